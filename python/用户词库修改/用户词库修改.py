@@ -6,9 +6,15 @@ MODS_FILE = 'D:/Rime/config/cn_dicts_user/modifications.txt'  # 修改规则文
 ADDS_FILE = 'D:/Rime/config/cn_dicts_user/additions.txt'      # 新增词条文件：定义需要添加的新词条
 DELETIONS_FILE = 'D:/Rime/config/cn_dicts_user/deletions.txt'  # 删除词条文件：定义需要删除的词条
 NEUTRAL_TONE_FILE = 'D:/Rime/config/cn_dicts_user/neutral_tone.txt'  # 轻声对应表：定义轻声与有声调的拼音对应关系
+WEIGHTS_FILE = 'D:/Rime/config/cn_dicts_user/weights.txt'  # 批量词频规则文件（可选）：按词库整体缩放、截断、对齐或提升词频，不存在时跳过
+USERDB_FILES = []  # 导入用户词频（可选）：Rime 同步目录下的用户词典快照，可用通配符，如 ['D:/Rime/sync/*/wanxiang_pro.userdb.txt']，为空时不导入
+USERDB_BLEND = 0.3  # 用户词频所占比重（0~1）：新词频 = 原词频 + 比重 ×（上屏次数 × USERDB_COUNT_WEIGHT − 原词频），只提高不降低
+USERDB_COUNT_WEIGHT = 1000  # 每次上屏折合的词频
 # 词库目录配置
 DICTS_FOLDER = 'D:/Rime/config/dicts/'  # Rime词库文件所在目录
 USER_EXTEND_FILE = 'chars.pro.dict.yaml'  # 用户扩展文件：所有新增词条将统一存储在此文件中,默认'chars.pro.dict.yaml',也可用packs拓展词库，请根据实际情况修改
+AUTO_FILL_AUX_CODE = True  # 自动补全辅助码：新增词条和多字词修改规则中只写了拼音的音节，按单字词库的辅助码补全
+AUX_CODE_SOURCE = 'chars.pro.dict.yaml'  # 补全辅助码所用的单字词库（词库目录下的文件名），单字修改规则优先于其中的辅助码
 EXCLUDE_FILES = [  # 排除文件列表：这些文件不会被处理
     'fuhao.pro.dict.yaml',     # 符号词库
     'en.dict.yaml',            # 英文词库
@@ -16,23 +22,74 @@ EXCLUDE_FILES = [  # 排除文件列表：这些文件不会被处理
     'cn&en.dict.yaml'          # 中英混合词库
 ]
 # 性能配置
+GLOBAL_ADD_DEDUP = True  # 新增词条跨词库去重：True=已存在于其他词库（汉字、拼音相同）的新增词条不再写入用户扩展文件，False=只与用户扩展文件去重
 USE_PARALLEL = True  # 是否启用并行处理：True=启用（推荐），False=禁用
 MAX_WORKERS = None   # 最大工作进程数：None=自动检测CPU核心数，可设置为具体数字（如4）
+EXECUTION_MODE = 'auto'  # 执行方式：'auto'=按词库大小自动选择，'sequential'=串行，'thread'=线程池，'process'=进程池，'pipeline'=读、处理、写流水线（词库在网络盘、同步盘等慢速存储上时使用）
+SCHEDULE_SERIAL_BYTES = 2 * 1024 * 1024  # 自动调度：待处理词库总大小低于此值时串行处理，省去启动并行的开销
+SCHEDULE_PROCESS_BYTES = 16 * 1024 * 1024  # 自动调度：总大小达到此值才用进程池，介于两者之间用线程池
+SCHEDULE_PACK_BYTES = 512 * 1024  # 小于此大小的词库打包成一个任务，由同一个工作者依次处理
+IO_ENGINE = 'mmap'   # 词库读写方式：'mmap'=按字节处理，未变化的行整段复制（保留原换行符）；'text'=按文本模式逐行读写
+EXTEND_SORT_MEMORY_MB = 256  # 用户扩展文件排序的内存预算（MB）：文件未排好序且超过预算时改用临时文件外部归并排序
+CHUNK_SIZE = 1024 * 1024  # 大文件分块大小（字节）：并行模式下超过该大小的词库会按行切块分给多个进程
+COMPACT_RULES_MIN = 100000  # 紧凑规则表：单字修改或删除规则达到此条数时，该规则表以紧凑格式交给进程池的每个工作进程（内存约为原来的几分之一，查找稍慢），None=不压缩
+PIPELINE_BLOCK_SIZE = 1024 * 1024  # 流水线模式每次读取、写出的块大小（字节）：逐行的小写入攒够这么多再一次写出
+PIPELINE_QUEUE_BLOCKS = 4  # 流水线模式读、写队列的容量（块数）：限制预读和待写数据占用的内存
+USE_RULE_CACHE = True  # 是否启用规则缓存：True=把解析、扩展后的规则保存到磁盘，规则文件未变化时直接加载
+RULE_CACHE_FILE = '.rules_cache.pickle'  # 规则缓存文件名（保存在修改规则文件所在目录）
+METRICS_FILE = None  # 运行指标输出路径（JSON Lines，每次运行追加），None=关闭；也可用 --metrics 参数指定
+WATCH_POLL_INTERVAL = 2.0  # 监视模式轮询间隔（秒），未安装 watchdog 时使用
+WATCH_DEBOUNCE = 1.0       # 监视模式防抖时间（秒）：连续变化在静默这么久之后合并为一批处理
+USE_REVERSE_INDEX = True  # 是否启用反向索引：规则文件只改了几行时，只重写含变化规则字的词条行，不再扫描全部词库
+REVERSE_INDEX_FILE = '.rule_index.pickle'  # 反向索引文件名（保存在词库目录下）
+INCREMENTAL = True   # 是否启用增量模式：True=跳过词库与规则均未变化的文件，False=每次全部重写
+MANIFEST_FILE = '.user_dict_manifest.json'  # 增量清单文件名（保存在词库目录下）
+WEIGHT_BASE_DIR = '.weight_base'  # 原始词频记录目录（保存在词库目录下，每个词库一个按词和拼音排序的文件）：词频规则和用户词频总是从原始词频计算，重复运行结果不变
+USERDB_IMPORT_FILE = '.userdb_import.txt'  # 用户词典按 (词, 拼音) 排序合并后的导入文件（保存在词库目录下），快照未变化时直接复用
+SNAPSHOT_FILE = '.dict_snapshot.bin'  # 词库快照文件名（保存在词库目录下）：query 命令直接查询快照，不再解析 YAML
 # ===========================================================================
 
 import os
+import posixpath
 import glob
+import shutil
 import sys
+import io
+import mmap
+import json
+import hashlib
+import zlib
+import pickle
+import heapq
+import itertools
+import collections
+import collections.abc
+import threading
+import bisect
+from array import array
+import tempfile
+import time
+import contextlib
 
 # 禁用字节码生成，减少磁盘I/O
 sys.dont_write_bytecode = True
 
+# 用户配置项名称（库接口和批量模式按这些名称覆盖配置）
+CONFIG_NAMES = tuple(name for name in list(globals()) if name.isupper())
+
 # 配置缓存
 _config_cache = {}
+# 库接口临时替换模块级配置时持有，保证同一时间只有一份配置生效
+_config_lock = threading.RLock()
 
 def load_neutral_tone_map():
-    """加载轻声对应表"""
+    """加载轻声对应表 - 带缓存"""
+    cache_key = 'neutral_tone_map'
+    if cache_key in _config_cache:
+        return _config_cache[cache_key]
+    
     neutral_tone_map = {}  # {(汉字, 轻声拼音): 有声调拼音}
+    _config_cache[cache_key] = neutral_tone_map
     
     if not os.path.exists(NEUTRAL_TONE_FILE):
         print(f"注意：未找到轻声对应表文件 {NEUTRAL_TONE_FILE}（跳过轻声处理）")
@@ -58,29 +115,143 @@ def load_neutral_tone_map():
         print(f"读取轻声对应表文件出错: {e}")
     
     return neutral_tone_map
+def build_neutral_tone_index(neutral_tone_map):
+    """按 (汉字, 有声调拼音) 建立轻声拼音索引"""
+    neutral_index = {}  # {(汉字, 有声调拼音): [轻声拼音, ...]}
+    for (hanzi, neutral_pinyin), tonal_pinyin in neutral_tone_map.items():
+        neutral_index.setdefault((hanzi, tonal_pinyin), []).append(neutral_pinyin)
+    return neutral_index
+
+def refresh_neutral_syllables(word, encoding, mods, neutral_tone_map):
+    """用单字规则为多字词编码中没有辅助码的轻声音节补上辅助码，已写出的辅助码保持不变"""
+    syllables = encoding.split()
+    if len(syllables) != len(word):
+        return encoding
+    
+    new_syllables = []
+    changed = False
+    for char, syllable in zip(word, syllables):
+        p, sep, c = syllable.partition(';')
+        mod_key = (char, p)
+        if not sep and mod_key in neutral_tone_map and mod_key in mods:
+            syllable = f"{p};{mods[mod_key][0]}"
+            changed = True
+        new_syllables.append(syllable)
+    
+    return ' '.join(new_syllables) if changed else encoding
+
 def expand_modifications_with_neutral_tone(mods, multi_mods, neutral_tone_map):
-    """使用轻声对应表扩展修改规则"""
+    """使用轻声对应表扩展修改规则（按索引单遍完成）"""
     expanded_mods = mods.copy()       # 扩展后的单字修改规则
-    expanded_multi_mods = multi_mods.copy()  # 扩展后的多字词修改规则
+    expanded_multi_mods = {}          # 扩展后的多字词修改规则
+    neutral_index = build_neutral_tone_index(neutral_tone_map)
     
-    # 处理单字修改规则
+    # 处理单字修改规则：每条规则只查一次索引
     neutral_added_count = 0
-    for (hanzi, pinyin), (code, freq) in mods.items():
-        # 检查这个拼音是否有对应的轻声版本
-        for (neutral_hanzi, neutral_pinyin), tonal_pinyin in neutral_tone_map.items():
-            if neutral_hanzi == hanzi and tonal_pinyin == pinyin:
-                # 添加轻声拼音的修改规则
-                expanded_mods[(hanzi, neutral_pinyin)] = (code, freq)
+    for (hanzi, pinyin), rule in mods.items():
+        for neutral_pinyin in neutral_index.get((hanzi, pinyin), ()):
+            neutral_key = (hanzi, neutral_pinyin)
+            # 显式写出的轻声规则优先，不被有声调规则覆盖
+            if neutral_key not in mods:
+                expanded_mods[neutral_key] = rule
                 neutral_added_count += 1
-                # print(f"添加轻声规则: {hanzi} {neutral_pinyin} -> {code}")
+                # print(f"添加轻声规则: {hanzi} {neutral_pinyin} -> {rule[0]}")
     
-    # 处理多字词修改规则（如果需要的话）
-    # 这里可以根据需要添加多字词的轻声处理逻辑
+    # 处理多字词修改规则：轻声音节按扩展后的单字规则刷新辅助码（如 妻子 qī zi）
+    # 词库中多字词内的轻声音节由 process_multi_char_line 直接命中扩展后的单字规则
+    for word, (encoding, freq) in multi_mods.items():
+        expanded_multi_mods[word] = (
+            refresh_neutral_syllables(word, encoding, expanded_mods, neutral_tone_map),
+            freq
+        )
     
     # print(f"轻声规则扩展完成: 新增 {neutral_added_count} 条轻声修改规则")
     return expanded_mods, expanded_multi_mods
 
 
+def get_aux_code_source_path():
+    """补全辅助码所用的单字词库路径"""
+    return os.path.join(DICTS_FOLDER, AUX_CODE_SOURCE)
+
+def build_aux_code_index(mods):
+    """建立 (汉字, 拼音) → 辅助码 的索引：取单字词库中词频最高的辅助码，再以单字修改规则覆盖"""
+    best = {}  # {(汉字, 拼音): (词频, 辅助码)}
+    source_path = get_aux_code_source_path()
+    if os.path.exists(source_path):
+        for word, syllables, weight in iter_dict_entries(source_path):
+            if len(word) != 1 or len(syllables) != 1 or not syllables[0][1]:
+                continue
+            key = (word, syllables[0][0])
+            if key not in best or weight > best[key][0]:
+                best[key] = (weight, syllables[0][1])
+    else:
+        print(f"注意：未找到单字词库 {AUX_CODE_SOURCE}，仅按单字修改规则补全辅助码")
+    index = {key: code for key, (_, code) in best.items()}
+    index.update((key, code) for key, (code, _) in mods.items() if code)
+    return index
+
+def needs_aux_codes(word, encoding):
+    """编码的音节与字一一对应，且有音节没写辅助码"""
+    syllables = encoding.split()
+    return len(syllables) == len(word) and not all(';' in syllable for syllable in syllables)
+
+def fill_encoding_aux_codes(word, encoding, index, neutral_tone_map):
+    """给编码中没有辅助码的音节补上辅助码（轻声音节按有声调读音查找），查不到的音节保持原样"""
+    if not needs_aux_codes(word, encoding):
+        return encoding
+    filled = []
+    for char, syllable in zip(word, encoding.split()):
+        if ';' not in syllable:
+            code = index.get((char, syllable))
+            if code is None and (char, syllable) in neutral_tone_map:
+                code = index.get((char, neutral_tone_map[(char, syllable)]))
+            if code is not None:
+                syllable = f"{syllable};{code}"
+        filled.append(syllable)
+    return ' '.join(filled)
+
+def fill_missing_aux_codes(adds, multi_mods, mods, neutral_tone_map):
+    """一遍补全新增词条和多字词修改规则中缺少的辅助码，每个音节只查一次索引
+    
+    索引在遇到第一个缺辅助码的规则时才建立：规则都写全了辅助码时不读取单字词库
+    """
+    index = None
+    
+    def fill(word, encoding):
+        nonlocal index
+        if not needs_aux_codes(word, encoding):
+            return encoding
+        if index is None:
+            index = build_aux_code_index(mods)
+        return fill_encoding_aux_codes(word, encoding, index, neutral_tone_map)
+    
+    filled_adds = []
+    filled_count = 0
+    for hanzi, encoding, freq in adds:
+        new_encoding = fill(hanzi, encoding)
+        filled_count += new_encoding != encoding
+        filled_adds.append((hanzi, new_encoding, freq))
+    filled_multi_mods = {}
+    for word, (encoding, freq) in multi_mods.items():
+        # 模式规则的编码对应的是片段而不是整个词条，不补全
+        new_encoding = encoding if '*' in word else fill(word, encoding)
+        filled_count += new_encoding != encoding
+        filled_multi_mods[word] = (new_encoding, freq)
+    if filled_count:
+        print(f"自动补全辅助码: {filled_count} 条新增词条或多字词规则")
+    return filled_adds, filled_multi_mods
+
+def fill_rules_aux_codes(rules):
+    """按当前词库目录的单字词库补全规则中缺少的辅助码
+    
+    不写入规则缓存：单字词库每次运行都可能被改写，已解析的规则也可能被多个词库目录共用
+    """
+    if not AUTO_FILL_AUX_CODE:
+        return rules
+    mods, multi_mods, adds, deletions = rules
+    adds, multi_mods = fill_missing_aux_codes(adds, multi_mods, mods, load_neutral_tone_map())
+    return mods, multi_mods, adds, deletions
+
 def load_modifications():
     """加载修改规则（支持单字和多字词）- 带缓存"""
     cache_key = 'modifications'
@@ -108,8 +279,15 @@ def load_modifications():
                     encoding = parts[1]
                     freq = parts[2] if len(parts) >= 3 else ""
                     
+                    # 模式规则（词条字段含 *）与多字词规则存放在一起，由 compile_pattern_rules 编译
+                    if '*' in hanzi:
+                        if is_valid_pattern_rule(hanzi, encoding):
+                            multi_mods[hanzi] = (encoding, freq)
+                        else:
+                            print(f"修改规则第 {line_num} 行的模式无效，已跳过: {line}")
+                    
                     # 处理单字规则
-                    if len(hanzi) == 1:
+                    elif len(hanzi) == 1:
                         if ';' in encoding:
                             pinyin, code = encoding.split(';', 1)
                             mods[(hanzi, pinyin)] = (code, freq)
@@ -168,7 +346,7 @@ def load_deletions():
         
     try:
         with open(DELETIONS_FILE, 'r', encoding='utf-8') as f:
-            for line in f:
+            for line_num, line in enumerate(f, 1):
                 line = line.strip()
                 if not line or line.startswith('#'):
                     continue
@@ -177,6 +355,10 @@ def load_deletions():
                     hanzi = parts[0]
                     encoding = parts[1]
                     
+                    if '*' in hanzi and not is_valid_pattern_rule(hanzi, encoding, deletion=True):
+                        print(f"删除规则第 {line_num} 行的模式无效，已跳过: {line}")
+                        continue
+                    
                     # 提取拼音部分
                     pinyin_part = extract_pinyin_part(encoding)
                     if pinyin_part:
@@ -215,8 +397,8 @@ def should_process_entry(hanzi, encoding, deletions):
     pinyin_part = extract_pinyin_part(encoding)
     return (hanzi, pinyin_part) not in deletions
 
-def process_single_line(line, mods, multi_mods, deletions):
-    """处理单行词条"""
+def process_single_line(line, mods, multi_mods, deletions, metrics=None):
+    """处理单行词条（metrics 不为 None 时累计各类规则命中次数）"""
     line = line.rstrip('\n')
     
     # 保留元数据行
@@ -230,10 +412,24 @@ def process_single_line(line, mods, multi_mods, deletions):
         
         # 检查是否需要删除
         if not should_process_entry(hanzi, encoding, deletions):
+            if metrics is not None:
+                metrics['hits']['deletion'] += 1
             return None  # 标记为删除
         
+        # 模式规则：命中删除模式即删除；修改模式改写命中片段的辅助码和词频，之后精确规则仍然优先
+        patterns = get_pattern_rules(multi_mods, deletions)
+        if patterns is not None:
+            pattern_result = apply_pattern_rules(patterns, hanzi, encoding, freq, metrics)
+            if pattern_result is None:
+                return None
+            if pattern_result != (encoding, freq):
+                encoding, freq = pattern_result
+                line = f"{hanzi}\t{encoding}\t{freq}"
+        
         # 处理多字词修改规则
         if len(hanzi) > 1 and hanzi in multi_mods:
+            if metrics is not None:
+                metrics['hits']['multi_mod'] += 1
             new_encoding, new_freq = multi_mods[hanzi]
             if not new_freq.strip():
                 new_freq = freq
@@ -243,29 +439,38 @@ def process_single_line(line, mods, multi_mods, deletions):
         if len(hanzi) == 1:
             if ';' in encoding:
                 p, c = encoding.split(';', 1)
-                mod_key = (hanzi, p)
-                if mod_key in mods:
-                    new_code, new_freq = mods[mod_key]
+                rule = mods.get((hanzi, p))
+                if rule is not None:
+                    if metrics is not None:
+                        metrics['hits']['single_mod'] += 1
+                    new_code, new_freq = rule
                     if not new_freq.strip():
                         new_freq = freq
                     return f"{hanzi}\t{p};{new_code}\t{new_freq}"
             else:
                 # 处理没有形码的单字条目
                 p = encoding
-                mod_key = (hanzi, p)
-                if mod_key in mods:
-                    new_code, new_freq = mods[mod_key]
+                rule = mods.get((hanzi, p))
+                if rule is not None:
+                    if metrics is not None:
+                        metrics['hits']['single_mod'] += 1
+                    new_code, new_freq = rule
                     if not new_freq.strip():
                         new_freq = freq
                     return f"{hanzi}\t{p};{new_code}\t{new_freq}"
         
         # 处理多字词中的单字修改（逐字检查）
         elif len(hanzi) > 1:
-            return process_multi_char_line(hanzi, encoding, freq, mods)
+            if metrics is None:
+                return process_multi_char_line(hanzi, encoding, freq, mods)
+            start_time = time.perf_counter()
+            result = process_multi_char_line(hanzi, encoding, freq, mods, metrics)
+            metrics['stages']['process_multi_char_line'] += time.perf_counter() - start_time
+            return result
     
     return line
 
-def process_multi_char_line(hanzi, encoding, freq, mods):
+def process_multi_char_line(hanzi, encoding, freq, mods, metrics=None):
     """处理多字词中的单字修改"""
     enc_parts = []
     modified = False
@@ -281,9 +486,11 @@ def process_multi_char_line(hanzi, encoding, freq, mods):
     # 检查每个字是否需要修改
     new_enc_parts = []
     for char, (p, c) in zip(hanzi, enc_parts):
-        mod_key = (char, p)
-        if mod_key in mods:
-            new_code, _ = mods[mod_key]  # 多字词中的单字修改只改形码，不改词频
+        rule = mods.get((char, p))
+        if rule is not None:
+            if metrics is not None:
+                metrics['hits']['char_in_word'] += 1
+            new_code, _ = rule  # 多字词中的单字修改只改形码，不改词频
             new_enc_parts.append(f"{p};{new_code}")
             modified = True
         else:
@@ -295,17 +502,167 @@ def process_multi_char_line(hanzi, encoding, freq, mods):
     
     return f"{hanzi}\t{encoding}\t{freq}"
 
+# ==================== 模式规则 ====================
+
+# 已编译的模式规则：(id(multi_mods), id(deletions)) → (multi_mods, deletions, 编译结果)
+_pattern_rules_cache = {}
+
+def parse_word_pattern(word):
+    """解析词条字段中的模式：'X*' 以 X 开头，'*X' 以 X 结尾，'*X*' 含有 X，返回 (X, 锚定方式)；不是合法模式时返回 None"""
+    fragment = word.strip('*')
+    if not fragment or '*' in fragment:
+        return None
+    anchors = {f'{fragment}*': 'prefix', f'*{fragment}': 'suffix', f'*{fragment}*': 'contains'}
+    return (fragment, anchors[word]) if word in anchors else None
+
+def is_valid_pattern_rule(word, encoding, deletion=False):
+    """检查模式规则：编码按音节对应片段 X 的每个字
+    
+    删除规则的拼音可写 *（任意拼音）或以 * 结尾（拼音前缀）；修改规则必须写出完整拼音，可带辅助码
+    """
+    parsed = parse_word_pattern(word)
+    if parsed is None:
+        return False
+    pinyin = extract_pinyin_part(encoding)
+    if deletion and pinyin.endswith('*'):
+        return '*' not in pinyin[:-1]
+    return '*' not in encoding and len(pinyin.split()) == len(parsed[0])
+
+def compile_pattern_rules(multi_mods, deletions):
+    """把模式规则编译为一个多模式自动机：片段用 Aho-Corasick 自动机匹配，
+    每个片段按锚定方式各有一棵拼音字典树，逐字匹配命中片段对应音节的拼音
+    
+    每行的匹配开销只与词条长度有关，与模式规则的条数无关。没有模式规则时返回 None
+    """
+    fragments = {}  # 片段 → {锚定方式: 拼音字典树}，树节点为 [子节点, 拼音完全相同的规则, 拼音前缀命中的规则]
+    actions = []    # 规则编号 → None（删除）或 (各音节的新辅助码, 新词频)
+    
+    def add_rule(word, pinyin, action):
+        parsed = parse_word_pattern(word)
+        if parsed is None:
+            return  # 不合法的模式（如旧版本缓存中未经校验的规则）不参与匹配
+        fragment, anchor = parsed
+        node = fragments.setdefault(fragment, {}).setdefault(anchor, [{}, [], []])
+        prefix = pinyin.endswith('*')
+        for char in pinyin.rstrip('*'):
+            node = node[0].setdefault(char, [{}, [], []])
+        (node[2] if prefix else node[1]).append(len(actions))
+        actions.append(action)
+    
+    # 删除规则先编号：命中的规则按编号排序后，删除总排在修改之前
+    for hanzi, pinyin in sorted(key for key in deletions if '*' in key[0]):
+        add_rule(hanzi, pinyin, None)
+    for word, (encoding, freq) in multi_mods.items():
+        if '*' in word:
+            syllables = [syllable.partition(';') for syllable in encoding.split()]
+            add_rule(word, ' '.join(p for p, _, _ in syllables),
+                     (tuple(code if sep else None for _, sep, code in syllables), freq))
+    if not actions:
+        return None
+    
+    # Aho-Corasick：goto 为转移表，fail 为失配跳转，output 为在该状态结束的片段（含失配链上的）
+    goto, fail, output = [{}], [0], [[]]
+    for fragment in fragments:
+        state = 0
+        for char in fragment:
+            if char not in goto[state]:
+                goto[state][char] = len(goto)
+                goto.append({})
+                fail.append(0)
+                output.append([])
+            state = goto[state][char]
+        output[state].append(fragment)
+    queue = collections.deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char, child in goto[state].items():
+            queue.append(child)
+            fallback = fail[state]
+            while fallback and char not in goto[fallback]:
+                fallback = fail[fallback]
+            fail[child] = goto[fallback].get(char, 0)
+            output[child] = output[child] + output[fail[child]]
+    return {'goto': goto, 'fail': fail, 'output': output, 'fragments': fragments, 'actions': actions}
+
+def get_pattern_rules(multi_mods, deletions):
+    """取出规则中的模式规则（每组规则只编译一次），没有模式规则时返回 None"""
+    key = (id(multi_mods), id(deletions))
+    cached = _pattern_rules_cache.get(key)
+    if cached is None:
+        if len(_pattern_rules_cache) >= 8:
+            _pattern_rules_cache.clear()
+        # 保留规则本身的引用，保证缓存期间 id 不会被其他对象复用
+        cached = _pattern_rules_cache[key] = (multi_mods, deletions, compile_pattern_rules(multi_mods, deletions))
+    return cached[2]
+
+def match_pinyin_trie(trie, pinyin):
+    """在拼音字典树中查找命中的规则编号；pinyin 为 None（音节与字数对不上）时只命中任意拼音的规则"""
+    rule_ids = list(trie[2])
+    if pinyin is None:
+        return rule_ids
+    node = trie
+    for char in pinyin:
+        node = node[0].get(char)
+        if node is None:
+            return rule_ids
+        rule_ids.extend(node[2])
+    rule_ids.extend(node[1])
+    return rule_ids
+
+def apply_pattern_rules(patterns, hanzi, encoding, freq, metrics=None):
+    """按模式规则处理一个词条，返回 None（删除）或 (编码, 词频)"""
+    goto, fail, output = patterns['goto'], patterns['fail'], patterns['output']
+    syllables = encoding.split()
+    pinyins = [syllable.partition(';')[0] for syllable in syllables] if len(syllables) == len(hanzi) else None
+    hits = []
+    state = 0
+    for end, char in enumerate(hanzi, 1):
+        while state and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        for fragment in output[state]:
+            start = end - len(fragment)
+            for anchor, trie in patterns['fragments'][fragment].items():
+                if (anchor == 'prefix' and start) or (anchor == 'suffix' and end != len(hanzi)):
+                    continue
+                pinyin = ' '.join(pinyins[start:end]) if pinyins else None
+                hits.extend((rule_id, start) for rule_id in match_pinyin_trie(trie, pinyin))
+    if not hits:
+        return encoding, freq
+    
+    if metrics is not None:
+        metrics['hits']['pattern'] += 1
+    hits.sort()
+    actions = patterns['actions']
+    if actions[hits[0][0]] is None:
+        return None
+    # 修改规则按书写顺序依次生效（修改规则要求拼音完整，命中时音节必然与字数对应）
+    for rule_id, start in hits:
+        codes, new_freq = actions[rule_id]
+        for offset, code in enumerate(codes):
+            if code is not None:
+                syllables[start + offset] = f"{pinyins[start + offset]};{code}"
+        if new_freq.strip():
+            freq = new_freq
+    return ' '.join(syllables), freq
+
+def entry_sort_key(entry):
+    """词条排序键：先按词条长度（字数），再按词条内容"""
+    return (len(entry[0]), entry[0])
+
 def sort_entries(entries):
     """对词条进行排序：先按词条长度（字数），再按词条内容"""
-    return sorted(entries, key=lambda x: (len(x[0]), x[0]))
+    return sorted(entries, key=entry_sort_key)
 
-def get_dict_files():
+def get_dict_files(create_missing=True):
     """获取目录下所有的词库文件（排除指定文件）"""
     pattern = os.path.join(DICTS_FOLDER, '*.yaml')
     
-    # 确保USER_EXTEND_FILE存在
+    # 确保USER_EXTEND_FILE存在（预演模式不创建，仅把它列入待预览文件）
     user_extend_path = os.path.join(DICTS_FOLDER, USER_EXTEND_FILE)
-    if not os.path.exists(user_extend_path):
+    if not os.path.exists(user_extend_path) and not create_missing:
+        print(f"注意：{USER_EXTEND_FILE} 不存在，实际运行时将创建新文件")
+    elif not os.path.exists(user_extend_path):
         print(f"注意：{USER_EXTEND_FILE} 不存在，将创建新文件")
         # 从文件名中提取name（去掉.dict.yaml后缀）
         dict_name = USER_EXTEND_FILE.replace('.dict.yaml', '')
@@ -322,6 +679,8 @@ sort: by_weight
     
     # 获取所有yaml文件（包括新创建的user_extend.dict.yaml）
     dict_files = glob.glob(pattern)
+    if not os.path.exists(user_extend_path):
+        dict_files.append(user_extend_path)
     
     # 过滤掉排除的文件
     filtered_files = []
@@ -334,139 +693,668 @@ sort: by_weight
     
     return filtered_files
 
-def process_single_dict_file(args):
-    """处理单个词库文件 - 用于并行处理"""
-    file_path, mods, multi_mods, adds, deletions = args
-    filename = os.path.basename(file_path)
+# ==================== 运行指标（可选） ====================
+
+# 是否采集运行指标（主进程由 main_optimized 设置，工作进程由 init_worker_rules 设置）
+_metrics_enabled = False
+
+def get_peak_rss_kb():
+    """当前进程的峰值常驻内存（KB），平台不支持时返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def new_file_metrics(file_path):
+    """创建单个文件（或文件块）的指标记录"""
+    return {
+        'file': os.path.basename(file_path),
+        'bytes': 0,
+        'lines': 0,
+        'stages': {'read': 0.0, 'process_single_line': 0.0, 'process_multi_char_line': 0.0,
+                   'write': 0.0, 'sort': 0.0, 'replace': 0.0},
+        'hits': {'deletion': 0, 'multi_mod': 0, 'single_mod': 0, 'char_in_word': 0, 'pattern': 0, 'prefiltered': 0},
+        'tasks': [{'pid': os.getpid(), 'thread': threading.get_ident(), 'start': time.time()}]
+    }
+
+def finish_task_metrics(metrics):
+    """记录任务结束时间和所在进程的峰值内存"""
+    task = metrics['tasks'][-1]
+    task['end'] = time.time()
+    task['peak_rss_kb'] = get_peak_rss_kb()
+
+def merge_metrics(target, source):
+    """把文件块的指标累加到整个文件的指标上"""
+    target['lines'] += source['lines']
+    for group in ('stages', 'hits'):
+        for key, value in source[group].items():
+            target[group][key] += value
+    target['tasks'].extend(source['tasks'])
+
+def timed_lines(f, metrics):
+    """逐行读取并累计读取耗时"""
+    lines = iter(f)
+    while True:
+        start_time = time.perf_counter()
+        line = next(lines, None)
+        metrics['stages']['read'] += time.perf_counter() - start_time
+        if line is None:
+            return
+        yield line
+
+def timed_writer(write, metrics):
+    """包装写入函数并累计写入耗时"""
+    def timed_write(text):
+        start_time = time.perf_counter()
+        write(text)
+        metrics['stages']['write'] += time.perf_counter() - start_time
+    return timed_write
+
+def build_metrics_report(results, mode, wall):
+    """汇总各文件指标，计算各工作进程的利用率"""
+    files = [result['metrics'] for result in results if result.get('metrics')]
+    busy = {}
+    for metrics in files:
+        for task in metrics['tasks']:
+            if 'end' in task:
+                # 线程池模式下所有工作者同属一个进程，按线程区分
+                worker = f"{task['pid']}/{task.get('thread')}" if mode == 'thread' else task['pid']
+                busy[worker] = busy.get(worker, 0.0) + task['end'] - task['start']
     
-    temp_file = file_path + '.tmp'
-    is_user_extend_file = (filename == USER_EXTEND_FILE)
+    totals = {'bytes': 0, 'lines': 0, 'stages': {}, 'hits': {}}
+    for metrics in files:
+        totals['bytes'] += metrics['bytes']
+        totals['lines'] += metrics['lines']
+        for group in ('stages', 'hits'):
+            for key, value in metrics[group].items():
+                totals[group][key] = totals[group].get(key, 0) + value
     
-    modified_count = 0
-    multi_modified_count = 0
-    deleted_count = 0
+    peak_children = None
+    try:
+        import resource
+        peak_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        if sys.platform == 'darwin':
+            peak_children //= 1024
+    except ImportError:
+        pass
     
+    worker_count = len(busy)
+    return {
+        'type': 'run',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'mode': mode,
+        'wall': wall,
+        'workers': worker_count,
+        'worker_busy': {str(pid): seconds for pid, seconds in busy.items()},
+        'utilisation': sum(busy.values()) / (wall * worker_count) if wall and worker_count else None,
+        'peak_rss_kb': get_peak_rss_kb(),
+        'peak_rss_children_kb': peak_children,
+        'totals': totals
+    }
+
+def write_metrics_report(path, results, run_summary):
+    """以 JSON Lines 追加写入：每个文件一行，最后一行为本次运行汇总"""
     try:
-        # 第一遍：收集已存在的词条（只记录汉字和编码）
-        existing_entries = set()
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line or line.startswith('#') or line in ('---', '...'):
-                        continue
-                    parts = line.split('\t')
-                    if len(parts) >= 2:
-                        hanzi = parts[0]
-                        encoding = parts[1]
-                        existing_entries.add((hanzi, encoding))
+        with open(path, 'a', encoding='utf-8') as f:
+            for result in results:
+                if result.get('metrics'):
+                    record = dict(result['metrics'], type='file', timings=result.get('timings'))
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.write(json.dumps(run_summary, ensure_ascii=False) + '\n')
+        print(f"运行指标已写入 {path}")
+    except Exception as e:
+        print(f"写入运行指标出错: {e}")
+
+# ========================================================
+
+def build_rule_char_set(mods, multi_mods, deletions):
+    """收集所有规则涉及的汉字，词条中不含这些字的行不可能被任何规则命中"""
+    rule_chars = {hanzi for hanzi, _ in mods}
+    for word in multi_mods:
+        rule_chars.update(word)
+    for hanzi, _ in deletions:
+        rule_chars.update(hanzi)
+    return frozenset(rule_chars)
+
+def apply_rules_to_line(line, mods, multi_mods, deletions, stats, metrics=None, rule_chars=None):
+    """处理一行词条并累计修改/删除统计，返回处理后的行（None 表示删除）
+    
+    传入 rule_chars 时先做字符预筛：汉字字段不含任何规则字的行原样返回，跳过拆分和重组
+    """
+    if rule_chars is not None and rule_chars.isdisjoint(line.partition('\t')[0]):
+        if metrics is not None:
+            metrics['lines'] += 1
+            metrics['hits']['prefiltered'] += 1
+        return line
+    
+    if metrics is None:
+        processed_line = process_single_line(line, mods, multi_mods, deletions)
+    else:
+        start_time = time.perf_counter()
+        processed_line = process_single_line(line, mods, multi_mods, deletions, metrics)
+        metrics['stages']['process_single_line'] += time.perf_counter() - start_time
+        metrics['lines'] += 1
+    
+    if processed_line is None:
+        stats['deleted'] += 1
+        return None
+    
+    # 统计修改数量
+    if processed_line != line and not processed_line.startswith('#'):
+        if len(processed_line.split('\t')[0]) > 1:
+            stats['multi_modified'] += 1
+        else:
+            stats['modified'] += 1
+    
+    return processed_line
+
+def prepare_new_entries(adds, mods, multi_mods, deletions):
+    """预处理新增词条：应用删除和修改规则，按排序键稳定排序
+    
+    返回 [(原始键, 处理后词条), ...]，去重需要结合词库内容，由 accept_new_entries 完成
+    """
+    candidates = []
+    for hanzi, encoding, freq in adds:
+        if not should_process_entry(hanzi, encoding, deletions):
+            continue
         
-        # 第二遍：处理文件
-        with open(file_path, 'r', encoding='utf-8') as fin, \
-             open(temp_file, 'w', encoding='utf-8') as fout:
+        # 对新增词条应用修改规则
+        processed_entry = process_single_line(f"{hanzi}\t{encoding}\t{freq}", mods, multi_mods, deletions)
+        
+        # 如果词条被删除，跳过
+        if processed_entry is None:
+            continue
+        
+        # 解析处理后的词条
+        parts = processed_entry.split('\t')
+        if len(parts) >= 2:
+            processed_freq = parts[2] if len(parts) >= 3 else freq
+            candidates.append(((hanzi, encoding), [parts[0], parts[1], processed_freq]))
+    
+    # 同一词条的多个新增项保持文件中的先后顺序
+    candidates.sort(key=lambda candidate: entry_sort_key(candidate[1]))
+    return candidates
+
+def get_addition_keys(original_key, entry):
+    """新增词条跨词库查重用的键：原始和处理后的 (汉字, 拼音)，不含辅助码"""
+    return {(original_key[0], extract_pinyin_part(original_key[1])), (entry[0], extract_pinyin_part(entry[1]))}
+
+def build_addition_probe(adds, mods, multi_mods, deletions):
+    """新增词条的跨词库查重表（汉字 → 拼音集合），未开启跨词库去重或没有新增词条时为 None
+    
+    只记录新增词条本身，内存占用与词库规模无关
+    """
+    if not GLOBAL_ADD_DEDUP or not adds:
+        return None
+    probe = {}
+    for original_key, entry in prepare_new_entries(adds, mods, multi_mods, deletions):
+        for hanzi, pinyin in get_addition_keys(original_key, entry):
+            probe.setdefault(hanzi, set()).add(pinyin)
+    return probe or None
+
+def record_addition_duplicate(probe, line, found):
+    """词条与某个新增词条的汉字、拼音都相同时，把 (汉字, 拼音) 记入 found"""
+    parts = line.rstrip('\r\n').split('\t')
+    if len(parts) >= 2:
+        pinyin = extract_pinyin_part(parts[1])
+        if pinyin in probe.get(parts[0], ()):
+            found.add((parts[0], pinyin))
+
+def exclude_addition_duplicates(candidates, duplicates):
+    """去掉已存在于其他词库的新增词条，返回 (保留的, 跳过的)"""
+    if not duplicates:
+        return candidates, []
+    kept = []
+    skipped = []
+    for original_key, entry in candidates:
+        if get_addition_keys(original_key, entry).isdisjoint(duplicates):
+            kept.append((original_key, entry))
+        else:
+            skipped.append(entry)
+    return kept, skipped
+
+def collect_addition_duplicates(results, manifest=None, skipped_files=()):
+    """汇总其他词库中与新增词条重复的键：本次处理的文件取结果，跳过的文件取增量清单中的记录"""
+    duplicates = set()
+    for result in results:
+        duplicates.update(map(tuple, result.get('adds_found', ())))
+    if manifest is not None:
+        for file_path in skipped_files:
+            entry = manifest['files'].get(os.path.basename(file_path)) or {}
+            duplicates.update(map(tuple, entry.get('adds_found', ())))
+    return duplicates
+
+def split_user_extend_file(dict_files):
+    """把用户扩展文件从文件列表中分出来：它要等其他词库查重完成后才能处理"""
+    others = [path for path in dict_files if os.path.basename(path) != USER_EXTEND_FILE]
+    extend_files = [path for path in dict_files if os.path.basename(path) == USER_EXTEND_FILE]
+    return others, extend_files
+
+def accept_new_entries(candidates, existing_entries):
+    """新增词条去重：原始键或处理后的键已存在则跳过，返回实际新增的词条"""
+    new_entries = []
+    for original_key, entry in candidates:
+        # 检查是否已存在（去重）
+        if original_key in existing_entries:
+            continue
+        
+        # 再次检查去重（处理后的词条可能已存在）
+        processed_key = (entry[0], entry[1])
+        if processed_key not in existing_entries:
+            new_entries.append(entry)
+            existing_entries.add(processed_key)
+    
+    return new_entries
+
+def files_identical(path_a, path_b, block_size=1 << 20):
+    """逐块比较两个文件内容是否完全一致"""
+    if os.path.getsize(path_a) != os.path.getsize(path_b):
+        return False
+    with open(path_a, 'rb') as fa, open(path_b, 'rb') as fb:
+        while True:
+            block_a = fa.read(block_size)
+            if block_a != fb.read(block_size):
+                return False
+            if not block_a:
+                return True
+
+def commit_temp_file(temp_file, file_path, has_changes):
+    """用临时文件替换原文件；内容完全相同时丢弃临时文件，返回是否实际写入"""
+    # 没有任何词条改动时仍可能有换行符等差异，需按字节确认
+    if not has_changes and os.path.exists(file_path) and files_identical(temp_file, file_path):
+        os.remove(temp_file)
+        return False
+    os.replace(temp_file, file_path)
+    return True
+
+def uses_byte_engine(file_path, is_user_extend_file):
+    """判断文件是否走字节引擎（用户扩展文件需要整体排序，仍按文本处理；空文件无法 mmap）"""
+    return IO_ENGINE == 'mmap' and not is_user_extend_file and os.path.getsize(file_path) > 0
+
+def find_body_start(buf):
+    """定位元数据结束行（...）之后的字节偏移，没有元数据结束行时返回 None"""
+    pos = 0
+    size = len(buf)
+    while pos < size:
+        newline = buf.find(b'\n', pos)
+        line_end = size if newline < 0 else newline + 1
+        if buf[pos:line_end].rstrip(b'\r\n') == b'...':
+            return line_end
+        pos = line_end
+    return None
+
+def apply_rules_to_raw_line(raw, mods, multi_mods, deletions, stats, metrics=None):
+    """处理一行原始字节（含换行符），未变化时返回 raw 本身，删除时返回 b''"""
+    # 拆出行尾换行符，改动后的行沿用原来的换行符
+    content_end = len(raw)
+    if raw.endswith(b'\r\n'):
+        content_end -= 2
+    elif raw.endswith(b'\n'):
+        content_end -= 1
+    line = raw[:content_end].decode('utf-8')
+    
+    processed_line = apply_rules_to_line(line, mods, multi_mods, deletions, stats, metrics)
+    if processed_line == line:
+        return raw
+    if processed_line is None:
+        return b''
+    return processed_line.encode('utf-8') + raw[content_end:]
+
+def transform_byte_range(buf, start, end, write, mods, multi_mods, deletions, stats, metrics, rule_chars,
+                         probe=None, found=None):
+    """按字节处理 [start, end) 内的词条行
+    
+    只解码汉字字段做预筛，命中规则字的行才整行解码；未变化的连续行作为一段字节切片整体写出。
+    传入 probe 时顺带把与新增词条重复的词条记入 found。buf 为 mmap 或 io.BytesIO（流水线模式的一块数据）
+    """
+    view = buf.getbuffer() if isinstance(buf, io.BytesIO) else memoryview(buf)
+    try:
+        buf.seek(start)
+        readline = buf.readline
+        run_start = pos = start
+        while pos < end:
+            raw = readline()
+            line_end = pos + len(raw)
+            hanzi = raw.partition(b'\t')[0].decode('utf-8')
             
-            # 处理现有内容
-            entries_to_sort = []  # 用于收集需要排序的词条（仅USER_EXTEND_FILE使用）
-            in_metadata = True   # 标记是否在元数据部分
+            if rule_chars.isdisjoint(hanzi):
+                if metrics is not None:
+                    metrics['lines'] += 1
+                    metrics['hits']['prefiltered'] += 1
+                if probe and hanzi in probe:
+                    record_addition_duplicate(probe, raw.decode('utf-8'), found)
+                pos = line_end
+                continue
             
-            for line in fin:
-                processed_line = line.rstrip('\n')
-                
-                # 检查是否结束元数据部分
-                if in_metadata and processed_line == '...':
-                    in_metadata = False
-                    fout.write(processed_line + '\n')
-                    continue
-                
-                # 元数据行直接写入
-                if in_metadata:
-                    fout.write(processed_line + '\n')
-                    continue
-                
-                # 处理词条行
-                processed_line = process_single_line(processed_line, mods, multi_mods, deletions)
-                
-                if processed_line is None:
-                    deleted_count += 1
-                    continue
-                
-                # 统计修改数量
-                original_line = line.rstrip('\n')
-                if processed_line != original_line and not processed_line.startswith('#'):
-                    if len(processed_line.split('\t')[0]) > 1:
-                        multi_modified_count += 1
-                    else:
-                        modified_count += 1
+            processed_raw = apply_rules_to_raw_line(raw, mods, multi_mods, deletions, stats, metrics)
+            if probe and hanzi in probe and processed_raw:
+                record_addition_duplicate(probe, processed_raw.decode('utf-8'), found)
+            if processed_raw is not raw:
+                write(view[run_start:pos])
+                write(processed_raw)
+                run_start = line_end
+            pos = line_end
+        
+        if run_start < end:
+            write(view[run_start:end])
+    finally:
+        view.release()
+
+def rewrite_dict_file_bytes(file_path, temp_file, mods, multi_mods, deletions, stats, metrics, rule_chars,
+                            probe=None, found=None, weigher=None):
+    """字节引擎：mmap 读取整个文件，元数据原样复制，正文交给 transform_byte_range（weigher 给出时写出前调整词频）"""
+    with open(file_path, 'rb') as fin, open(temp_file, 'wb') as fout:
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            size = len(buf)
+            body_start = find_body_start(buf)
+            if body_start is None:
+                body_start = size
+            write = fout.write if metrics is None else timed_writer(fout.write, metrics)
+            write, flush = weighing_writer(write, weigher)
+            with memoryview(buf) as view:
+                write(view[:body_start])
+            transform_byte_range(buf, body_start, size, write, mods, multi_mods, deletions,
+                                 stats, metrics, rule_chars, probe, found)
+            flush()
+
+class ExtendFileNotSorted(Exception):
+    """用户扩展文件不是按排序键有序的，不能走流式归并"""
+
+def iter_extend_entries(fin, write, mods, multi_mods, deletions, stats, metrics, rule_chars):
+    """逐行读取用户扩展文件：元数据原样写出，正文产出 (原始键, 处理后字段)，被删除的词条字段为 None"""
+    in_metadata = True
+    for line in fin:
+        line = line.rstrip('\n')
+        
+        # 元数据行直接写入
+        if in_metadata:
+            write(line + '\n')
+            if line == '...':
+                in_metadata = False
+            continue
+        
+        # 不足两列的行（注释、空行）不是词条，排序后的文件中不保留
+        original_parts = line.split('\t')
+        if len(original_parts) < 2:
+            continue
+        
+        processed_line = apply_rules_to_line(line, mods, multi_mods, deletions, stats, metrics, rule_chars)
+        parts = None if processed_line is None else processed_line.split('\t')
+        yield (original_parts[0], original_parts[1]), parts
+
+def merge_into_sorted_extend_file(entries, candidates, write):
+    """流式归并：文件已有序时，把排好序的新增词条按位置插入，只需读一遍、不整体排序
+    
+    同一词条的已有项都相邻，去重只需比较当前词条组；发现乱序时抛出 ExtendFileNotSorted
+    """
+    added_count = 0
+    next_candidate = 0
+    group_key = None       # 当前词条组的排序键
+    group_entries = set()  # 当前词条组已有的（汉字, 编码），含将被删除的词条
+    
+    def emit_candidates(limit_key, inclusive, group_key=None, group_entries=frozenset()):
+        """写出排序键小于（inclusive 时不大于）limit_key 的新增词条，属于当前词条组的先与组内已有项去重"""
+        nonlocal next_candidate, added_count
+        while next_candidate < len(candidates):
+            key = entry_sort_key(candidates[next_candidate][1])
+            if key > limit_key or (key == limit_key and not inclusive):
+                break
+            # 取出同一排序键的全部新增项，逐组去重
+            group_end = next_candidate
+            while group_end < len(candidates) and entry_sort_key(candidates[group_end][1]) == key:
+                group_end += 1
+            existing = set(group_entries) if key == group_key else set()
+            for entry in accept_new_entries(candidates[next_candidate:group_end], existing):
+                write('\t'.join(entry) + '\n')
+                added_count += 1
+            next_candidate = group_end
+    
+    for original_key, parts in entries:
+        key = (len(original_key[0]), original_key[0])
+        if key != group_key:
+            if group_key is not None:
+                if key < group_key:
+                    raise ExtendFileNotSorted()
+                # 上一组结束：写出属于上一组的新增词条
+                emit_candidates(group_key, True, group_key, group_entries)
+            # 新一组开始前：写出排在它之前、文件中没有的新增词条
+            emit_candidates(key, False)
+            group_key = key
+            group_entries = set()
+        group_entries.add(original_key)
+        if parts is not None:
+            write('\t'.join(parts) + '\n')
+    
+    # 文件结束：写出最后一组及剩余的新增词条
+    if group_key is not None:
+        emit_candidates(group_key, True, group_key, group_entries)
+    if candidates:
+        emit_candidates(entry_sort_key(candidates[-1][1]), True)
+    return added_count
+
+def iter_run_file(path):
+    """逐行读取外部排序的临时归并段"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield line.rstrip('\n').split('\t')
+
+def sort_extend_entries(entries, candidates, write, temp_dir, timings):
+    """通用路径：文件无序时整体排序；超过内存预算时分段排序写入临时文件，再多路归并"""
+    memory_budget = EXTEND_SORT_MEMORY_MB * 1024 * 1024
+    # 去重只需要与新增词条键相同的已有词条，不必为整个文件的每一行保存一个键
+    candidate_keys = {key for original_key, entry in candidates for key in (original_key, (entry[0], entry[1]))}
+    existing_entries = set()
+    buffer = []
+    buffer_bytes = 0
+    run_files = []
+    
+    def spill():
+        """把当前缓冲区排序后写成一个临时归并段"""
+        sort_start = time.perf_counter()
+        run = sort_entries(buffer)
+        timings['sort'] += time.perf_counter() - sort_start
+        fd, run_path = tempfile.mkstemp(prefix='.sort-run-', suffix='.tmp', dir=temp_dir)
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.writelines('\t'.join(entry) + '\n' for entry in run)
+        run_files.append(run_path)
+    
+    try:
+        for original_key, parts in entries:
+            if original_key in candidate_keys:
+                existing_entries.add(original_key)
+            if parts is None:
+                continue
+            buffer.append(parts)
+            # 粗略估算内存：每条词条的对象开销加上字符内容
+            buffer_bytes += 250 + 2 * sum(len(part) for part in parts)
+            if buffer_bytes > memory_budget:
+                spill()
+                buffer = []
+                buffer_bytes = 0
+        
+        new_entries = accept_new_entries(candidates, existing_entries)
+        sort_start = time.perf_counter()
+        buffer = sort_entries(buffer)
+        timings['sort'] += time.perf_counter() - sort_start
+        
+        # 各段内部稳定有序，heapq.merge 对相同键按段的先后输出，结果与整体稳定排序一致
+        write_start = time.perf_counter()
+        runs = [iter_run_file(path) for path in run_files] + [buffer, new_entries]
+        for entry in heapq.merge(*runs, key=entry_sort_key):
+            write('\t'.join(entry) + '\n')
+        timings['write'] += time.perf_counter() - write_start
+        return len(new_entries)
+    finally:
+        for run_path in run_files:
+            if os.path.exists(run_path):
+                os.remove(run_path)
+
+def reset_counters(stats, metrics):
+    """放弃一次未完成的处理时清零统计"""
+    for key in stats:
+        stats[key] = 0
+    if metrics is not None:
+        metrics['lines'] = 0
+        for group in ('stages', 'hits'):
+            for key in metrics[group]:
+                metrics[group][key] = 0
+
+def rewrite_user_extend_file(file_path, temp_file, mods, multi_mods, candidates, deletions,
+                             stats, metrics, rule_chars, timings, source=None, weigher=None):
+    """重写用户扩展文件并插入新增词条（candidates 来自 prepare_new_entries），返回新增条数
+    
+    文件已有序（首次运行之后的常态）时只对新增词条排序并流式归并；否则回退到整体排序。
+    source 为 (更新包路径, 成员名) 时从更新包中读取；weigher 给出时各行写出前调整词频
+    """
+    def open_source():
+        if source is None:
+            return open(file_path, 'r', encoding='utf-8')
+        return open_archive_member(source, text=True)
+    
+    try:
+        with open_source() as fin, \
+             open(temp_file, 'w', encoding='utf-8') as fout:
+            write = fout.write if metrics is None else timed_writer(fout.write, metrics)
+            write, flush = weighing_writer(write, weigher)
+            lines = fin if metrics is None else timed_lines(fin, metrics)
+            entries = iter_extend_entries(lines, write, mods, multi_mods, deletions, stats, metrics, rule_chars)
+            added_count = merge_into_sorted_extend_file(entries, candidates, write)
+            flush()
+            return added_count
+    except ExtendFileNotSorted:
+        reset_counters(stats, metrics)
+        if weigher is not None:
+            reset_weigher(weigher)
+    
+    with open_source() as fin, \
+         open(temp_file, 'w', encoding='utf-8') as fout:
+        write = fout.write if metrics is None else timed_writer(fout.write, metrics)
+        write, flush = weighing_writer(write, weigher)
+        lines = fin if metrics is None else timed_lines(fin, metrics)
+        entries = iter_extend_entries(lines, write, mods, multi_mods, deletions, stats, metrics, rule_chars)
+        added_count = sort_extend_entries(entries, candidates, write, os.path.dirname(os.path.abspath(file_path)), timings)
+        flush()
+    if metrics is not None:
+        metrics['stages']['sort'] += timings['sort']
+    return added_count
+
+def process_single_dict_file(args, rule_chars=None, add_duplicates=None, source=None, filename=None):
+    """处理单个词库文件 - 用于并行处理
+    
+    rule_chars 为预筛字符集，默认由全部规则生成；只有部分规则变化时可只传变化规则涉及的字。
+    add_duplicates 为其他词库中已有的新增词条键，处理用户扩展文件时跳过这些新增词条。
+    source 为 (更新包路径, 成员名) 时从更新包中流式读取该词库，处理结果写到 file_path。
+    filename 为词库的原文件名（处理结果写到别的路径时给出），按它判断是否为用户扩展文件和匹配词频规则。
+    需要调整词频时在同一遍重写中逐行调整（见 open_weigher）
+    """
+    file_path, mods, multi_mods, adds, deletions = args
+    filename = filename or os.path.basename(file_path)
+    
+    temp_file = file_path + '.tmp'
+    is_user_extend_file = (filename == USER_EXTEND_FILE)
+    
+    stats = {'modified': 0, 'multi_modified': 0, 'deleted': 0}
+    timings = {'sort': 0.0, 'write': 0.0}  # 用户扩展文件的排序、整体写出耗时，以及替换文件耗时
+    start_time = time.perf_counter()
+    
+    metrics = new_file_metrics(file_path) if _metrics_enabled else None
+    if rule_chars is None:
+        rule_chars = build_rule_char_set(mods, multi_mods, deletions)
+    # 其他词库在同一遍扫描中查找与新增词条重复的词条
+    probe = None if is_user_extend_file else build_addition_probe(adds, mods, multi_mods, deletions)
+    found = set()
+    skipped_adds = []
+    weigher = None
+    
+    try:
+        weigher = open_weigher(file_path, filename)
+        if is_user_extend_file:
+            # 用户扩展文件：应用规则、插入新增词条并保持排序
+            candidates, skipped_adds = exclude_addition_duplicates(
+                prepare_new_entries(adds, mods, multi_mods, deletions), add_duplicates)
+            added_count = rewrite_user_extend_file(file_path, temp_file, mods, multi_mods, candidates, deletions,
+                                                   stats, metrics, rule_chars, timings, source, weigher)
+        elif source is not None:
+            # 更新包中的词库：边解压边按字节处理，只写出处理后的文件
+            rewrite_archive_member(source, temp_file, mods, multi_mods, deletions, stats, metrics, rule_chars,
+                                   probe, found, weigher)
+            added_count = 0
+        elif uses_byte_engine(file_path, is_user_extend_file):
+            # 字节引擎：未变化的行不解码、不重组，整段复制
+            rewrite_dict_file_bytes(file_path, temp_file, mods, multi_mods, deletions, stats, metrics, rule_chars,
+                                    probe, found, weigher)
+            added_count = 0
+        else:
+            # 单遍流式处理：逐行写出，内存占用与文件大小无关
+            with open(file_path, 'r', encoding='utf-8') as fin, \
+                 open(temp_file, 'w', encoding='utf-8') as fout:
                 
-                # 如果是USER_EXTEND_FILE且是词条行，收集起来用于排序
-                if is_user_extend_file:
-                    parts = processed_line.split('\t')
-                    if len(parts) >= 2:
-                        entries_to_sort.append(parts)
-                else:
-                    fout.write(processed_line + '\n')
-            
-            # 对于USER_EXTEND_FILE，添加新词条并排序
-            if is_user_extend_file:
-                added_count = 0
-                new_entries = []
+                # 启用运行指标时包装读写以分别计时
+                lines = fin if metrics is None else timed_lines(fin, metrics)
+                write = fout.write if metrics is None else timed_writer(fout.write, metrics)
+                write, flush = weighing_writer(write, weigher)
+                in_metadata = True   # 标记是否在元数据部分
                 
-                # 收集新增词条（去重检查）
-                for entry in adds:
-                    hanzi, encoding, freq = entry
-                    
-                    if not should_process_entry(hanzi, encoding, deletions):
-                        continue
+                for line in lines:
+                    processed_line = line.rstrip('\n')
                     
-                    # 检查是否已存在（去重）
-                    if (hanzi, encoding) in existing_entries:
+                    # 检查是否结束元数据部分
+                    if in_metadata and processed_line == '...':
+                        in_metadata = False
+                        write(processed_line + '\n')
                         continue
                     
-                    # 对新增词条应用修改规则
-                    processed_entry = process_single_line(f"{hanzi}\t{encoding}\t{freq}", mods, multi_mods, deletions)
-                    
-                    # 如果词条被删除，跳过
-                    if processed_entry is None:
+                    # 元数据行直接写入
+                    if in_metadata:
+                        write(processed_line + '\n')
                         continue
                     
-                    # 解析处理后的词条
-                    parts = processed_entry.split('\t')
-                    if len(parts) >= 2:
-                        processed_hanzi = parts[0]
-                        processed_encoding = parts[1]
-                        processed_freq = parts[2] if len(parts) >= 3 else freq
-                        
-                        # 再次检查去重（处理后的词条可能已存在）
-                        if (processed_hanzi, processed_encoding) not in existing_entries:
-                            new_entries.append([processed_hanzi, processed_encoding, processed_freq])
-                            added_count += 1
-                
-                # 合并现有词条和新增词条
-                all_entries = entries_to_sort + new_entries
-                
-                # 按词条长度和内容排序
-                sorted_entries = sort_entries(all_entries)
-                
-                # 写入排序后的词条
-                for hanzi, encoding, freq in sorted_entries:
-                    fout.write(f"{hanzi}\t{encoding}\t{freq}\n")
-            else:
-                # 其他文件只处理修改和删除，不添加新词条
-                added_count = 0
+                    # 处理词条行
+                    processed_line = apply_rules_to_line(processed_line, mods, multi_mods, deletions, stats,
+                                                         metrics, rule_chars)
+                    if processed_line is not None:
+                        if probe and processed_line.partition('\t')[0] in probe:
+                            record_addition_duplicate(probe, processed_line, found)
+                        write(processed_line + '\n')
+                flush()
+            
+            # 其他文件只处理修改和删除，不添加新词条
+            added_count = 0
+        weighted = finish_weigher(weigher, temp_file) if weigher is not None else 0
         
-        # 原子替换文件
-        os.replace(temp_file, file_path)
+        # 内容未变化时保留原文件（不更新修改时间，避免 Rime 重新编译词库）；来自更新包时总是与现有文件比较
+        commit_start = time.perf_counter()
+        changed = commit_temp_file(temp_file, file_path, source is None and (
+            stats['modified'] or stats['multi_modified'] or stats['deleted'] or added_count or weighted))
+        if weigher is not None:
+            commit_weigher(weigher)
+        timings['commit'] = time.perf_counter() - commit_start
+        timings['total'] = time.perf_counter() - start_time
+        if metrics is not None:
+            metrics['bytes'] = os.path.getsize(file_path)
+            metrics['stages']['replace'] = timings['commit']
+            finish_task_metrics(metrics)
         return {
             'filename': filename,
-            'modified': modified_count,
-            'multi_modified': multi_modified_count,
+            'modified': stats['modified'],
+            'multi_modified': stats['multi_modified'],
             'added': added_count,
-            'deleted': deleted_count,
+            'deleted': stats['deleted'],
+            'weighted': weighted,
+            'changed': changed,
+            'adds_found': sorted(found),
+            'skipped_adds': ['\t'.join(entry[:2]) for entry in skipped_adds],
+            'timings': timings,
+            'metrics': metrics,
             'success': True
         }
         
     except Exception as e:
         # 清理临时文件
+        if weigher is not None:
+            close_weigher(weigher)
         if os.path.exists(temp_file):
             os.remove(temp_file)
         return {
@@ -481,122 +1369,2351 @@ def process_single_dict_file(args):
 
 
 
-def process_dict_files_parallel(dict_files, mods, multi_mods, adds, deletions):
-    """并行处理多个词库文件"""
-    try:
-        from concurrent.futures import ProcessPoolExecutor, as_completed
-        import multiprocessing
-        
-        # 自动检测CPU核心数
-        if MAX_WORKERS is None:
-            max_workers = min(multiprocessing.cpu_count(), len(dict_files))
-        else:
-            max_workers = min(MAX_WORKERS, len(dict_files))
-        
-        print(f"使用 {max_workers} 个进程并行处理 {len(dict_files)} 个文件...")
-        
-        # 准备参数
-        tasks = [(file_path, mods, multi_mods, adds, deletions) for file_path in dict_files]
-        
-        results = []
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有任务
-            future_to_file = {
-                executor.submit(process_single_dict_file, task): task[0] 
-                for task in tasks
-            }
-            
-            # 收集结果
-            for future in as_completed(future_to_file):
-                file_path = future_to_file[future]
-                try:
-                    result = future.result()
-                    results.append(result)
-                    filename = os.path.basename(file_path)
-                    if result['success']:
-                        print(f"✓ {filename} - 完成 (修改:{result['modified']}, 多字:{result['multi_modified']}, 新增:{result['added']}, 删除:{result['deleted']})")
-                    else:
-                        print(f"✗ {filename} - 失败: {result.get('error', '未知错误')}")
-                except Exception as e:
-                    print(f"✗ {os.path.basename(file_path)} - 处理异常: {e}")
-                    results.append({
-                        'filename': os.path.basename(file_path),
-                        'success': False,
-                        'error': str(e)
-                    })
-        
-        return results
-        
-    except ImportError:
-        print("警告：无法导入concurrent.futures，回退到串行处理")
-        return process_dict_files_sequential(dict_files, mods, multi_mods, adds, deletions)
+# ==================== 紧凑规则表 ====================
 
-def process_dict_files_sequential(dict_files, mods, multi_mods, adds, deletions):
-    """串行处理多个词库文件"""
-    results = []
-    for file_path in dict_files:
-        filename = os.path.basename(file_path)
-        print(f"处理: {filename}", end="", flush=True)
-        
-        # 复用并行处理函数
-        result = process_single_dict_file((file_path, mods, multi_mods, adds, deletions))
-        results.append(result)
-        
-        if result['success']:
-            print(f" - 完成 (修改:{result['modified']}, 多字:{result['multi_modified']}, 新增:{result['added']}, 删除:{result['deleted']})")
-        else:
-            print(f" - 失败: {result.get('error', '未知错误')}")
+class CompactKeys:
+    """只读的紧凑键表，键为 (汉字, 拼音) 这样的两个字符串
     
-    return results
+    所有键以制表符连接、UTF-8 编码后拼接在一块连续内存中，用开放寻址哈希表（数组）查找。
+    哈希取 zlib.crc32，在各进程中结果相同，序列化后交给工作进程可直接使用
+    """
+    
+    def __init__(self, keys):
+        data = bytearray()
+        self.offsets = array('I', [0])  # 第 i 个键在 data 中的范围为 offsets[i]:offsets[i + 1]
+        self.hashes = array('I')        # 各键的哈希，探查时先比较哈希，相同才比较键本身
+        for first, second in keys:
+            data += (first + '\t' + second).encode('utf-8')
+            self.offsets.append(len(data))
+            self.hashes.append(zlib.crc32(data[self.offsets[-2]:]))
+        self.data = bytes(data)
+        # 槽位数为不小于键数两倍的 2 的幂，槽中存放键序号 + 1，0 为空槽
+        size = 8
+        while size < 2 * len(self.hashes):
+            size *= 2
+        self.slots = array('I', [0]) * size
+        mask = size - 1
+        for index, key_hash in enumerate(self.hashes):
+            slot = key_hash & mask
+            while self.slots[slot]:
+                slot = (slot + 1) & mask
+            self.slots[slot] = index + 1
+    
+    def find(self, key):
+        """键的序号，不存在时返回 -1"""
+        if type(key) is not tuple or len(key) != 2:
+            return -1
+        encoded = (key[0] + '\t' + key[1]).encode('utf-8')
+        key_hash = zlib.crc32(encoded)
+        slots, hashes, offsets = self.slots, self.hashes, self.offsets
+        mask = len(slots) - 1
+        slot = key_hash & mask
+        index = slots[slot] - 1
+        while index >= 0:
+            if hashes[index] == key_hash and self.data[offsets[index]:offsets[index + 1]] == encoded:
+                return index
+            slot = (slot + 1) & mask
+            index = slots[slot] - 1
+        return -1
+    
+    def __contains__(self, key):
+        return self.find(key) >= 0
+    
+    def __len__(self):
+        return len(self.hashes)
+    
+    def __iter__(self):
+        offsets, data = self.offsets, self.data
+        for index in range(len(self.hashes)):
+            yield tuple(data[offsets[index]:offsets[index + 1]].decode('utf-8').split('\t', 1))
+    
+    def nbytes(self):
+        """占用的内存（字节）"""
+        return sys.getsizeof(self.data) + sum(len(column) * column.itemsize
+                                              for column in (self.offsets, self.hashes, self.slots))
 
-def clear_cache():
-    """清空配置缓存"""
-    _config_cache.clear()
+class CompactKeySet(CompactKeys, collections.abc.Set):
+    """只读的紧凑键集合，用于删除规则"""
 
-def main_optimized():
-    """主函数"""
-    # 预加载所有配置
-    print("加载配置文件中...")
+class CompactRuleTable(CompactKeys, collections.abc.Mapping):
+    """只读的紧凑规则表：键同 CompactKeys，值 (辅助码, 词频) 存为两列字符串编号，相同的字符串只存一份"""
     
-    # 加载轻声对应表
-    neutral_tone_map = load_neutral_tone_map()
+    def __init__(self, rules):
+        super().__init__(rules)
+        strings = {}
+        codes = [strings.setdefault(code, len(strings)) for code, _ in rules.values()]
+        freqs = [strings.setdefault(freq, len(strings)) for _, freq in rules.values()]
+        # 不同的辅助码、词频通常只有几百个，编号用 2 字节即可
+        typecode = 'H' if len(strings) <= 0xFFFF else 'I'
+        self.codes = array(typecode, codes)
+        self.freqs = array(typecode, freqs)
+        self.strings = tuple(strings)
     
-    # 加载原始修改规则
-    mods, multi_mods = load_modifications()
+    def __getitem__(self, key):
+        index = self.find(key)
+        if index < 0:
+            raise KeyError(key)
+        return self.strings[self.codes[index]], self.strings[self.freqs[index]]
     
-    # 使用轻声对应表扩展修改规则
-    if neutral_tone_map:
-        mods, multi_mods = expand_modifications_with_neutral_tone(mods, multi_mods, neutral_tone_map)
+    def get(self, key, default=None):
+        index = self.find(key)
+        if index < 0:
+            return default
+        return self.strings[self.codes[index]], self.strings[self.freqs[index]]
     
-    adds = load_additions()
-    deletions = load_deletions()
+    def nbytes(self):
+        """占用的内存（字节）"""
+        return (super().nbytes() + (len(self.codes) + len(self.freqs)) * self.codes.itemsize
+                + sys.getsizeof(self.strings) + sum(map(sys.getsizeof, self.strings)))
+
+def estimate_rules_size(rules):
+    """估算规则字典或集合的内存占用：容器本身，加上按前 1000 条推算的键、值元组及其中的字符串"""
+    sample = list(itertools.islice(rules.items() if isinstance(rules, dict) else ((key,) for key in rules), 1000))
+    if not sample:
+        return sys.getsizeof(rules)
+    seen = set()
+    sample_size = 0
+    for item in sample:
+        for obj in item:
+            for part in (obj, *obj):
+                if id(part) not in seen:
+                    seen.add(id(part))
+                    sample_size += sys.getsizeof(part)
+    return sys.getsizeof(rules) + sample_size * len(rules) // len(sample)
+
+def compact_rules(mods, multi_mods, adds, deletions):
+    """单字修改、删除规则达到 COMPACT_RULES_MIN 条时换成紧凑表（各自判断），用于交给进程池的工作进程
     
-    # 获取所有词库文件
-    dict_files = get_dict_files()
+    查找方式（in、下标、get、遍历）与字典、集合相同，处理结果不变；每个工作进程的规则表内存约为原来的几分之一，
+    代价是每次查找要编码键、计算 crc32，比字典慢
+    """
+    if COMPACT_RULES_MIN is None:
+        return mods, multi_mods, adds, deletions
+    start_time = time.time()
+    reports = []
+    if isinstance(mods, dict) and len(mods) >= COMPACT_RULES_MIN:
+        original_size = estimate_rules_size(mods)
+        mods = CompactRuleTable(mods)
+        reports.append(f"单字修改 {len(mods)} 条 {format_size(original_size)} → {format_size(mods.nbytes())}")
+    if isinstance(deletions, (set, frozenset)) and len(deletions) >= COMPACT_RULES_MIN:
+        original_size = estimate_rules_size(deletions)
+        deletions = CompactKeySet(deletions)
+        reports.append(f"删除 {len(deletions)} 条 {format_size(original_size)} → {format_size(deletions.nbytes())}")
+    if reports:
+        print(f"规则表已压缩（每个工作进程）: {'，'.join(reports)}，耗时 {time.time() - start_time:.2f} 秒")
+    return mods, multi_mods, adds, deletions
+
+# 工作进程内的规则表（由进程池初始化函数设置，每个进程只接收一次）
+_worker_rules = None
+_worker_rule_chars = None
+_worker_add_probe = None
+_worker_pool_rules = None  # 进程池初始化时收到的规则（批量模式下各配置补全辅助码前后的规则以它为准）
+
+def run_task_with_config(config, filled_rules, task, *args):
+    """工作进程任务：先应用任务所属的配置再执行（批量模式下多份配置共用一个进程池）
     
-    if not dict_files:
-        print(f"错误：在目录 {DICTS_FOLDER} 中未找到任何词库文件")
-        return False
+    filled_rules 为本配置补全辅助码后的 (多字词修改规则, 新增词条)，与进程池初始化时的规则相同时为 None
+    """
+    global _worker_rules, _worker_add_probe
+    if filled_rules is not None or any(globals().get(name) != value for name, value in config.items()):
+        globals().update(config)
+        mods, multi_mods, adds, deletions = _worker_pool_rules
+        if filled_rules is not None:
+            multi_mods, adds = filled_rules
+        # 补全辅助码只改编码，不改规则涉及的字，预筛字符集不变
+        _worker_rules = (mods, multi_mods, adds, deletions)
+        _worker_add_probe = build_addition_probe(adds, mods, multi_mods, deletions)
+    return task(*args)
+
+def get_config_snapshot():
+    """当前的模块级配置（用户配置区域中的常量），随进程池初始化或任务交给工作进程
     
-    print(f"找到 {len(dict_files)} 个词库文件，开始处理...")
+    spawn 方式（Windows、macOS 的默认方式）启动的工作进程重新导入本模块，只有默认配置
+    """
+    return {name: globals()[name] for name in CONFIG_NAMES}
+
+def get_shared_executor(shared_pool, rules):
+    """取出批量模式共用的进程池，第一次用到时按当前配置（已补全辅助码）的规则创建"""
+    if shared_pool['executor'] is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        shared_pool['rules'] = rules
+        shared_pool['executor'] = ProcessPoolExecutor(max_workers=MAX_WORKERS or multiprocessing.cpu_count(),
+                                                      initializer=init_worker_rules,
+                                                      initargs=compact_rules(*rules) + (
+                                                          False, None, get_config_snapshot()))
+    return shared_pool['executor']
+
+def init_worker_rules(mods, multi_mods, adds, deletions, metrics_enabled=False, weight_plan=None, config=None):
+    """进程池初始化：把规则表（和词频调整计划）一次性交给工作进程，避免每个任务重复序列化
     
-    # 根据配置选择处理方式
-    if USE_PARALLEL and len(dict_files) > 1:
-        results = process_dict_files_parallel(dict_files, mods, multi_mods, adds, deletions)
-    else:
-        results = process_dict_files_sequential(dict_files, mods, multi_mods, adds, deletions)
+    config 为主进程的配置（get_config_snapshot），进程池的工作进程先应用它；线程池与主进程共用配置，不需要
+    """
+    global _worker_rules, _worker_rule_chars, _worker_add_probe, _worker_pool_rules, _metrics_enabled, _weight_plan
+    if config is not None:
+        globals().update(config)
+    _worker_rules = _worker_pool_rules = (mods, multi_mods, adds, deletions)
+    _worker_rule_chars = build_rule_char_set(mods, multi_mods, deletions)
+    _worker_add_probe = build_addition_probe(adds, mods, multi_mods, deletions)
+    _metrics_enabled = metrics_enabled
+    _weight_plan = weight_plan
+
+def process_dict_file_task(file_path, rule_chars=None, add_duplicates=None):
+    """工作进程任务：只携带文件路径（和可选的预筛字符集、新增词条查重结果），规则表取自 init_worker_rules"""
+    return process_single_dict_file((file_path,) + _worker_rules,
+                                    _worker_rule_chars if rule_chars is None else rule_chars, add_duplicates)
+
+def iter_text_lines(data):
+    """按文本模式（通用换行符）逐行解码一段字节，与 open(..., 'r') 的行为一致"""
+    return io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+
+def plan_file_chunks(file_path):
+    """把大词库文件在元数据（...）之后按行对齐切成若干字节区间
     
-    # 统计总结果
-    total_results = {
-        'modified': 0,
-        'multi_modified': 0, 
-        'added': 0,
-        'deleted': 0,
-        'success_count': 0,
-        'fail_count': 0
-    }
+    返回 (元数据结束偏移, [(起始, 结束), ...])，文件不需要分块时返回 None
+    """
+    file_size = os.path.getsize(file_path)
+    if file_size <= CHUNK_SIZE:
+        return None
     
-    for result in results:
+    with open(file_path, 'rb') as f:
+        # 定位元数据结束行
+        for line in f:
+            if line.rstrip(b'\r\n') == b'...':
+                break
+        else:
+            return None
+        body_start = f.tell()
+        
+        # 每隔 CHUNK_SIZE 字节向后对齐到下一个换行符
+        ranges = []
+        start = body_start
+        while start < file_size:
+            if start + CHUNK_SIZE >= file_size:
+                end = file_size
+            else:
+                f.seek(start + CHUNK_SIZE - 1)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    
+    if len(ranges) < 2:
+        return None
+    return body_start, ranges
+
+def process_chunk_task(file_path, start, end, byte_engine=False):
+    """工作进程任务：处理词库文件中的一个字节区间，返回处理后的文本（字节引擎为字节串）、统计、
+    运行指标和与新增词条重复的键"""
+    mods, multi_mods, _, deletions = _worker_rules
+    stats = {'modified': 0, 'multi_modified': 0, 'deleted': 0}
+    metrics = new_file_metrics(file_path) if _metrics_enabled else None
+    probe = _worker_add_probe
+    found = set()
+    
+    if byte_engine:
+        output = io.BytesIO()
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            transform_byte_range(buf, start, end, output.write, mods, multi_mods, deletions,
+                                 stats, metrics, _worker_rule_chars, probe, found)
+        if metrics is not None:
+            finish_task_metrics(metrics)
+        return output.getvalue(), stats, metrics, found
+    
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    output = []
+    for line in iter_text_lines(data):
+        processed_line = apply_rules_to_line(line.rstrip('\n'), mods, multi_mods, deletions, stats,
+                                             metrics, _worker_rule_chars)
+        if processed_line is not None:
+            if probe and processed_line.partition('\t')[0] in probe:
+                record_addition_duplicate(probe, processed_line, found)
+            output.append(processed_line + '\n')
+    if metrics is not None:
+        finish_task_metrics(metrics)
+    return ''.join(output), stats, metrics, found
+
+def start_chunked_file(file_path, body_start, chunk_count, byte_engine=False):
+    """开始按块重写文件：写出元数据部分，返回记录写入进度的状态
+    
+    需要调整词频时由主进程在按顺序写出各块时逐行调整（各块在不同进程中处理，同一键的词条要按文件顺序对应）
+    """
+    temp_file = file_path + '.tmp'
+    with open(file_path, 'rb') as f:
+        header = f.read(body_start)
+    if byte_engine:
+        # 字节引擎：元数据原样复制，各块结果也是字节串
+        fout = open(temp_file, 'wb')
+        fout.write(header)
+    else:
+        fout = open(temp_file, 'w', encoding='utf-8')
+        for line in iter_text_lines(header):
+            fout.write(line.rstrip('\n') + '\n')
+    weigher = error = None
+    try:
+        weigher = open_weigher(file_path)
+    except Exception as e:
+        error = str(e)
+    write, flush = weighing_writer(fout.write, weigher, in_metadata=False)
+    return {
+        'file_path': file_path,
+        'temp_file': temp_file,
+        'fout': fout,
+        'write': write,
+        'flush': flush,
+        'weigher': weigher,
+        'chunk_count': chunk_count,
+        'byte_engine': byte_engine,
+        'next_index': 0,
+        'pending': {},  # 乱序完成、等待按顺序写出的块
+        'stats': {'modified': 0, 'multi_modified': 0, 'deleted': 0},
+        'adds_found': set(),
+        'start_time': time.perf_counter(),
+        'metrics': None,
+        'error': error
+    }
+
+def add_chunk_result(state, index, text, stats, metrics=None, found=()):
+    """收下一个块的结果，并按原始顺序写出所有已就绪的块"""
+    state['pending'][index] = text
+    for key in stats:
+        state['stats'][key] += stats[key]
+    state['adds_found'].update(found)
+    if metrics is not None:
+        if state['metrics'] is None:
+            state['metrics'] = new_file_metrics(state['file_path'])
+            state['metrics']['tasks'] = []
+        merge_metrics(state['metrics'], metrics)
+    while state['next_index'] in state['pending'] and state['error'] is None:
+        state['write'](state['pending'].pop(state['next_index']))
+        state['next_index'] += 1
+
+def finish_chunked_file(state):
+    """所有块完成后原子替换文件，返回与 process_single_dict_file 相同格式的结果"""
+    weigher = state['weigher']
+    try:
+        if state['error'] is None:
+            state['flush']()
+    except Exception as e:
+        state['error'] = str(e)
+    state['fout'].close()
+    filename = os.path.basename(state['file_path'])
+    if state['error'] is None and state['next_index'] == state['chunk_count']:
+        try:
+            weighted = finish_weigher(weigher, state['temp_file']) if weigher is not None else 0
+            commit_start = time.perf_counter()
+            changed = commit_temp_file(state['temp_file'], state['file_path'],
+                                       any(state['stats'].values()) or weighted)
+            if weigher is not None:
+                commit_weigher(weigher)
+        except Exception as e:
+            state['error'] = str(e)
+        else:
+            timings = {'sort': 0.0, 'write': 0.0, 'commit': time.perf_counter() - commit_start,
+                       'total': time.perf_counter() - state['start_time']}
+            metrics = state['metrics']
+            if metrics is not None:
+                metrics['bytes'] = os.path.getsize(state['file_path'])
+                metrics['stages']['replace'] = timings['commit']
+            return dict(filename=filename, added=0, weighted=weighted, changed=changed,
+                        adds_found=sorted(state['adds_found']), timings=timings, metrics=metrics, success=True,
+                        **state['stats'])
+    
+    if weigher is not None:
+        close_weigher(weigher)
+    if os.path.exists(state['temp_file']):
+        os.remove(state['temp_file'])
+    return {
+        'filename': filename,
+        'modified': 0,
+        'multi_modified': 0,
+        'added': 0,
+        'deleted': 0,
+        'success': False,
+        'error': state['error'] or '分块处理不完整'
+    }
+
+def print_skipped_adds(result):
+    """报告因已存在于其他词库而跳过的新增词条"""
+    skipped_adds = result.get('skipped_adds')
+    if skipped_adds:
+        preview = '、'.join(skipped_adds[:5]) + ('…' if len(skipped_adds) > 5 else '')
+        print(f"  跳过 {len(skipped_adds)} 条已存在于其他词库的新增词条: {preview}")
+
+def print_weight_changes(result, preview=False):
+    """报告词频规则和用户词频调整的词频条数"""
+    if result.get('weighted'):
+        print(f"  {'将调整' if preview else '调整'} {result['weighted']} 条词频")
+
+def print_parallel_result(result):
+    """输出并行处理的单个文件结果"""
+    if result['success']:
+        print(f"✓ {result['filename']} - 完成 (修改:{result['modified']}, 多字:{result['multi_modified']}, 新增:{result['added']}, 删除:{result['deleted']}){'' if result.get('changed', True) else '，内容未变化'}")
+        print_skipped_adds(result)
+        print_weight_changes(result)
+    else:
+        print(f"✗ {result['filename']} - 失败: {result.get('error', '未知错误')}")
+
+def process_dict_files_task(file_paths, add_duplicates=None):
+    """工作者任务：依次处理打包在一起的若干词库，返回各自的结果"""
+    return [process_dict_file_task(file_path, None, add_duplicates) for file_path in file_paths]
+
+def format_size(size):
+    """把字节数格式化为便于阅读的 KB/MB"""
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{size / 1024:.1f} KB"
+
+def choose_auto_mode(total_bytes, file_count, largest, cpu_count):
+    """自动调度：按待处理的总大小选择串行、线程池或进程池，返回 (执行方式, 原因)"""
+    if cpu_count < 2:
+        return 'sequential', '只有 1 个可用核心'
+    if total_bytes < SCHEDULE_SERIAL_BYTES:
+        return 'sequential', f"总大小低于 {format_size(SCHEDULE_SERIAL_BYTES)}，省去启动并行的开销"
+    if file_count < 2 and largest <= CHUNK_SIZE:
+        return 'sequential', '只有一个无需分块的文件'
+    if total_bytes < SCHEDULE_PROCESS_BYTES:
+        return 'thread', f"总大小低于 {format_size(SCHEDULE_PROCESS_BYTES)}，线程池无需启动进程、传递规则表"
+    return 'process', f"总大小达到 {format_size(SCHEDULE_PROCESS_BYTES)}，用进程池占满所有核心"
+
+def plan_schedule(dict_files, mode=None, defer_user_extend=False):
+    """按文件大小规划执行方式和任务
+    
+    进程池模式下大文件切块；小文件打包成共享任务；任务按字节数从大到小排列，最大的最先开始。
+    defer_user_extend=True 时用户扩展文件不进任务列表，等其他词库完成后再处理（新增词条跨词库查重）。
+    返回 {'mode', 'reason', 'workers', 'total_bytes', 'tasks', 'chunk_plans', 'deferred'}，
+    tasks 中每项为 (字节数, ('chunk', 文件路径, 块序号, 起始, 结束)) 或 (字节数, ('files', [文件路径, ...]))
+    """
+    import multiprocessing
+    
+    file_sizes = {file_path: os.path.getsize(file_path) for file_path in dict_files}
+    total_bytes = sum(file_sizes.values())
+    largest = max(file_sizes.values(), default=0)
+    cpu_count = MAX_WORKERS or multiprocessing.cpu_count()
+    others, deferred = split_user_extend_file(dict_files) if defer_user_extend else (dict_files, [])
+    
+    # 流水线模式只用读写线程掩盖存储延迟，不属于并行处理，不受 USE_PARALLEL 限制
+    mode = mode or (EXECUTION_MODE if USE_PARALLEL or EXECUTION_MODE == 'pipeline' else 'sequential')
+    reason = '按配置指定' if USE_PARALLEL else '未启用并行处理'
+    if mode == 'auto':
+        mode, reason = choose_auto_mode(total_bytes, len(dict_files), largest, cpu_count)
+    
+    tasks = []
+    chunk_plans = {}
+    small_files = []
+    for file_path in others:
+        # 只有进程池能让同一文件的多个块真正同时计算，其他模式不切块
+        plan = None
+        if mode == 'process' and os.path.basename(file_path) != USER_EXTEND_FILE:
+            plan = plan_file_chunks(file_path)
+        if plan:
+            chunk_plans[file_path] = plan
+            for index, (start, end) in enumerate(plan[1]):
+                tasks.append((end - start, ('chunk', file_path, index, start, end)))
+        elif file_sizes[file_path] < SCHEDULE_PACK_BYTES:
+            small_files.append(file_path)
+        else:
+            tasks.append((file_sizes[file_path], ('files', [file_path])))
+    
+    # 小文件从大到小依次装箱，每箱不超过 SCHEDULE_PACK_BYTES
+    pack = []
+    pack_bytes = 0
+    for file_path in sorted(small_files, key=file_sizes.get, reverse=True):
+        if pack and pack_bytes + file_sizes[file_path] > SCHEDULE_PACK_BYTES:
+            tasks.append((pack_bytes, ('files', pack)))
+            pack = []
+            pack_bytes = 0
+        pack.append(file_path)
+        pack_bytes += file_sizes[file_path]
+    if pack:
+        tasks.append((pack_bytes, ('files', pack)))
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    
+    workers = 1 if mode in ('sequential', 'pipeline') else max(1, min(cpu_count, len(tasks) + len(deferred)))
+    return {
+        'mode': mode,
+        'reason': reason,
+        'workers': workers,
+        'total_bytes': total_bytes,
+        'file_count': len(dict_files),
+        'tasks': tasks,
+        'chunk_plans': chunk_plans,
+        'deferred': deferred
+    }
+
+def print_schedule(schedule):
+    """输出执行计划"""
+    mode_names = {'sequential': '串行', 'thread': '线程池', 'process': '进程池', 'pipeline': '流水线'}
+    print(f"执行计划：{mode_names[schedule['mode']]}（{schedule['workers']} 个工作者）处理 {schedule['file_count']} 个文件，"
+          f"共 {format_size(schedule['total_bytes'])}（{schedule['reason']}）")
+    if schedule['mode'] in ('sequential', 'pipeline'):
+        return
+    for number, (size, task) in enumerate(schedule['tasks'], 1):
+        if task[0] == 'chunk':
+            chunk_count = len(schedule['chunk_plans'][task[1]][1])
+            print(f"  任务 {number}: {os.path.basename(task[1])} 第 {task[2] + 1}/{chunk_count} 块 ({format_size(size)})")
+        else:
+            names = '、'.join(os.path.basename(file_path) for file_path in task[1])
+            print(f"  任务 {number}: {names} ({format_size(size)}{'，打包' if len(task[1]) > 1 else ''})")
+    for file_path in schedule['deferred']:
+        print(f"  最后: {os.path.basename(file_path)}（等其他词库完成新增词条查重）")
+
+def process_dict_files_parallel(dict_files, mods, multi_mods, adds, deletions, add_duplicates=None, schedule=None,
+                                shared_pool=None):
+    """按执行计划用线程池或进程池并行处理多个词库文件
+    
+    schedule 为 plan_schedule 的结果，未传入时按进程池规划。需要跨词库查重新增词条时，用户扩展文件等
+    其他任务全部完成后再提交；add_duplicates 为未参与本次处理的词库中已知的重复键。
+    shared_pool 为批量模式共用的进程池（规则表相同），任务携带当前配置提交
+    """
+    try:
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+    except ImportError:
+        print("警告：无法导入concurrent.futures，回退到串行处理")
+        return process_dict_files_sequential(dict_files, mods, multi_mods, adds, deletions, add_duplicates)
+    
+    if schedule is None:
+        schedule = plan_schedule(dict_files, 'process',
+                                 build_addition_probe(adds, mods, multi_mods, deletions) is not None)
+        print_schedule(schedule)
+    
+    if shared_pool is not None:
+        # 共用的进程池不随本次处理结束而关闭；工作进程按任务携带的配置处理
+        executor_context = contextlib.nullcontext(
+            get_shared_executor(shared_pool, (mods, multi_mods, adds, deletions)))
+        task_config = get_config_snapshot()
+        task_config['_metrics_enabled'] = _metrics_enabled
+        task_config['_weight_plan'] = _weight_plan
+        # 各配置按自己的单字词库补全辅助码，结果与创建进程池时不同才随任务发送
+        _, pool_multi_mods, pool_adds, _ = shared_pool['rules']
+        filled_rules = None if (pool_multi_mods, pool_adds) == (multi_mods, adds) else (multi_mods, adds)
+    else:
+        # 规则表通过初始化函数每个工作者只传一次，任务本身只携带文件路径
+        # 线程池与主进程共用规则表，进程池的每个工作进程各有一份，规则多时换成紧凑表
+        if schedule['mode'] == 'thread':
+            executor_class, worker_rules = ThreadPoolExecutor, (mods, multi_mods, adds, deletions)
+            config = None
+        else:
+            executor_class, worker_rules = ProcessPoolExecutor, compact_rules(mods, multi_mods, adds, deletions)
+            config = get_config_snapshot()
+        executor_context = executor_class(max_workers=schedule['workers'], initializer=init_worker_rules,
+                                          initargs=worker_rules + (_metrics_enabled, _weight_plan, config))
+        task_config = None
+    
+    results = []
+    chunk_states = {}
+    deferred_files = list(schedule['deferred'])
+    with executor_context as executor:
+        def submit(task, *args):
+            if task_config is None:
+                return executor.submit(task, *args)
+            return executor.submit(run_task_with_config, task_config, filled_rules, task, *args)
+        
+        # 按计划顺序（从大到小）提交：分块任务值为 (文件路径, 块序号)，整文件任务值为文件路径列表
+        future_to_task = {}
+        for file_path, (body_start, ranges) in schedule['chunk_plans'].items():
+            chunk_states[file_path] = start_chunked_file(file_path, body_start, len(ranges),
+                                                         uses_byte_engine(file_path, False))
+        for _, task in schedule['tasks']:
+            if task[0] == 'chunk':
+                _, file_path, index, start, end = task
+                future = submit(process_chunk_task, file_path, start, end, chunk_states[file_path]['byte_engine'])
+                future_to_task[future] = (file_path, index)
+            else:
+                future_to_task[submit(process_dict_files_task, task[1])] = task[1]
+        
+        # 收集结果（延后的用户扩展文件在其他任务全部完成后提交，再收集一轮）
+        remaining_chunks = {path: len(ranges) for path, (_, ranges) in schedule['chunk_plans'].items()}
+        while future_to_task or deferred_files:
+            for future in as_completed(list(future_to_task)):
+                task = future_to_task.pop(future)
+                
+                if isinstance(task, tuple):
+                    # 分块任务：按顺序写出，全部完成后替换文件
+                    file_path, index = task
+                    state = chunk_states[file_path]
+                    try:
+                        add_chunk_result(state, index, *future.result())
+                    except Exception as e:
+                        state['error'] = str(e)
+                    remaining_chunks[file_path] -= 1
+                    if remaining_chunks[file_path] == 0:
+                        result = finish_chunked_file(state)
+                        results.append(result)
+                        print_parallel_result(result)
+                    continue
+                
+                try:
+                    task_results = future.result()
+                except Exception as e:
+                    task_results = []
+                    for file_path in task:
+                        print(f"✗ {os.path.basename(file_path)} - 处理异常: {e}")
+                        results.append({
+                            'filename': os.path.basename(file_path),
+                            'success': False,
+                            'error': str(e)
+                        })
+                for result in task_results:
+                    results.append(result)
+                    print_parallel_result(result)
+            
+            if deferred_files:
+                add_duplicates = collect_addition_duplicates(results) | set(add_duplicates or ())
+                future_to_task[submit(process_dict_files_task, deferred_files, add_duplicates)] = deferred_files
+                deferred_files = []
+    
+    return results
+
+def process_dict_files_sequential(dict_files, mods, multi_mods, adds, deletions, add_duplicates=None):
+    """串行处理多个词库文件（用户扩展文件最后处理，以便跳过其他词库中已有的新增词条）"""
+    results = []
+    others, extend_files = split_user_extend_file(dict_files)
+    for file_path in others + extend_files:
+        filename = os.path.basename(file_path)
+        print(f"处理: {filename}", end="", flush=True)
+        
+        # 复用并行处理函数
+        duplicates = None
+        if file_path in extend_files:
+            duplicates = collect_addition_duplicates(results) | set(add_duplicates or ())
+        result = process_single_dict_file((file_path, mods, multi_mods, adds, deletions), None, duplicates)
+        results.append(result)
+        
+        if result['success']:
+            print(f" - 完成 (修改:{result['modified']}, 多字:{result['multi_modified']}, 新增:{result['added']}, 删除:{result['deleted']}){'' if result.get('changed', True) else '，内容未变化'}")
+            print_skipped_adds(result)
+            print_weight_changes(result)
+        else:
+            print(f" - 失败: {result.get('error', '未知错误')}")
+    
+    return results
+
+def read_blocks_pipelined(file_paths, blocks):
+    """读取线程：依次读取各文件，按 PIPELINE_BLOCK_SIZE 分块放入有界队列
+    
+    每个文件读完后放入 b''；读取出错时放入异常并转到下一个文件
+    """
+    for file_path in file_paths:
+        try:
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(PIPELINE_BLOCK_SIZE), b''):
+                    blocks.put(block)
+            blocks.put(b'')
+        except Exception as e:
+            blocks.put(e)
+
+def write_blocks_pipelined(writes):
+    """写入线程：按顺序执行 ('open', 临时文件)、('write', 数据)、('close', Future) 请求，收到 None 时退出
+    
+    某个文件写入出错后丢弃它余下的数据，在关闭时通过 Future 报告错误
+    """
+    fout = None
+    error = None
+    for request, arg in iter(writes.get, None):
+        if request == 'open':
+            error = None
+            try:
+                fout = open(arg, 'wb')
+            except Exception as e:
+                fout, error = None, e
+        elif request == 'write':
+            if error is None:
+                try:
+                    fout.write(arg)
+                except Exception as e:
+                    error = e
+        else:
+            if fout is not None:
+                try:
+                    fout.close()
+                except Exception as e:
+                    error = error or e
+                fout = None
+            if error is None:
+                arg.set_result(None)
+            else:
+                arg.set_exception(error)
+
+def iter_file_blocks(blocks, metrics=None):
+    """从读取队列依次取出当前文件的各块，直到文件结束；读取出错时抛出读取线程传来的异常"""
+    while True:
+        wait_start = time.perf_counter()
+        block = blocks.get()
+        if metrics is not None:
+            metrics['stages']['read'] += time.perf_counter() - wait_start
+        if isinstance(block, Exception):
+            raise block
+        if not block:
+            return
+        yield block
+
+def batched_writer(writes, metrics=None):
+    """把逐行的小写入攒成不小于 PIPELINE_BLOCK_SIZE 的大块交给写入线程，返回 (write, flush)"""
+    pending = []
+    pending_bytes = 0
+    
+    def flush():
+        nonlocal pending_bytes
+        if not pending:
+            return
+        wait_start = time.perf_counter()
+        writes.put(('write', b''.join(pending)))
+        if metrics is not None:
+            metrics['stages']['write'] += time.perf_counter() - wait_start
+        pending.clear()
+        pending_bytes = 0
+    
+    def write(data):
+        nonlocal pending_bytes
+        pending.append(data)
+        pending_bytes += len(data)
+        if pending_bytes >= PIPELINE_BLOCK_SIZE:
+            flush()
+    
+    return write, flush
+
+def transform_file_blocks(file_blocks, write, mods, multi_mods, deletions, stats, metrics, rule_chars,
+                          probe=None, found=None):
+    """转换一个文件的各块：元数据原样写出，正文的完整行交给 transform_byte_range，跨块的半行留到下一块"""
+    data = b''
+    in_metadata = True
+    for block in itertools.chain(file_blocks, [None]):
+        at_end = block is None
+        if not at_end:
+            data += block
+        # 文件结束前只处理完整的行
+        end = len(data) if at_end else data.rfind(b'\n') + 1
+        if in_metadata:
+            body_start = find_body_start(data[:end]) if end else None
+            if body_start is None:
+                if at_end:
+                    write(data)
+                continue
+            write(data[:body_start])
+            data = data[body_start:]
+            end -= body_start
+            in_metadata = False
+        if end:
+            transform_byte_range(io.BytesIO(data), 0, end, write, mods, multi_mods, deletions,
+                                 stats, metrics, rule_chars, probe, found)
+            data = data[end:]
+
+def process_dict_files_pipelined(dict_files, mods, multi_mods, adds, deletions, add_duplicates=None):
+    """流水线处理多个词库文件：读取线程预读下一块（包括下一个文件），主线程转换当前块，写入线程写出上一块
+    
+    适合网络盘、同步盘等延迟高的存储；各队列容量为 PIPELINE_QUEUE_BLOCKS 块，内存占用与文件大小无关。
+    按字节处理，结果与字节引擎一致；用户扩展文件需要整体排序，最后按串行方式处理
+    """
+    import queue
+    from concurrent.futures import Future
+    
+    results = []
+    others, extend_files = split_user_extend_file(dict_files)
+    rule_chars = build_rule_char_set(mods, multi_mods, deletions)
+    probe = build_addition_probe(adds, mods, multi_mods, deletions)
+    blocks = queue.Queue(maxsize=PIPELINE_QUEUE_BLOCKS)
+    writes = queue.Queue(maxsize=PIPELINE_QUEUE_BLOCKS)
+    reader = threading.Thread(target=read_blocks_pipelined, args=(others, blocks), daemon=True)
+    writer = threading.Thread(target=write_blocks_pipelined, args=(writes,), daemon=True)
+    reader.start()
+    writer.start()
+    
+    try:
+        for file_path in others:
+            filename = os.path.basename(file_path)
+            print(f"处理: {filename}", end="", flush=True)
+            temp_file = file_path + '.tmp'
+            stats = {'modified': 0, 'multi_modified': 0, 'deleted': 0}
+            metrics = new_file_metrics(file_path) if _metrics_enabled else None
+            found = set()
+            start_time = time.perf_counter()
+            file_blocks = iter_file_blocks(blocks, metrics)
+            closed = Future()
+            writes.put(('open', temp_file))
+            weigher = None
+            try:
+                write, flush = batched_writer(writes, metrics)
+                try:
+                    weigher = open_weigher(file_path)
+                    weighing_write, flush_weights = weighing_writer(write, weigher)
+                    transform_file_blocks(file_blocks, weighing_write, mods, multi_mods, deletions, stats, metrics,
+                                          rule_chars, probe, found)
+                    flush_weights()
+                    flush()
+                finally:
+                    # 转换出错时也要取走该文件余下的块，后续文件才能对齐
+                    for _ in file_blocks:
+                        pass
+                    writes.put(('close', closed))
+                wait_start = time.perf_counter()
+                closed.result()
+                if metrics is not None:
+                    metrics['stages']['write'] += time.perf_counter() - wait_start
+                
+                weighted = finish_weigher(weigher, temp_file) if weigher is not None else 0
+                commit_start = time.perf_counter()
+                changed = commit_temp_file(temp_file, file_path, any(stats.values()) or weighted)
+                if weigher is not None:
+                    commit_weigher(weigher)
+                timings = {'sort': 0.0, 'write': 0.0, 'commit': time.perf_counter() - commit_start,
+                           'total': time.perf_counter() - start_time}
+                if metrics is not None:
+                    metrics['bytes'] = os.path.getsize(file_path)
+                    metrics['stages']['replace'] = timings['commit']
+                    finish_task_metrics(metrics)
+                result = dict(filename=filename, added=0, weighted=weighted, changed=changed, adds_found=sorted(found),
+                              skipped_adds=[], timings=timings, metrics=metrics, success=True, **stats)
+            except Exception as e:
+                # 写入线程可能还没处理完关闭请求，等它关闭文件后再清理临时文件
+                if not closed.done():
+                    closed.exception()
+                if weigher is not None:
+                    close_weigher(weigher)
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                result = {'filename': filename, 'modified': 0, 'multi_modified': 0, 'added': 0, 'deleted': 0,
+                          'success': False, 'error': str(e)}
+            results.append(result)
+            
+            if result['success']:
+                print(f" - 完成 (修改:{result['modified']}, 多字:{result['multi_modified']}, 新增:{result['added']}, 删除:{result['deleted']}){'' if result['changed'] else '，内容未变化'}")
+                print_weight_changes(result)
+            else:
+                print(f" - 失败: {result.get('error', '未知错误')}")
+    finally:
+        writes.put(None)
+        writer.join()
+        reader.join()
+    
+    # 用户扩展文件要插入新增词条并保持排序，在其他词库处理完后按串行方式处理
+    if extend_files:
+        results += process_dict_files_sequential(extend_files, mods, multi_mods, adds, deletions,
+                                                 collect_addition_duplicates(results) | set(add_duplicates or ()))
+    return results
+
+# ==================== 直接处理更新包 ====================
+
+@contextlib.contextmanager
+def open_archive_member(source, text=False):
+    """打开更新包中的成员（source 为 (更新包路径, 成员名)），边读边解压；text=True 时按 UTF-8 文本读取"""
+    import zipfile
+    with zipfile.ZipFile(source[0]) as archive, archive.open(source[1]) as member:
+        yield io.TextIOWrapper(member, encoding='utf-8') if text else member
+
+def rewrite_archive_member(source, temp_file, mods, multi_mods, deletions, stats, metrics, rule_chars,
+                           probe=None, found=None, weigher=None):
+    """从更新包中流式解压一个词库，按块交给 transform_file_blocks 处理后写到临时文件（weigher 给出时写出前调整词频）"""
+    with open_archive_member(source) as member, open(temp_file, 'wb') as fout:
+        write = fout.write if metrics is None else timed_writer(fout.write, metrics)
+        write, flush = weighing_writer(write, weigher)
+        blocks = iter(lambda: member.read(PIPELINE_BLOCK_SIZE), b'')
+        if metrics is not None:
+            blocks = timed_lines(blocks, metrics)
+        transform_file_blocks(blocks, write, mods, multi_mods, deletions, stats, metrics, rule_chars, probe, found)
+        flush()
+
+def get_archive_dicts_dir(names):
+    """更新包中的词库目录：含 *.dict.yaml 的目录中，优先取与 DICTS_FOLDER 同名的，否则取词库最多的"""
+    counts = collections.Counter(posixpath.dirname(name) for name in names if name.endswith('.dict.yaml'))
+    if not counts:
+        return None
+    folder_name = os.path.basename(os.path.normpath(DICTS_FOLDER))
+    named = [folder for folder in counts if posixpath.basename(folder) == folder_name]
+    return max(named or counts, key=counts.__getitem__)
+
+def list_archive_dicts(archive_path):
+    """列出更新包中的词库：返回 ([(成员名, 目标路径, 解压后大小), ...], [排除的成员...])
+    
+    只取包内词库目录（见 get_archive_dicts_dir）下的 *.dict.yaml，按文件名放到 DICTS_FOLDER 下；
+    方案、配置等其他成员不处理也不解压。EXCLUDE_FILES 中的词库单独列出，原样解压
+    """
+    import zipfile
+    dicts, excluded = [], []
+    with zipfile.ZipFile(archive_path) as archive:
+        infos = [info for info in archive.infolist() if not info.is_dir()]
+        dicts_dir = get_archive_dicts_dir([info.filename for info in infos])
+        for info in infos:
+            filename = posixpath.basename(info.filename)
+            if posixpath.dirname(info.filename) != dicts_dir or not filename.endswith('.dict.yaml'):
+                continue
+            member = (info.filename, os.path.join(DICTS_FOLDER, filename), info.file_size)
+            (excluded if filename in EXCLUDE_FILES else dicts).append(member)
+    return dicts, excluded
+
+def extract_archive_member(source, target_path):
+    """原样解压一个成员（排除的词库），内容与现有文件相同时不改写"""
+    temp_file = target_path + '.tmp'
+    try:
+        with open_archive_member(source) as member, open(temp_file, 'wb') as fout:
+            shutil.copyfileobj(member, fout, PIPELINE_BLOCK_SIZE)
+        return commit_temp_file(temp_file, target_path, False)
+    except Exception:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+def process_archive_member_task(archive_path, member_name, target_path, add_duplicates=None):
+    """工作者任务：处理更新包中的一个词库，规则表取自 init_worker_rules"""
+    return process_single_dict_file((target_path,) + _worker_rules, _worker_rule_chars, add_duplicates,
+                                    (archive_path, member_name))
+
+def process_update_archive(archive_path, mods, multi_mods, adds, deletions, manifest=None):
+    """直接处理更新包：词库边解压边应用规则，只写出最终文件，不必先全部解压到词库目录再重写一遍
+    
+    各词库按 EXECUTION_MODE（auto 时按解压后的总大小）并行处理，用户扩展文件最后处理（目录中不在
+    更新包里的词库，与新增词条重复的键取自增量清单）；返回 (处理结果列表, 写到的词库路径列表)，
+    更新包无法读取时返回 None
+    """
+    import zipfile
+    try:
+        dicts, excluded = list_archive_dicts(archive_path)
+    except (OSError, zipfile.BadZipFile) as e:
+        print(f"错误：无法读取更新包 {archive_path}: {e}")
+        return None
+    
+    os.makedirs(DICTS_FOLDER, exist_ok=True)
+    for member_name, target_path, _ in excluded:
+        print(f"跳过排除文件: {os.path.basename(target_path)}（原样解压）")
+        extract_archive_member((archive_path, member_name), target_path)
+    
+    others = [member for member in dicts if os.path.basename(member[1]) != USER_EXTEND_FILE]
+    extend_members = [member for member in dicts if os.path.basename(member[1]) == USER_EXTEND_FILE]
+    # 大的先开始；更新包内的词库不切块，流水线模式本身就是边读边处理，按串行方式执行
+    others.sort(key=lambda member: member[2], reverse=True)
+    total_bytes = sum(member[2] for member in dicts)
+    import multiprocessing
+    cpu_count = MAX_WORKERS or multiprocessing.cpu_count()
+    mode = EXECUTION_MODE if USE_PARALLEL else 'sequential'
+    if mode == 'auto':
+        mode = choose_auto_mode(total_bytes, len(dicts), max((member[2] for member in dicts), default=0),
+                                cpu_count)[0]
+    if mode == 'pipeline' or len(others) < 2:
+        mode = 'sequential'
+    mode_names = {'sequential': '串行', 'thread': '线程池', 'process': '进程池'}
+    print(f"更新包：直接处理 {len(dicts)} 个词库，解压后共 {format_size(total_bytes)}（{mode_names[mode]}）")
+    
+    results = []
+    if mode == 'sequential':
+        for member_name, target_path, _ in others:
+            result = process_single_dict_file((target_path, mods, multi_mods, adds, deletions), None, None,
+                                              (archive_path, member_name))
+            results.append(result)
+            print_parallel_result(result)
+    else:
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        if mode == 'thread':
+            executor_class, worker_rules = ThreadPoolExecutor, (mods, multi_mods, adds, deletions)
+            config = None
+        else:
+            executor_class, worker_rules = ProcessPoolExecutor, compact_rules(mods, multi_mods, adds, deletions)
+            config = get_config_snapshot()
+        with executor_class(max_workers=min(cpu_count, len(others)), initializer=init_worker_rules,
+                            initargs=worker_rules + (_metrics_enabled, _weight_plan, config)) as executor:
+            futures = [(executor.submit(process_archive_member_task, archive_path, member_name, target_path),
+                        target_path) for member_name, target_path, _ in others]
+            for future, target_path in futures:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'filename': os.path.basename(target_path), 'modified': 0, 'multi_modified': 0,
+                              'added': 0, 'deleted': 0, 'success': False, 'error': str(e)}
+                results.append(result)
+                print_parallel_result(result)
+    
+    # 用户扩展文件跳过其他词库中已有的新增词条
+    archive_names = {os.path.basename(member[1]) for member in dicts}
+    local_files = [path for path in glob.glob(os.path.join(DICTS_FOLDER, '*.yaml'))
+                   if os.path.basename(path) not in archive_names]
+    for member_name, target_path, _ in extend_members:
+        duplicates = collect_addition_duplicates(results, manifest, local_files)
+        result = process_single_dict_file((target_path, mods, multi_mods, adds, deletions), None, duplicates,
+                                          (archive_path, member_name))
+        results.append(result)
+        print_parallel_result(result)
+    return results, [member[1] for member in others + extend_members]
+
+# 规则缓存格式版本：解析或扩展逻辑变化时递增，使旧缓存失效
+RULE_CACHE_VERSION = 3
+
+def get_rule_sources():
+    """规则缓存依赖的源文件"""
+    return [MODS_FILE, ADDS_FILE, DELETIONS_FILE, NEUTRAL_TONE_FILE]
+
+def get_source_stat(path):
+    """源文件的 (大小, 修改时间)，文件不存在时为 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+def get_source_hash(path):
+    """源文件内容的哈希，文件不存在时为 None"""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+def get_rule_cache_path():
+    """规则缓存文件路径"""
+    return os.path.join(os.path.dirname(MODS_FILE), RULE_CACHE_FILE)
+
+def load_rule_cache(dry_run=False):
+    """加载规则缓存（一次读取），源文件有变化时返回 None；dry_run=True 时不回写刷新后的源文件状态"""
+    cache_path = get_rule_cache_path()
+    try:
+        with open(cache_path, 'rb') as f:
+            cache = pickle.loads(f.read())
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        return None
+    
+    if not isinstance(cache, dict) or cache.get('version') != RULE_CACHE_VERSION:
+        return None
+    sources = cache.get('sources', {})
+    if set(sources) != set(get_rule_sources()):
+        return None
+    
+    refreshed = False
+    for path, (stat, content_hash) in sources.items():
+        current_stat = get_source_stat(path)
+        if current_stat == stat:
+            continue
+        # 修改时间变了但内容可能相同（如同步工具重写），按内容哈希确认
+        if current_stat is None or get_source_hash(path) != content_hash:
+            # 保留上一版规则，反向索引据此只重写受规则变化影响的行
+            _config_cache['previous_rules'] = cache['rules']
+            return None
+        sources[path] = (current_stat, content_hash)
+        refreshed = True
+    
+    if refreshed and not dry_run:
+        save_rule_cache(cache)
+    return cache['rules']
+
+def save_rule_cache(cache):
+    """原子写入规则缓存"""
+    cache_path = get_rule_cache_path()
+    temp_file = cache_path + '.tmp'
+    try:
+        with open(temp_file, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_path)
+    except Exception as e:
+        print(f"写入规则缓存出错: {e}")
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def load_rules(dry_run=False):
+    """加载全部规则（修改、多字词修改、新增、删除），优先使用磁盘缓存
+    
+    dry_run=True（预演模式）时只读取缓存、不写入：缓存保留上一版规则，之后的正式运行仍能按规则变化局部更新
+    """
+    if USE_RULE_CACHE:
+        rules = load_rule_cache(dry_run)
+        if rules is not None:
+            print("规则文件未变化，已从缓存加载规则")
+            return rules
+        # 先记录源文件状态，避免解析期间源文件被修改而缓存了旧内容
+        sources = {path: (get_source_stat(path), get_source_hash(path)) for path in get_rule_sources()}
+    
+    # 加载轻声对应表
+    neutral_tone_map = load_neutral_tone_map()
+    
+    # 加载原始修改规则
+    mods, multi_mods = load_modifications()
+    
+    # 使用轻声对应表扩展修改规则
+    if neutral_tone_map:
+        mods, multi_mods = expand_modifications_with_neutral_tone(mods, multi_mods, neutral_tone_map)
+    
+    adds = load_additions()
+    deletions = load_deletions()
+    rules = (mods, multi_mods, adds, deletions)
+    
+    if USE_RULE_CACHE and not dry_run and os.path.isdir(os.path.dirname(MODS_FILE)):
+        save_rule_cache({'version': RULE_CACHE_VERSION, 'sources': sources, 'rules': rules})
+    return rules
+
+def get_rules_fingerprint(mods, multi_mods, adds, deletions):
+    """计算已解析规则集的指纹（与规则文件的书写顺序、注释无关）"""
+    digest = hashlib.sha1()
+    parts = [USER_EXTEND_FILE, sorted(mods.items()), sorted(multi_mods.items()), sorted(adds), sorted(deletions)]
+    # 词频调整在同一遍重写中进行，一并计入指纹（没有词频规则时指纹与以往相同）；参考词库的词频范围
+    # 变化后指纹随之变化，对齐到它的词库下次运行时重新对齐
+    weight_plan = prepare_weight_plan((mods, multi_mods, adds, deletions))
+    if weight_plan['rules']:
+        parts.append(weight_plan['rules'])
+    if weight_plan['references']:
+        parts.append(sorted(weight_plan['references'].items()))
+    if weight_plan['userdb_fingerprint']:
+        parts.append(weight_plan['userdb_fingerprint'])
+    for part in parts:
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def get_file_fingerprint(file_path):
+    """计算词库文件的内容指纹（分块读取，不受文件大小影响）"""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': digest.hexdigest()}
+
+def get_manifest_path():
+    """增量清单文件路径"""
+    return os.path.join(DICTS_FOLDER, MANIFEST_FILE)
+
+def load_manifest():
+    """加载增量清单，文件缺失或损坏时返回空清单"""
+    manifest_path = get_manifest_path()
+    if not os.path.exists(manifest_path):
+        return {'files': {}}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get('files'), dict):
+            return manifest
+    except Exception as e:
+        print(f"读取增量清单出错（将全部重新处理）: {e}")
+    return {'files': {}}
+
+def save_manifest(manifest):
+    """原子写入增量清单"""
+    manifest_path = get_manifest_path()
+    temp_file = manifest_path + '.tmp'
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(temp_file, manifest_path)
+    except Exception as e:
+        print(f"写入增量清单出错: {e}")
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def is_file_unchanged(file_path, entry, rules_fingerprint):
+    """判断文件自上次处理后是否未变化（先比对大小和修改时间，不一致时再比对内容哈希）"""
+    if not entry or entry.get('rules') != rules_fingerprint:
+        return False
+    stat = os.stat(file_path)
+    if stat.st_size != entry.get('size'):
+        return False
+    if stat.st_mtime_ns == entry.get('mtime_ns'):
+        return True
+    # 修改时间变了但大小相同（如被原样复制覆盖），按内容判断并刷新记录
+    fingerprint = get_file_fingerprint(file_path)
+    if fingerprint['sha1'] != entry.get('sha1'):
+        return False
+    entry.update(fingerprint)
+    return True
+
+def filter_unchanged_files(dict_files, manifest, rules_fingerprint):
+    """按增量清单筛选需要处理的文件"""
+    files_to_process = []
+    skipped_files = []
+    for file_path in dict_files:
+        entry = manifest['files'].get(os.path.basename(file_path))
+        if is_file_unchanged(file_path, entry, rules_fingerprint):
+            skipped_files.append(file_path)
+        else:
+            files_to_process.append(file_path)
+    return files_to_process, skipped_files
+
+def update_manifest(manifest, dict_files, results, rules_fingerprint):
+    """记录处理成功的文件指纹"""
+    succeeded = {result['filename']: result for result in results if result.get('success')}
+    for file_path in dict_files:
+        filename = os.path.basename(file_path)
+        if filename in succeeded:
+            entry = manifest['files'].get(filename)
+            # 文件未被改写（大小和修改时间与记录一致）时沿用已有的内容哈希，不必重新读取
+            if not entry or get_source_stat(file_path) != (entry.get('size'), entry.get('mtime_ns')):
+                entry = get_file_fingerprint(file_path)
+            entry['rules'] = rules_fingerprint
+            # 与新增词条重复的词条，文件下次被跳过时据此查重而不必重读
+            entry['adds_found'] = succeeded[filename].get('adds_found', [])
+            manifest['files'][filename] = entry
+        else:
+            manifest['files'].pop(filename, None)
+
+def write_line_diff(out, old_no, new_no, old_line, new_line):
+    """以零上下文的统一 diff 格式输出单行改动"""
+    if new_line is None:
+        out.write(f"@@ -{old_no} +{new_no - 1},0 @@\n-{old_line}\n")
+    else:
+        out.write(f"@@ -{old_no} +{new_no} @@\n-{old_line}\n+{new_line}\n")
+
+def preview_dict_file(file_path, mods, multi_mods, adds, deletions, show_diff=False, out=None,
+                      add_duplicates=None, found=None):
+    """预览单个词库文件的改动，不写任何文件；show_diff=True 时输出统一 diff
+    
+    其他词库中与新增词条重复的键记入 found，用户扩展文件预览时跳过 add_duplicates 中的新增词条；
+    需要调整词频时另外统计将调整的词频条数（diff 中不列出）
+    """
+    out = out or sys.stdout
+    filename = os.path.basename(file_path)
+    is_user_extend_file = (filename == USER_EXTEND_FILE)
+    stats = {'modified': 0, 'multi_modified': 0, 'deleted': 0}
+    added_count = 0
+    
+    if show_diff:
+        out.write(f"--- a/{filename}\n+++ b/{filename}\n")
+    
+    rule_chars = build_rule_char_set(mods, multi_mods, deletions)
+    probe = None if is_user_extend_file or found is None else build_addition_probe(adds, mods, multi_mods, deletions)
+    original_lines = []    # 用户扩展文件的原始正文（需要整体排序后再比较）
+    processed_entries = []
+    existing_entries = set()
+    old_no = new_no = 0
+    in_metadata = True
+    weigher = open_weigher(file_path, dry_run=True) if os.path.exists(file_path) else None
+    
+    if os.path.exists(file_path):
+        with open(file_path, 'r', encoding='utf-8') as fin:
+            for line in fin:
+                line = line.rstrip('\n')
+                old_no += 1
+                new_no += 1
+                if in_metadata:
+                    if line == '...':
+                        in_metadata = False
+                    continue
+                
+                if is_user_extend_file:
+                    original_lines.append(line)
+                    parts = line.split('\t')
+                    if len(parts) >= 2:
+                        existing_entries.add((parts[0], parts[1]))
+                
+                processed_line = apply_rules_to_line(line, mods, multi_mods, deletions, stats, rule_chars=rule_chars)
+                if is_user_extend_file:
+                    if processed_line is not None:
+                        parts = processed_line.split('\t')
+                        if len(parts) >= 2:
+                            processed_entries.append(parts)
+                    continue
+                
+                # 非扩展文件逐行流式比较
+                if probe and processed_line is not None and processed_line.partition('\t')[0] in probe:
+                    record_addition_duplicate(probe, processed_line, found)
+                if weigher is not None and processed_line is not None:
+                    weigh_line(weigher, processed_line.encode('utf-8'))
+                if processed_line is None:
+                    if show_diff:
+                        write_line_diff(out, old_no, new_no, line, None)
+                    new_no -= 1
+                elif processed_line != line and show_diff:
+                    write_line_diff(out, old_no, new_no, line, processed_line)
+    
+    if is_user_extend_file:
+        import difflib
+        candidates, skipped_adds = exclude_addition_duplicates(
+            prepare_new_entries(adds, mods, multi_mods, deletions), add_duplicates)
+        new_entries = accept_new_entries(candidates, existing_entries)
+        added_count = len(new_entries)
+        new_lines = ['\t'.join(entry) for entry in sort_entries(processed_entries + new_entries)]
+        if weigher is not None:
+            for line in new_lines:
+                weigh_line(weigher, line.encode('utf-8'))
+        if show_diff:
+            body_start = old_no - len(original_lines)
+            for diff_line in difflib.unified_diff(original_lines, new_lines, n=0, lineterm=''):
+                if diff_line.startswith('@@'):
+                    # 行号加上元数据部分的偏移
+                    old_range, new_range = diff_line.split()[1:3]
+                    diff_line = f"@@ {shift_diff_range(old_range, body_start)} {shift_diff_range(new_range, body_start)} @@"
+                elif diff_line.startswith(('---', '+++')):
+                    continue
+                out.write(diff_line + '\n')
+    
+    weighted = 0
+    if weigher is not None:
+        weighted = finish_weigher(weigher)
+        close_weigher(weigher)
+    return {
+        'filename': filename,
+        'modified': stats['modified'],
+        'multi_modified': stats['multi_modified'],
+        'added': added_count,
+        'deleted': stats['deleted'],
+        'weighted': weighted,
+        'skipped_adds': ['\t'.join(entry[:2]) for entry in skipped_adds] if is_user_extend_file else [],
+        'success': True
+    }
+
+def shift_diff_range(diff_range, offset):
+    """给 diff 范围（如 -12,3）的起始行号加上偏移"""
+    start, sep, count = diff_range[1:].partition(',')
+    return f"{diff_range[0]}{int(start) + offset}{sep}{count}"
+
+def preview_dict_files(dict_files, mods, multi_mods, adds, deletions, show_diff=False, add_duplicates=None):
+    """预演模式：逐个文件输出改动摘要或统一 diff，不修改任何文件（用户扩展文件最后预览）"""
+    results = []
+    found = set(add_duplicates or ())
+    others, extend_files = split_user_extend_file(dict_files)
+    for file_path in others + extend_files:
+        result = preview_dict_file(file_path, mods, multi_mods, adds, deletions, show_diff,
+                                   add_duplicates=found, found=found)
+        results.append(result)
+        if not show_diff:
+            print(f"预览: {result['filename']} (修改:{result['modified']}, 多字:{result['multi_modified']}, 新增:{result['added']}, 删除:{result['deleted']})")
+            print_skipped_adds(result)
+            print_weight_changes(result, preview=True)
+    return results
+
+# ==================== 批量词频规则 ====================
+
+# 操作 → 参数个数
+WEIGHT_OPERATIONS = {'scale': 1, 'rescale': 2, 'clamp': 2, 'normalize': 1, 'boost': 2}
+# 原始词频记录的文件头（格式变化时修改版本号，版本不同的记录不再使用）
+WEIGHT_BASE_HEADER = '#weight_base\t1\n'
+# 排序记录文件（用户词频导入文件、原始词频记录）稀疏索引的间隔（字节）
+SORTED_BLOCK_SIZE = 8192
+
+# 本次运行的词频调整计划（主进程由 prepare_weight_plan 设置、clear_cache 清除，工作进程由 init_worker_rules 设置）
+_weight_plan = None
+
+def load_weight_rules():
+    """加载批量词频规则 - 带缓存
+    
+    每行：操作<Tab>文件名（可用 * ? 通配符）<Tab>参数；同一词库的多条规则按书写顺序依次执行
+    """
+    cache_key = 'weight_rules'
+    if cache_key in _config_cache:
+        return _config_cache[cache_key]
+    
+    weight_rules = []
+    if not WEIGHTS_FILE or not os.path.exists(WEIGHTS_FILE):
+        _config_cache[cache_key] = weight_rules
+        return weight_rules
+    
+    try:
+        with open(WEIGHTS_FILE, 'r', encoding='utf-8') as f:
+            for line_num, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                parts = line.split('\t')
+                operation = parts[0].lower()
+                if WEIGHT_OPERATIONS.get(operation) != len(parts) - 2:
+                    print(f"词频规则第 {line_num} 行格式有误，已跳过: {line}")
+                    continue
+                args = parts[2:]
+                try:
+                    if operation in ('scale', 'rescale', 'clamp'):
+                        args = [float(arg) for arg in args]
+                    elif operation == 'boost':
+                        args = [args[0], float(args[1])]
+                except ValueError:
+                    args = None
+                # 词频必须是非负整数，负数写回后无法再被识别为词频
+                if args is None or any(isinstance(arg, float) and arg < 0 for arg in args) or \
+                        (operation in ('rescale', 'clamp') and args[0] > args[1]):
+                    print(f"词频规则第 {line_num} 行参数有误，已跳过: {line}")
+                    continue
+                weight_rules.append((operation, parts[1], tuple(args)))
+    except Exception as e:
+        print(f"读取词频规则文件出错: {e}")
+    
+    _config_cache[cache_key] = weight_rules
+    return weight_rules
+
+def get_file_weight_rules(filename, weight_rules):
+    """作用于该词库的词频规则（按书写顺序）"""
+    import fnmatch
+    return [rule for rule in weight_rules if fnmatch.fnmatchcase(filename, rule[1])]
+
+def import_numpy():
+    """NumPy 可用时返回该模块，否则返回 None（改用纯 Python 按列计算）"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def parse_weight_line(content):
+    """拆出词条行（字节串，不含换行符）的 (词, 编码, 词频)：至少三列、最后一列为非负整数的行才有词频，其他行返回 None"""
+    if content[:1] == b'#' or content.count(b'\t') < 2:
+        return None
+    weight = content[content.rfind(b'\t') + 1:]
+    if not weight.isdigit():
+        return None
+    word, encoding, _ = content.split(b'\t', 2)
+    return word, encoding, int(weight)
+
+def get_reference_weight_range(reference, rules):
+    """参考词库处理完成后的词频范围，词库不存在或没有词频时返回 None
+    
+    按规则 (mods, multi_mods, adds, deletions) 和参考词库自己的词频调整预先算出（流式读取，不写入任何文件）：
+    调整总是从原始词频计算，参考词库处理前后算出的范围相同，对齐到它的词库重复运行结果不变
+    """
+    file_path = os.path.join(DICTS_FOLDER, reference)
+    if not os.path.exists(file_path):
+        print(f"词频规则：找不到参考词库 {reference}，跳过 normalize")
+        return None
+    mods, multi_mods, _, deletions = rules
+    rule_chars = build_rule_char_set(mods, multi_mods, deletions)
+    stats = {'modified': 0, 'multi_modified': 0, 'deleted': 0}
+    weigher = open_weigher(file_path, reference, dry_run=True)
+    weights = array('q')
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.rstrip('\n') == '...':
+                    break
+            for line in f:
+                line = apply_rules_to_line(line.rstrip('\n'), mods, multi_mods, deletions, stats,
+                                           rule_chars=rule_chars)
+                if line is None:
+                    continue
+                if weigher is not None:
+                    weigh_line(weigher, line.encode('utf-8'))
+                else:
+                    parsed = parse_weight_line(line.encode('utf-8'))
+                    if parsed is not None:
+                        weights.append(parsed[2])
+        if weigher is not None:
+            weights = weigh_column(weigher)
+    finally:
+        if weigher is not None:
+            close_weigher(weigher)
+    return (min(weights), max(weights)) if weights else None
+
+def compile_weight_rules(rules):
+    """把作用于一个词库的词频规则转成 (操作, 参数)"""
+    return [(operation, args) for operation, _, args in rules]
+
+def transform_weight_column(originals, rules, reference_ranges, masks, users=None):
+    """从原始词频对整列依次混入用户词频、执行词频规则：有 NumPy 时每一步是一次向量运算，
+    否则按列逐项计算，两者结果一致；返回各词条的最终词频（array('q')）
+    
+    originals 为各词条的原始词频（array('q')），masks 为各条 boost 规则命中的词条（每条规则一个字节串），
+    users 为各词条的上屏次数（array('q')，0 为没有记录；未导入用户词频时为 None）
+    """
+    np = import_numpy()
+    column = np.frombuffer(originals, dtype=np.int64).astype(np.float64) if np else [float(weight) for weight in originals]
+    if users is not None:
+        # 用户词频只提高不降低
+        if np:
+            counts = np.frombuffer(users, dtype=np.int64)
+            blended = np.maximum(column, column + USERDB_BLEND * (counts * USERDB_COUNT_WEIGHT - column))
+            column = np.where(counts > 0, blended, column)
+        else:
+            column = [max(weight, weight + USERDB_BLEND * (count * USERDB_COUNT_WEIGHT - weight)) if count else weight
+                      for weight, count in zip(column, users)]
+    masks = iter(masks)
+    for operation, args in rules:
+        if not len(column):
+            break
+        if operation == 'scale':
+            column = column * args[0] if np else [weight * args[0] for weight in column]
+        elif operation in ('rescale', 'normalize'):
+            # 把当前词频范围线性映射到目标范围（normalize 的目标范围取自参考词库）
+            target = args if operation == 'rescale' else reference_ranges.get(args[0])
+            low, high = (column.min(), column.max()) if np else (min(column), max(column))
+            if target is None or high == low:
+                continue
+            ratio = (target[1] - target[0]) / (high - low)
+            if np:
+                column = (column - low) * ratio + target[0]
+            else:
+                column = [(weight - low) * ratio + target[0] for weight in column]
+        elif operation == 'clamp':
+            low, high = args
+            column = np.clip(column, low, high) if np else [min(max(weight, low), high) for weight in column]
+        elif operation == 'boost':
+            mask = next(masks)
+            if np:
+                column = np.where(np.frombuffer(mask, dtype=np.uint8).astype(bool), column * args[1], column)
+            else:
+                column = [weight * args[1] if hit else weight for weight, hit in zip(column, mask)]
+    weights = array('q')
+    if np:
+        weights.frombytes(np.rint(column).astype(np.int64).tobytes())
+    else:
+        weights.extend(int(round(weight)) for weight in column)
+    return weights
+
+def prepare_weight_plan(rules=None, dry_run=False):
+    """汇总本次运行的词频调整 - 带缓存，clear_cache 时清除
+    
+    返回 {'rules': 词频规则, 'userdb': 用户词频导入文件路径或 None, 'userdb_fingerprint': 导入指纹,
+    'references': {参考词库: 词频范围}}；normalize 的参考范围在处理前按参考词库的最终内容算出，
+    各词库（包括并行处理的）按同一范围对齐。rules 为本次的规则（已补全辅助码），不给出时按规则文件加载；
+    dry_run=True 时不在词库目录写入任何文件
+    """
+    global _weight_plan
+    if _weight_plan is None:
+        weight_rules = load_weight_rules()
+        userdb = prepare_userdb_import(dry_run)
+        _weight_plan = {
+            'rules': weight_rules,
+            'userdb': userdb and userdb['path'],
+            'userdb_fingerprint': userdb and userdb['fingerprint'],
+            'references': {}
+        }
+        # 参考词库按规则中首次出现的顺序计算，参考词库自己 normalize 到的词库需先出现
+        for operation, _, args in weight_rules:
+            if operation == 'normalize' and args[0] not in _weight_plan['references']:
+                rules = rules or fill_rules_aux_codes(load_rules(dry_run))
+                _weight_plan['references'][args[0]] = get_reference_weight_range(args[0], rules)
+    return _weight_plan
+
+class SortedRecordFile:
+    """按 (词, 拼音键) 排序、以制表符分隔的记录文件（首行为文件头），如用户词频导入文件、原始词频记录
+    
+    以 mmap 打开，每隔 SORTED_BLOCK_SIZE 字节取一行的键作为稀疏索引：查找时二分定位到相邻的一两个块，
+    再在块内按字节查找，不必把文件读入内存。键为 UTF-8 字节串，字节序与按字符排序的顺序相同
+    """
+    
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        self._keys = []
+        self._offsets = []
+        buf = self._buf
+        pos = buf.find(b'\n') + 1  # 跳过文件头
+        while 0 < pos < len(buf):
+            word, pinyin, _ = buf[pos:pos + 4096].split(b'\t', 2)
+            self._keys.append((word, pinyin))
+            self._offsets.append(pos)
+            pos = buf.find(b'\n', pos + SORTED_BLOCK_SIZE) + 1
+    
+    def lookup(self, word, pinyin):
+        """返回键为 (词, 拼音键)（字节串）的各条记录的其余字段（字节串列表，按文件中的顺序），没有时返回空列表"""
+        key = (word, pinyin)
+        first = bisect.bisect_left(self._keys, key)
+        last = bisect.bisect_right(self._keys, key)
+        if last == 0:
+            return []
+        # 相同键的记录可能从前一块的末尾开始，到键更大的块之前结束
+        start = self._offsets[max(first - 1, 0)] - 1
+        end = self._offsets[last] if last < len(self._offsets) else len(self._buf)
+        prefix = word + b'\t' + pinyin + b'\t'
+        buf = self._buf
+        pos = buf.find(b'\n' + prefix, start, end)
+        records = []
+        while pos >= 0:
+            line_start = pos + 1 + len(prefix)
+            line_end = buf.find(b'\n', line_start)
+            records.append(buf[line_start:len(buf) if line_end < 0 else line_end].split(b'\t'))
+            if line_end < 0 or buf[line_end + 1:line_end + 1 + len(prefix)] != prefix:
+                break
+            pos = line_end
+        return records
+    
+    def close(self):
+        self._buf.close()
+        self._file.close()
+
+def get_weight_base_path(filename):
+    """词库的原始词频记录文件路径（词库目录下 WEIGHT_BASE_DIR 中与词库同名的 .txt 文件）"""
+    return os.path.join(DICTS_FOLDER, WEIGHT_BASE_DIR, filename + '.txt')
+
+def is_dict_folder_file(file_path, filename):
+    """file_path 是否就是词库目录中的该词库（原始词频记录只属于词库目录中的词库）"""
+    return os.path.normpath(os.path.abspath(file_path)) == \
+        os.path.normpath(os.path.abspath(os.path.join(DICTS_FOLDER, filename)))
+
+def is_weight_adjusted(file_path, filename=None):
+    """词库是否需要调整词频：有作用于它的词频规则、导入了用户词频，或有原始词频记录（规则删除后要恢复）"""
+    plan = _weight_plan
+    if plan is None:
+        return False
+    filename = filename or os.path.basename(file_path)
+    return bool(plan['userdb'] or get_file_weight_rules(filename, plan['rules']) or (
+        is_dict_folder_file(file_path, filename) and os.path.exists(get_weight_base_path(filename))))
+
+def open_weigher(file_path, filename=None, dry_run=False):
+    """准备在重写一个词库的同时调整词频，不需要调整时返回 None
+    
+    词频规则和用户词频总是从原始词频计算：原始词频记录按 (词, 拼音键) 保存上次写出时词频被改动的词条的
+    (原始词频, 写出的词频)，词条的词频仍是写出的值时取回原始词频，因此重复运行结果不变；词库被替换后以新的词频为准。
+    记录只属于词库目录中的词库（处理结果写到别处时从文件当前的词频计算）；dry_run=True 时只统计，不记录
+    """
+    if not is_weight_adjusted(file_path, filename):
+        return None
+    filename = filename or os.path.basename(file_path)
+    plan = _weight_plan
+    base_path = get_weight_base_path(filename) if is_dict_folder_file(file_path, filename) else None
+    weigher = {
+        'rules': compile_weight_rules(get_file_weight_rules(filename, plan['rules'])),
+        'references': plan['references'],
+        'base_path': None if dry_run else base_path,
+        'bases': None,
+        'userdb': None,
+        'changed': 0
+    }
+    try:
+        if base_path is not None and os.path.exists(base_path):
+            with open(base_path, 'r', encoding='utf-8') as f:
+                current = f.readline() == WEIGHT_BASE_HEADER
+            if current:
+                weigher['bases'] = SortedRecordFile(base_path)
+        if plan['userdb']:
+            weigher['userdb'] = SortedRecordFile(plan['userdb'])
+    except Exception:
+        close_weigher(weigher)
+        raise
+    reset_weigher(weigher)
+    return weigher
+
+def reset_weigher(weigher):
+    """清空本次已记录的词频（开始处理或放弃一次未完成的处理时）"""
+    for run_path in weigher.get('runs', ()):
+        if os.path.exists(run_path):
+            os.remove(run_path)
+    weigher['changed'] = 0
+    weigher['used'] = {}          # 有多条原始词频记录的键已取用的记录
+    weigher['records'] = []       # 本次写出的原始词频记录（超过内存预算时分段写入临时文件）
+    weigher['record_bytes'] = 0
+    weigher['runs'] = []
+    boost_chars = [tuple(char.encode('utf-8') for char in args[0])
+                   for operation, args in weigher['rules'] if operation == 'boost']
+    weigher['column'] = {
+        'currents': array('q'),   # 各词条写出前的词频
+        'originals': array('q'),  # 原始词频
+        'users': array('q') if weigher['userdb'] is not None else None,  # 上屏次数
+        'boost_chars': boost_chars,
+        'masks': [bytearray() for _ in boost_chars]
+    }
+
+def find_weight_base(weigher, word, pinyin, current):
+    """取回词条的原始词频：同一键有多条记录时取第一条未用过、写出的词频与当前词频相同的记录"""
+    records = weigher['bases'].lookup(word, pinyin)
+    if not records:
+        return current
+    used = weigher['used'].get((word, pinyin)) if len(records) > 1 else None
+    for index, (base, written) in enumerate(records):
+        if int(written) == current and (used is None or index not in used):
+            if len(records) > 1:
+                weigher['used'].setdefault((word, pinyin), set()).add(index)
+            return int(base)
+    return current
+
+def record_weight_base(weigher, word, pinyin, base, weight):
+    """记下词频被改动的词条，超过 EXTEND_SORT_MEMORY_MB 时排序后写成临时归并段"""
+    records = weigher['records']
+    records.append((word, pinyin, base, weight))
+    # 粗略估算内存：每条记录的对象开销加上字节内容
+    weigher['record_bytes'] += 200 + len(word) + len(pinyin)
+    if weigher['record_bytes'] > EXTEND_SORT_MEMORY_MB * 1024 * 1024:
+        records.sort(key=lambda record: record[:2])
+        os.makedirs(os.path.dirname(weigher['base_path']), exist_ok=True)
+        fd, run_path = tempfile.mkstemp(prefix='.weight-run-', suffix='.tmp',
+                                        dir=os.path.dirname(weigher['base_path']))
+        weigher['runs'].append(run_path)
+        with open(fd, 'wb') as f:
+            f.writelines(b'%s\t%s\t%d\t%d\n' % record for record in records)
+        weigher['records'] = []
+        weigher['record_bytes'] = 0
+
+def weigh_line(weigher, content):
+    """记下一行词条（UTF-8 字节串，不含换行符）的词频：取回原始词频、查出上屏次数，词频由 finish_weigher 按整列计算
+    
+    没有词频的行不记录
+    """
+    parsed = parse_weight_line(content)
+    if parsed is None:
+        return
+    word, encoding, current = parsed
+    column = weigher['column']
+    base = current
+    if weigher['bases'] is not None or weigher['userdb'] is not None:
+        pinyin = encoding_pinyin_key_bytes(encoding)
+        if weigher['bases'] is not None:
+            base = find_weight_base(weigher, word, pinyin, current)
+        if weigher['userdb'] is not None:
+            records = weigher['userdb'].lookup(word, pinyin)
+            column['users'].append(int(records[0][0]) if records else 0)
+    column['currents'].append(current)
+    column['originals'].append(base)
+    for mask, chars in zip(column['masks'], column['boost_chars']):
+        mask.append(any(char in word for char in chars))
+
+def weighing_writer(write, weigher, in_metadata=True):
+    """包装写出函数：内容原样写出，同时把元数据之后的每一整行交给 weigh_line 记下词频，返回 (write, flush)
+    
+    写入的可以是字节串（含 memoryview）或文本，一行可能分几次写入，按 PIPELINE_BLOCK_SIZE 分块扫描；
+    写出的内容不变（字节引擎整段复制的未变化部分仍整段写出），词频有变化的行由 finish_weigher 改写。
+    flush 记下文件末尾没有换行符的最后一行。weigher 为 None 时原样返回 write
+    """
+    if weigher is None:
+        return write, lambda: None
+    partial = b''  # 上一次写入末尾不完整的行
+    
+    def observe(block):
+        nonlocal partial, in_metadata
+        lines = (partial + block).split(b'\n') if partial else block.split(b'\n')
+        partial = lines.pop()
+        if in_metadata:
+            for index, line in enumerate(lines):
+                if line.rstrip(b'\r') == b'...':
+                    in_metadata = False
+                    lines = lines[index + 1:]
+                    break
+            else:
+                return
+        for line in lines:
+            weigh_line(weigher, line.rstrip(b'\r'))
+    
+    def weighing_write(data):
+        write(data)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        view = memoryview(data)
+        for start in range(0, len(view), PIPELINE_BLOCK_SIZE):
+            observe(view[start:start + PIPELINE_BLOCK_SIZE].tobytes())
+    
+    def flush():
+        nonlocal partial
+        if partial and not in_metadata:
+            weigh_line(weigher, partial.rstrip(b'\r'))
+        partial = b''
+    
+    return weighing_write, flush
+
+def weigh_column(weigher):
+    """按整列算出 weigh_line 记下的各词条的最终词频（array('q')）"""
+    column = weigher['column']
+    return transform_weight_column(column['originals'], weigher['rules'], weigher['references'], column['masks'],
+                                   column['users'])
+
+def rewrite_weight_column(temp_file, weights, flags, weigher):
+    """按整列算出的词频改写临时文件（词条与 weigh_line 记下的一一对应），并记下原始词频
+    
+    flags 为每个词条一个字节：1 位表示词频有变化，2 位表示要记下原始词频；临时文件以 mmap 打开，
+    只解析词条行的词频列，未变化的部分整段复制；词频都没有变化时只读一遍，为原始词频记录取得各词条的键
+    """
+    originals = weigher['column']['originals']
+    output_file = temp_file + '.weights'
+    write = None
+    try:
+        with open(temp_file, 'rb') as fin, contextlib.ExitStack() as stack:
+            buf = stack.enter_context(mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ))
+            if weigher['changed']:
+                write = stack.enter_context(open(output_file, 'wb')).write
+            in_metadata = True
+            index = 0
+            copied = 0  # 已写出到的位置
+            pos = 0
+            size = len(buf)
+            while pos < size:
+                end = buf.find(b'\n', pos)
+                if end < 0:
+                    end = size
+                content = buf[pos:end].rstrip(b'\r')
+                if in_metadata:
+                    in_metadata = content != b'...'
+                else:
+                    parsed = parse_weight_line(content)
+                    if parsed is not None:
+                        flag = flags[index]
+                        if flag:
+                            word, encoding, _ = parsed
+                            weight = weights[index]
+                            if flag & 2:
+                                record_weight_base(weigher, word, encoding_pinyin_key_bytes(encoding),
+                                                   originals[index], weight)
+                            if flag & 1 and write is not None:
+                                write(buf[copied:pos + content.rfind(b'\t') + 1])
+                                write(b'%d' % weight)
+                                copied = pos + len(content)
+                        index += 1
+                pos = end + 1
+            if write is not None:
+                write(buf[copied:])
+        if write is not None:
+            os.replace(output_file, temp_file)
+    finally:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+def finish_weigher(weigher, temp_file=None):
+    """词库写完后收尾，返回词频有变化的词条数
+    
+    按整列算出最终词频，有变化或需要记下原始词频时（temp_file 给出时）顺序改写一遍临时文件；
+    再把本次的原始词频记录按 (词, 拼音键) 归并写到记录的临时文件，由 commit_weigher 换上
+    """
+    column = weigher['column']
+    weights = weigh_column(weigher)
+    record = weigher['base_path'] is not None
+    np = import_numpy()
+    if np:
+        final = np.frombuffer(weights, dtype=np.int64)
+        changed = final != np.frombuffer(column['currents'], dtype=np.int64)
+        flags = changed.astype(np.uint8)
+        if record:
+            flags |= (final != np.frombuffer(column['originals'], dtype=np.int64)).astype(np.uint8) << 1
+        weigher['changed'] = int(np.count_nonzero(changed))
+        flags = flags.tobytes()
+    else:
+        flags = bytes((weight != current) | ((weight != base) << 1 if record else 0)
+                      for weight, current, base in zip(weights, column['currents'], column['originals']))
+        weigher['changed'] = sum(flag & 1 for flag in flags)
+    if temp_file is not None and flags.count(0) != len(flags):
+        rewrite_weight_column(temp_file, weights, flags, weigher)
+    
+    base_path = weigher['base_path']
+    if base_path is not None and (weigher['records'] or weigher['runs']):
+        weigher['records'].sort(key=lambda record: record[:2])
+        runs = [iter_weight_base_run(path) for path in weigher['runs']] + [weigher['records']]
+        os.makedirs(os.path.dirname(base_path), exist_ok=True)
+        with open(base_path + '.tmp', 'wb') as f:
+            f.write(WEIGHT_BASE_HEADER.encode('utf-8'))
+            # 各段内部稳定有序，heapq.merge 对相同键按段的先后输出，同一键的记录保持写出顺序
+            f.writelines(b'%s\t%s\t%d\t%d\n' % record
+                         for record in heapq.merge(*runs, key=lambda record: record[:2]))
+    return weigher['changed']
+
+def iter_weight_base_run(path):
+    """逐行读取原始词频记录的临时归并段"""
+    with open(path, 'rb') as f:
+        for line in f:
+            word, pinyin, base, weight = line.rstrip(b'\n').split(b'\t')
+            yield word, pinyin, int(base), int(weight)
+
+def close_record_files(weigher):
+    """关闭词频调整打开的记录文件（mmap 打开的文件在 Windows 上不能被替换）"""
+    for name in ('bases', 'userdb'):
+        if weigher.get(name) is not None:
+            weigher[name].close()
+            weigher[name] = None
+
+def commit_weigher(weigher):
+    """词库替换完成后换上新的原始词频记录（内容相同时不改写），本次没有任何记录时删除记录文件"""
+    close_record_files(weigher)
+    base_path = weigher['base_path']
+    if base_path is not None:
+        if os.path.exists(base_path + '.tmp'):
+            commit_temp_file(base_path + '.tmp', base_path, False)
+        elif os.path.exists(base_path):
+            os.remove(base_path)
+    close_weigher(weigher)
+
+def close_weigher(weigher):
+    """结束词频调整：关闭记录文件，删除临时归并段和未换上的记录临时文件（可重复调用）"""
+    close_record_files(weigher)
+    temp_files = weigher.get('runs', [])
+    if weigher['base_path'] is not None:
+        temp_files = temp_files + [weigher['base_path'] + '.tmp']
+    for path in temp_files:
+        if os.path.exists(path):
+            os.remove(path)
+    weigher['runs'] = []
+
+# ==================== 用户词频导入 ====================
+
+def get_userdb_import_path():
+    """用户词频导入文件路径"""
+    return os.path.join(DICTS_FOLDER, USERDB_IMPORT_FILE)
+
+def list_userdb_files():
+    """USERDB_FILES 匹配到的用户词典快照（去重、排序）"""
+    return sorted({os.path.normpath(path) for pattern in USERDB_FILES for path in glob.glob(pattern)})
+
+# 音节 → 去声调后的拼音（不同音节只有一千多个，逐个规范化的开销远大于查表）
+_syllable_key_cache = {}
+
+def encoding_pinyin_key(encoding):
+    """编码的拼音连接键：去掉各音节的辅助码后去声调（与 query 的拼音查询键相同）"""
+    keys = []
+    for syllable in encoding.split():
+        pinyin = syllable.partition(';')[0]
+        key = _syllable_key_cache.get(pinyin)
+        if key is None:
+            key = _syllable_key_cache[pinyin] = normalize_pinyin(pinyin)
+        keys.append(key)
+    return ' '.join(keys)
+
+# 音节（UTF-8 字节串）→ 去声调后的拼音（字节串）
+_syllable_key_bytes_cache = {}
+
+def encoding_pinyin_key_bytes(encoding):
+    """encoding_pinyin_key 的字节串版本：重写词库时按字节处理，不必逐行解码"""
+    keys = []
+    for syllable in encoding.split(b' '):
+        if not syllable:
+            continue
+        pinyin = syllable.partition(b';')[0]
+        key = _syllable_key_bytes_cache.get(pinyin)
+        if key is None:
+            key = _syllable_key_bytes_cache[pinyin] = encoding_pinyin_key(pinyin.decode('utf-8')).encode('utf-8')
+        keys.append(key)
+    return b' '.join(keys)
+
+def parse_userdb_line(line):
+    """解析用户词典快照的一行（编码<Tab>词<Tab>c=上屏次数 d=… t=…），返回 (词, 拼音键, 上屏次数)
+    
+    元数据行、格式不符的行和已被用户删除的词（上屏次数为负）返回 None
+    """
+    if line.startswith('#'):
+        return None
+    parts = line.rstrip('\r\n').split('\t')
+    if len(parts) < 3:
+        return None
+    count = 0
+    for field in parts[2].split():
+        name, _, value = field.partition('=')
+        if name == 'c':
+            try:
+                count = int(value)
+            except ValueError:
+                return None
+    pinyin = encoding_pinyin_key(parts[0])
+    if count <= 0 or not pinyin or not parts[1]:
+        return None
+    return parts[1], pinyin, count
+
+def iter_userdb_records(path):
+    """逐行读取外部排序的临时归并段：(词, 拼音键, 上屏次数)（导入文件本身由 SortedRecordFile 按键查找）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            word, pinyin, count = line.rstrip('\n').split('\t')
+            yield word, pinyin, int(count)
+
+def get_userdb_import_header(userdb_files):
+    """导入文件首行：记录各快照的 (大小, 修改时间)，用于判断能否复用"""
+    stats = [[path, get_source_stat(path)] for path in userdb_files]
+    return '#userdb\t' + json.dumps(stats, ensure_ascii=False) + '\n'
+
+def build_userdb_import(userdb_files, output_path):
+    """把用户词典快照按 (词, 拼音键) 外部排序，合并各快照中相同词条的上屏次数，返回写出的记录数
+    
+    超过 EXTEND_SORT_MEMORY_MB 时分段排序写入临时文件再多路归并，内存占用与快照大小无关
+    """
+    memory_budget = EXTEND_SORT_MEMORY_MB * 1024 * 1024
+    temp_dir = os.path.dirname(os.path.abspath(output_path))
+    run_files = []
+    buffer = []
+    buffer_bytes = 0
+    
+    def spill():
+        """把当前缓冲区排序后写成一个临时归并段"""
+        buffer.sort()
+        fd, run_path = tempfile.mkstemp(prefix='.userdb-run-', suffix='.tmp', dir=temp_dir)
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.writelines(f"{word}\t{pinyin}\t{count}\n" for word, pinyin, count in buffer)
+        run_files.append(run_path)
+    
+    temp_file = output_path + '.tmp'
+    try:
+        for path in userdb_files:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    record = parse_userdb_line(line)
+                    if record is None:
+                        continue
+                    buffer.append(record)
+                    # 粗略估算内存：每条记录的对象开销加上字符内容
+                    buffer_bytes += 200 + 2 * (len(record[0]) + len(record[1]))
+                    if buffer_bytes > memory_budget:
+                        spill()
+                        buffer = []
+                        buffer_bytes = 0
+        buffer.sort()
+        
+        record_count = 0
+        runs = [iter_userdb_records(path) for path in run_files] + [buffer]
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write(get_userdb_import_header(userdb_files))
+            # 归并后相同的 (词, 拼音键) 相邻，上屏次数相加
+            for (word, pinyin), group in itertools.groupby(heapq.merge(*runs), key=lambda record: record[:2]):
+                f.write(f"{word}\t{pinyin}\t{sum(record[2] for record in group)}\n")
+                record_count += 1
+        os.replace(temp_file, output_path)
+        return record_count
+    finally:
+        for path in run_files + [temp_file]:
+            if os.path.exists(path):
+                os.remove(path)
+
+def prepare_userdb_import(dry_run=False):
+    """准备用户词频导入文件 - 带缓存，快照都未变化时直接复用上次的排序结果
+    
+    返回 {'path': 导入文件路径, 'fingerprint': 快照与混合参数的指纹}；未配置或找不到快照时返回 None。
+    dry_run=True 且需要重新导入时写到系统临时目录（'temporary' 为 True），clear_cache 时删除，词库目录中的导入文件不变
+    """
+    cache_key = 'userdb_import'
+    if cache_key in _config_cache:
+        return _config_cache[cache_key]
+    
+    userdb = None
+    userdb_files = list_userdb_files()
+    if USERDB_FILES and not userdb_files:
+        print("注意：USERDB_FILES 未匹配到任何用户词典快照（跳过用户词频导入）")
+    if userdb_files:
+        path = get_userdb_import_path()
+        header = get_userdb_import_header(userdb_files)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                current = f.readline() == header
+        except OSError:
+            current = False
+        userdb = {'path': path, 'temporary': False}
+        if not current and dry_run:
+            fd, path = tempfile.mkstemp(prefix='wanxiang_userdb_', suffix='.txt')
+            os.close(fd)
+            userdb = {'path': path, 'temporary': True}
+        if not current:
+            start_time = time.perf_counter()
+            record_count = build_userdb_import(userdb_files, path)
+            print(f"用户词频导入：合并 {len(userdb_files)} 个用户词典快照，共 {record_count} 条记录，"
+                  f"耗时 {time.perf_counter() - start_time:.2f} 秒")
+        userdb['fingerprint'] = hashlib.sha1(
+            (header + repr((USERDB_BLEND, USERDB_COUNT_WEIGHT))).encode('utf-8')).hexdigest()
+    
+    _config_cache[cache_key] = userdb
+    return userdb
+
+# ==================== 反向索引 ====================
+
+REVERSE_INDEX_VERSION = 1
+
+def get_reverse_index_path():
+    """反向索引文件路径"""
+    return os.path.join(DICTS_FOLDER, REVERSE_INDEX_FILE)
+
+def load_reverse_index():
+    """加载反向索引，文件缺失或损坏时返回空索引"""
+    try:
+        with open(get_reverse_index_path(), 'rb') as f:
+            index = pickle.loads(f.read())
+        if isinstance(index, dict) and index.get('version') == REVERSE_INDEX_VERSION:
+            return index
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        pass
+    return {'version': REVERSE_INDEX_VERSION, 'files': {}}
+
+def save_reverse_index(index):
+    """原子写入反向索引"""
+    index_path = get_reverse_index_path()
+    temp_file = index_path + '.tmp'
+    try:
+        with open(temp_file, 'wb') as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, index_path)
+    except Exception as e:
+        print(f"写入反向索引出错: {e}")
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def build_file_index(file_path):
+    """扫描一个词库，记录每个汉字出现在哪些词条行（行首字节偏移，升序）
+    
+    单字规则也会改写词中的字，所以 (汉字, 拼音)、多字词和删除规则都可以归结到字上查找
+    """
+    chars = {}
+    with open(file_path, 'rb') as fin, mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        size = len(buf)
+        typecode = 'I' if size < 1 << 32 else 'Q'
+        pos = find_body_start(buf)
+        if pos is None:
+            pos = size
+        buf.seek(pos)
+        readline = buf.readline
+        while pos < size:
+            raw = readline()
+            for char in set(raw.partition(b'\t')[0].decode('utf-8')):
+                offsets = chars.get(char)
+                if offsets is None:
+                    offsets = chars[char] = array(typecode)
+                offsets.append(pos)
+            pos += len(raw)
+    return {'stat': get_source_stat(file_path), 'chars': chars}
+
+def get_file_index(index, file_path):
+    """取出文件的索引，文件在索引建立后被改动过时重新扫描"""
+    filename = os.path.basename(file_path)
+    entry = index['files'].get(filename)
+    if entry is None or entry['stat'] != get_source_stat(file_path):
+        entry = index['files'][filename] = build_file_index(file_path)
+    return entry
+
+def locate_rule_chars(entry, rule_chars):
+    """返回文件中含有任一规则字的词条行偏移（升序去重）"""
+    offsets = set()
+    for char in rule_chars:
+        offsets.update(entry['chars'].get(char, ()))
+    return sorted(offsets)
+
+def rewrite_dict_regions(file_path, temp_file, offsets, mods, multi_mods, deletions, stats):
+    """只处理 offsets 指向的行，其余字节整段复制；返回各改动行的 (偏移, 长度变化, 是否删除)"""
+    changes = []
+    with open(file_path, 'rb') as fin, open(temp_file, 'wb') as fout:
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as buf, memoryview(buf) as view:
+            run_start = 0
+            for pos in offsets:
+                buf.seek(pos)
+                raw = buf.readline()
+                processed_raw = apply_rules_to_raw_line(raw, mods, multi_mods, deletions, stats)
+                if processed_raw is not raw:
+                    fout.write(view[run_start:pos])
+                    fout.write(processed_raw)
+                    run_start = pos + len(raw)
+                    changes.append((pos, len(processed_raw) - len(raw), not processed_raw))
+            fout.write(view[run_start:])
+    return changes
+
+def shift_file_index(entry, changes):
+    """按改动行的长度变化平移索引中的偏移，并去掉被删除的行，不必重新扫描文件"""
+    if not changes:
+        return
+    positions = [pos for pos, _, _ in changes]
+    deleted = {pos for pos, _, is_deleted in changes if is_deleted}
+    # shift_before[k] 为前 k 处改动的长度变化之和
+    shift_before = [0]
+    for _, delta, _ in changes:
+        shift_before.append(shift_before[-1] + delta)
+    
+    for char, offsets in list(entry['chars'].items()):
+        shifted = array(offsets.typecode, (offset + shift_before[bisect.bisect_left(positions, offset)]
+                                           for offset in offsets if offset not in deleted))
+        if shifted:
+            entry['chars'][char] = shifted
+        else:
+            del entry['chars'][char]
+
+def find_indexed_additions(file_path, entry, probe):
+    """借助反向索引只读取含有新增词条全部汉字的行，查找与新增词条重复的词条"""
+    found = set()
+    with open(file_path, 'rb') as fin, mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for hanzi in probe:
+            offsets = None
+            for char in set(hanzi):
+                char_offsets = entry['chars'].get(char, ())
+                offsets = set(char_offsets) if offsets is None else offsets.intersection(char_offsets)
+                if not offsets:
+                    break
+            for pos in offsets or ():
+                buf.seek(pos)
+                record_addition_duplicate(probe, buf.readline().decode('utf-8'), found)
+    return found
+
+def process_dict_file_delta(file_path, rules, delta_chars, index, probe=None):
+    """规则部分变化时处理一个词库：由反向索引找到含变化规则字的行，只重写这些行
+    
+    传入 probe 时同样借助索引查找与新增词条重复的词条
+    """
+    mods, multi_mods, _, deletions = rules
+    filename = os.path.basename(file_path)
+    temp_file = file_path + '.tmp'
+    stats = {'modified': 0, 'multi_modified': 0, 'deleted': 0}
+    start_time = time.perf_counter()
+    try:
+        entry = get_file_index(index, file_path)
+        offsets = locate_rule_chars(entry, delta_chars)
+        changes = []
+        if offsets:
+            changes = rewrite_dict_regions(file_path, temp_file, offsets, mods, multi_mods, deletions, stats)
+        changed = bool(changes) and commit_temp_file(temp_file, file_path, True)
+        if offsets and not changes:
+            os.remove(temp_file)
+        if changed:
+            shift_file_index(entry, changes)
+            entry['stat'] = get_source_stat(file_path)
+        found = find_indexed_additions(file_path, entry, probe) if probe else set()
+        return {
+            'filename': filename,
+            'modified': stats['modified'],
+            'multi_modified': stats['multi_modified'],
+            'added': 0,
+            'deleted': stats['deleted'],
+            'changed': changed,
+            'adds_found': sorted(found),
+            'lines_checked': len(offsets),
+            'timings': {'total': time.perf_counter() - start_time},
+            'metrics': None,
+            'success': True
+        }
+    except Exception as e:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        index['files'].pop(filename, None)
+        return {
+            'filename': filename,
+            'modified': 0,
+            'multi_modified': 0,
+            'added': 0,
+            'deleted': 0,
+            'success': False,
+            'error': str(e)
+        }
+
+def split_delta_files(dict_files, manifest, old_fingerprint):
+    """挑出可以按规则变化局部更新的文件：上次已用旧规则处理且之后未被改动，且不是用户扩展文件
+    
+    需要调整词频的词库不局部更新：词频按整列（和原始词频记录）计算，随整个文件的重写一起调整
+    """
+    delta_files = []
+    other_files = []
+    for file_path in dict_files:
+        entry = manifest['files'].get(os.path.basename(file_path))
+        if (os.path.basename(file_path) != USER_EXTEND_FILE and os.path.getsize(file_path) > 0
+                and is_file_unchanged(file_path, entry, old_fingerprint) and not is_weight_adjusted(file_path)):
+            delta_files.append(file_path)
+        else:
+            other_files.append(file_path)
+    return delta_files, other_files
+
+def process_rule_delta(delta_files, rules, delta_chars):
+    """用反向索引处理规则变化，返回各文件结果（索引随改动同步更新并保存）"""
+    mods, multi_mods, adds, deletions = rules
+    index = load_reverse_index()
+    probe = build_addition_probe(adds, mods, multi_mods, deletions)
+    results = []
+    for file_path in delta_files:
+        result = process_dict_file_delta(file_path, rules, delta_chars, index, probe)
+        results.append(result)
+        if result['success'] and result['lines_checked'] == 0:
+            print(f"✓ {result['filename']} - 不含变化的规则字，无需处理")
+        else:
+            print_parallel_result(result)
+    save_reverse_index(index)
+    return results
+
+# ========================================================
+
+def clear_cache():
+    """清空配置缓存"""
+    global _weight_plan
+    # 预演模式写到临时目录的用户词频导入文件随缓存一起删除
+    userdb = _config_cache.get('userdb_import')
+    if userdb and userdb['temporary'] and os.path.exists(userdb['path']):
+        os.remove(userdb['path'])
+    _config_cache.clear()
+    _weight_plan = None
+
+def main_optimized(force_full=False, dry_run=False, show_diff=False, metrics_file=None, rules=None, shared_pool=None,
+                   archive=None):
+    """主函数（force_full=True 时忽略增量清单，全部重新处理；dry_run=True 时只预览不写入；
+    metrics_file 或 METRICS_FILE 指定时追加写入运行指标；rules、shared_pool 由库接口和批量模式传入
+    已解析的规则和共用的进程池；archive 为更新包路径时先直接处理包内的词库，再处理目录中的其他词库）"""
+    global _metrics_enabled
+    if archive and dry_run:
+        print("错误：预演模式不支持直接处理更新包，请先解压后再预览")
+        return False
+    # 预加载所有配置
+    print("加载配置文件中...")
+    
+    # 加载规则（规则文件未变化时直接读取缓存），再按本词库目录补全辅助码
+    mods, multi_mods, adds, deletions = fill_rules_aux_codes(rules or load_rules(dry_run))
+    weight_plan = prepare_weight_plan((mods, multi_mods, adds, deletions), dry_run)
+    
+    # 更新包中的词库边解压边处理，本次不再当作目录中的文件重新处理
+    incremental = INCREMENTAL and not force_full
+    manifest = load_manifest() if incremental else None
+    archive_results = []
+    archive_files = []
+    if archive:
+        processed = process_update_archive(archive, mods, multi_mods, adds, deletions, manifest)
+        if processed is None:
+            return False
+        archive_results, archive_files = processed
+    
+    # 获取所有词库文件
+    dict_files = get_dict_files(create_missing=not dry_run)
+    
+    if not dict_files:
+        print(f"错误：在目录 {DICTS_FOLDER} 中未找到任何词库文件")
+        clear_cache()
+        return False
+    if archive_files:
+        processed = {os.path.normpath(path) for path in archive_files}
+        dict_files = [path for path in dict_files if os.path.normpath(path) not in processed]
+    
+    # 增量模式：跳过词库内容与规则集均未变化的文件
+    skipped_files = []
+    if incremental:
+        rules_fingerprint = get_rules_fingerprint(mods, multi_mods, adds, deletions)
+        dict_files, skipped_files = filter_unchanged_files(dict_files, manifest, rules_fingerprint)
+        if skipped_files:
+            print(f"增量模式：跳过 {len(skipped_files)} 个未变化的文件")
+        if not dict_files and not archive_files:
+            if not dry_run:
+                save_manifest(manifest)
+            print("所有词库文件均未变化，无需处理")
+            clear_cache()
+            return True
+    
+    # 规则只改了一部分：上次按旧规则处理过的文件只需重写含变化规则字的行
+    delta_results = []
+    previous_rules = _config_cache.get('previous_rules')
+    if incremental and USE_REVERSE_INDEX and previous_rules is not None and not dry_run:
+        previous_rules = fill_rules_aux_codes(previous_rules)
+        delta_files, dict_files = split_delta_files(dict_files, manifest, get_rules_fingerprint(*previous_rules))
+        if delta_files:
+            delta_chars = get_rule_delta_chars(previous_rules, (mods, multi_mods, adds, deletions))
+            print(f"规则有变化：按反向索引局部更新 {len(delta_files)} 个文件（涉及 {len(delta_chars)} 个字）")
+            delta_results = process_rule_delta(delta_files, (mods, multi_mods, adds, deletions), delta_chars)
+            update_manifest(manifest, delta_files, delta_results, rules_fingerprint)
+    
+    # 预演模式：只输出改动摘要或 diff，不写入任何文件
+    if dry_run:
+        print(f"预演模式：检查 {len(dict_files)} 个词库文件（不写入任何文件）")
+        preview_dict_files(dict_files, mods, multi_mods, adds, deletions, show_diff,
+                           collect_addition_duplicates([], manifest, skipped_files))
+        clear_cache()
+        return True
+    
+    if dict_files:
+        print(f"找到 {len(dict_files)} 个词库文件，开始处理...")
+    
+    # 根据配置选择处理方式
+    metrics_file = metrics_file or METRICS_FILE
+    _metrics_enabled = bool(metrics_file)
+    run_start = time.perf_counter()
+    # 本次不重新扫描的词库，与新增词条重复的键取自更新包和局部更新的结果以及增量清单
+    add_duplicates = collect_addition_duplicates(archive_results + delta_results, manifest, skipped_files)
+    try:
+        if not dict_files:
+            mode = 'delta'
+            results = []
+        else:
+            # 按文件大小选择串行、线程池或进程池，并输出执行计划
+            schedule = plan_schedule(dict_files, defer_user_extend=build_addition_probe(
+                adds, mods, multi_mods, deletions) is not None)
+            print_schedule(schedule)
+            mode = schedule['mode']
+            if mode == 'sequential':
+                results = process_dict_files_sequential(dict_files, mods, multi_mods, adds, deletions, add_duplicates)
+            elif mode == 'pipeline':
+                results = process_dict_files_pipelined(dict_files, mods, multi_mods, adds, deletions, add_duplicates)
+            else:
+                results = process_dict_files_parallel(dict_files, mods, multi_mods, adds, deletions, add_duplicates,
+                                                      schedule, shared_pool)
+    finally:
+        _metrics_enabled = False
+    
+    if metrics_file:
+        run_summary = build_metrics_report(results, mode, time.perf_counter() - run_start)
+        write_metrics_report(metrics_file, results, run_summary)
+    
+    if incremental:
+        update_manifest(manifest, dict_files + archive_files, results + archive_results, rules_fingerprint)
+        save_manifest(manifest)
+    results = archive_results + delta_results + results
+    
+    # 统计总结果
+    total_results = {
+        'modified': 0,
+        'multi_modified': 0, 
+        'added': 0,
+        'deleted': 0,
+        'success_count': 0,
+        'fail_count': 0
+    }
+    
+    for result in results:
         if result['success']:
             total_results['modified'] += result['modified']
             total_results['multi_modified'] += result['multi_modified']
@@ -615,49 +3732,877 @@ def main_optimized():
     print(f"  • 多字词修改: {total_results['multi_modified']} 条") 
     print(f"  • 新增词条: {total_results['added']} 条")
     print(f"  • 删除词条: {total_results['deleted']} 条")
+    if weight_plan['rules'] or weight_plan['userdb']:
+        print(f"  • 调整词频: {sum(result.get('weighted', 0) for result in results if result['success'])} 条")
     
     # 清空缓存
     clear_cache()
     return True
 
-# ========================================================
+# ==================== 监视模式 ====================
 
-def benchmark():
-    """性能测试函数"""
-    import time
-    start_time = time.time()
+def get_rule_delta_chars(old_rules, new_rules):
+    """比较新旧规则，返回变化（新增、修改、移除）的规则涉及的汉字
     
-    print("=" * 60)
-    print("开始性能测试...")
-    print("=" * 60)
+    处理本身是幂等的：不含这些字的行在新旧规则下结果相同，无需重新处理
+    """
+    old_mods, old_multi_mods, _, old_deletions = old_rules
+    new_mods, new_multi_mods, _, new_deletions = new_rules
+    
+    changed_mods = {key for key in old_mods.keys() | new_mods.keys() if old_mods.get(key) != new_mods.get(key)}
+    changed_multi_mods = {word for word in old_multi_mods.keys() | new_multi_mods.keys()
+                          if old_multi_mods.get(word) != new_multi_mods.get(word)}
+    changed_deletions = old_deletions ^ new_deletions
+    return build_rule_char_set(dict.fromkeys(changed_mods), changed_multi_mods, changed_deletions)
+
+def snapshot_watched_files(rule_sources):
+    """记录被监视文件的 (大小, 修改时间)"""
+    snapshot = {path: get_source_stat(path) for path in rule_sources}
+    for file_path in glob.glob(os.path.join(DICTS_FOLDER, '*.yaml')):
+        snapshot[os.path.normpath(file_path)] = get_source_stat(file_path)
+    return snapshot
+
+def iter_change_batches_polling(rule_sources):
+    """轮询方式监视文件变化，每批产出一组变化的路径（连续变化经防抖合并）"""
+    snapshot = snapshot_watched_files(rule_sources)
+    pending = set()
+    last_change = None
+    while True:
+        time.sleep(WATCH_POLL_INTERVAL if not pending else min(WATCH_POLL_INTERVAL, WATCH_DEBOUNCE))
+        current = snapshot_watched_files(rule_sources)
+        changed = {path for path in current.keys() | snapshot.keys() if current.get(path) != snapshot.get(path)}
+        snapshot = current
+        if changed:
+            pending |= changed
+            last_change = time.monotonic()
+        elif pending and time.monotonic() - last_change >= WATCH_DEBOUNCE:
+            yield pending
+            pending = set()
+
+def iter_change_batches_watchdog(rule_sources):
+    """用 watchdog（Linux 下为 inotify）监视文件变化"""
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    import queue
+    
+    events = queue.Queue()
     
+    class ChangeHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            for path in (getattr(event, 'src_path', None), getattr(event, 'dest_path', None)):
+                if path:
+                    events.put(os.path.normpath(path))
+    
+    observer = Observer()
+    handler = ChangeHandler()
+    for folder in {os.path.dirname(os.path.abspath(path)) for path in rule_sources} | {os.path.abspath(DICTS_FOLDER)}:
+        if os.path.isdir(folder):
+            observer.schedule(handler, folder, recursive=False)
+    observer.start()
     try:
-        # 运行主函数
-        success = main_optimized()
-        
-        end_time = time.time()
-        execution_time = end_time - start_time
+        while True:
+            pending = {events.get()}
+            # 防抖：直到静默 WATCH_DEBOUNCE 秒才交出这一批
+            while True:
+                try:
+                    pending.add(events.get(timeout=WATCH_DEBOUNCE))
+                except queue.Empty:
+                    break
+            yield pending
+    finally:
+        observer.stop()
+        observer.join()
+
+def create_worker_pool(rules, worker_count):
+    """创建常驻进程池，规则表通过初始化函数每个进程只传一次"""
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=worker_count, initializer=init_worker_rules,
+                               initargs=compact_rules(*rules) + (False, _weight_plan, get_config_snapshot()))
+
+def save_worker_rules(rules, previous_path=None):
+    """把新规则（和词频调整计划）写到临时文件，供常驻进程池的工作进程重新加载（并删除上一份），返回文件路径"""
+    if previous_path and os.path.exists(previous_path):
+        os.remove(previous_path)
+    fd, path = tempfile.mkstemp(prefix='wanxiang_rules_', suffix='.pickle')
+    with open(fd, 'wb') as f:
+        pickle.dump(compact_rules(*rules) + (False, _weight_plan, get_config_snapshot()), f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+# 工作进程当前规则表所来自的文件（None 为进程池初始化时收到的规则）
+_worker_rules_file = None
+
+def run_task_with_rules(rules_file, task, *args):
+    """工作进程任务：规则已更新（rules_file 与本进程上次加载的不同）时先重新加载规则表，每个进程只加载一次"""
+    global _worker_rules_file
+    if rules_file != _worker_rules_file:
+        with open(rules_file, 'rb') as f:
+            init_worker_rules(*pickle.load(f))
+        _worker_rules_file = rules_file
+    return task(*args)
+
+def run_watch_batch(pool, rules, tasks, manifest, dict_files, rules_file=None):
+    """处理一批文件：tasks 为 {文件路径: 预筛字符集或 None（全部规则）}
+    
+    用户扩展文件最后处理，跳过其他词库（本批结果或增量清单记录）中已有的新增词条。
+    rules_file 为规则更新后 save_worker_rules 写出的文件，进程池的工作进程据此换用新规则
+    """
+    others, extend_files = split_user_extend_file(list(tasks))
+    results = []
+    for batch in (others, extend_files):
+        add_duplicates = None
+        if batch is extend_files:
+            add_duplicates = collect_addition_duplicates(results, manifest, set(dict_files).difference(others))
+        if pool is None:
+            for file_path in batch:
+                result = process_single_dict_file((file_path,) + tuple(rules), tasks[file_path], add_duplicates)
+                results.append(result)
+                print_parallel_result(result)
+            continue
         
-        print("\n" + "=" * 60)
-        print("性能测试结果:")
-        print("=" * 60)
-        print(f"总执行时间: {execution_time:.2f} 秒")
-        print(f"状态: {'成功' if success else '失败'}")
+        futures = {pool.submit(run_task_with_rules, rules_file, process_dict_file_task, file_path, tasks[file_path],
+                               add_duplicates): file_path
+                   for file_path in batch}
+        for future, file_path in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'filename': os.path.basename(file_path), 'success': False, 'error': str(e)}
+            results.append(result)
+            print_parallel_result(result)
+    return results
+
+def watch():
+    """监视模式：常驻内存保存已解析的规则和进程池，词库或规则文件变化时只处理受影响的文件"""
+    import multiprocessing
+    
+    rule_sources = [os.path.normpath(path) for path in get_rule_sources() + [WEIGHTS_FILE] + list_userdb_files()
+                    if path]
+    import importlib.util
+    if importlib.util.find_spec('watchdog') is not None:
+        change_batches = iter_change_batches_watchdog(rule_sources)
+        print("监视模式：使用文件系统事件（watchdog）")
+    else:
+        change_batches = iter_change_batches_polling(rule_sources)
+        print(f"监视模式：未安装 watchdog，改为每 {WATCH_POLL_INTERVAL} 秒轮询一次")
+    
+    # 启动时先按增量模式处理一遍，保证词库与当前规则一致
+    main_optimized()
+    clear_cache()
+    rules = fill_rules_aux_codes(load_rules())
+    weight_plan = prepare_weight_plan(rules)
+    worker_count = MAX_WORKERS or multiprocessing.cpu_count()
+    pool = create_worker_pool(rules, worker_count) if USE_PARALLEL and worker_count > 1 else None
+    rules_file = None
+    manifest = load_manifest()
+    rules_fingerprint = get_rules_fingerprint(*rules)
+    
+    print(f"开始监视 {DICTS_FOLDER} 和规则文件，按 Ctrl+C 退出")
+    try:
+        for changed_paths in change_batches:
+            tasks = {}
+            delta_files = []
+            dict_files = {os.path.normpath(path) for path in get_dict_files()}
+            
+            # 规则文件变化：重新加载，只用变化的规则涉及的字做预筛
+            if changed_paths & set(rule_sources):
+                clear_cache()
+                new_rules = fill_rules_aux_codes(load_rules())
+                delta_chars = get_rule_delta_chars(rules, new_rules)
+                adds_changed = rules[2] != new_rules[2]
+                # 词频规则（或参考词库的词频范围）变化：新旧规则作用到的词库都要重新执行
+                new_weight_plan = prepare_weight_plan(new_rules)
+                weight_rules_changed = (new_weight_plan['rules'] != weight_plan['rules']
+                                        or new_weight_plan['references'] != weight_plan['references'])
+                weight_files = set()
+                if weight_rules_changed:
+                    weight_files = {file_path for file_path in dict_files if get_file_weight_rules(
+                        os.path.basename(file_path), weight_plan['rules'] + new_weight_plan['rules'])}
+                # 用户词典快照变化（同步后）：所有词库都要重新混合用户词频
+                userdb_changed = new_weight_plan['userdb_fingerprint'] != weight_plan['userdb_fingerprint']
+                if userdb_changed:
+                    weight_files = set(dict_files)
+                weight_plan = new_weight_plan
+                old_fingerprint = rules_fingerprint
+                rules = new_rules
+                rules_fingerprint = get_rules_fingerprint(*rules)
+                if pool is not None:
+                    # 进程池常驻不重建：新规则写到临时文件，各工作进程在下一个任务前重新加载
+                    rules_file = save_worker_rules(rules, rules_file)
+                print(f"规则已更新：{len(delta_chars)} 个字的规则有变化{'，新增词条有变化' if adds_changed else ''}"
+                      f"{'，词频规则有变化' if weight_rules_changed else ''}"
+                      f"{'，用户词频有变化' if userdb_changed else ''}")
+                if (delta_chars or adds_changed) and USE_REVERSE_INDEX:
+                    # 反向索引直接定位含变化规则字的行，只重写这些行（新增词条变化时顺带按索引查重）
+                    delta_files, _ = split_delta_files(sorted(dict_files), manifest, old_fingerprint)
+                    delta_results = process_rule_delta(delta_files, rules, delta_chars)
+                    update_manifest(manifest, delta_files, delta_results, rules_fingerprint)
+                
+                def rule_chars_for(file_path):
+                    """上次已按旧规则完整处理过的文件只需处理变化规则涉及的字，其他文件（如上次处理失败）用全部规则"""
+                    entry = manifest['files'].get(os.path.basename(file_path))
+                    return delta_chars if is_file_unchanged(file_path, entry, old_fingerprint) else None
+                
+                if delta_chars or adds_changed:
+                    tasks = {file_path: rule_chars_for(file_path) for file_path in dict_files.difference(delta_files)}
+                for file_path in weight_files.difference(delta_files):
+                    tasks.setdefault(file_path, rule_chars_for(file_path))
+                if adds_changed:
+                    user_extend_path = os.path.normpath(os.path.join(DICTS_FOLDER, USER_EXTEND_FILE))
+                    tasks.setdefault(user_extend_path, rule_chars_for(user_extend_path))
+                # 不受影响的文件在新规则下结果不变，直接把清单记录转到新规则指纹下
+                for file_path in dict_files - tasks.keys():
+                    entry = manifest['files'].get(os.path.basename(file_path))
+                    if is_file_unchanged(file_path, entry, old_fingerprint):
+                        entry['rules'] = rules_fingerprint
+            
+            # 词库文件变化（如被更新脚本替换）：用全部规则处理；自己刚写出的文件不会重复处理
+            changed_dicts = [path for path in changed_paths if path in dict_files and os.path.exists(path)]
+            files_to_process, _ = filter_unchanged_files(changed_dicts, manifest, rules_fingerprint)
+            for file_path in files_to_process:
+                tasks[file_path] = None
+            
+            if tasks:
+                print(f"\n检测到变化，处理 {len(tasks)} 个文件...")
+                results = run_watch_batch(pool, rules, tasks, manifest, dict_files, rules_file)
+                update_manifest(manifest, list(tasks), results, rules_fingerprint)
+            if tasks or delta_files:
+                save_manifest(manifest)
+    except KeyboardInterrupt:
+        print("\n退出监视模式")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if rules_file and os.path.exists(rules_file):
+            os.remove(rules_file)
+        clear_cache()
+
+# ==================== 词库快照与查询 ====================
+
+SNAPSHOT_MAGIC = b'WXSNAP01'
+SNAPSHOT_VERSION = 1
+# 快照各列的类型：字符串表（偏移 + UTF-8 数据）、每个词条一行的定长列、按词/拼音/辅助码排序的序号列、按字的倒排列
+SNAPSHOT_COLUMNS = (
+    ('str_offsets', 'Q'), ('str_data', 'B'),
+    ('word', 'I'), ('syl_start', 'I'), ('syllable', 'I'), ('code', 'I'), ('weight', 'q'), ('file', 'H'),
+    ('word_order', 'I'), ('pinyin_order', 'I'), ('code_order', 'I'),
+    ('char_key', 'I'), ('char_start', 'I'), ('char_entry', 'I'),
+)
+# 去掉声调时删除的组合符号（保留 ü 的分音符）
+TONE_MARKS = {'\u0300', '\u0301', '\u0304', '\u030c'}
+
+def get_snapshot_path():
+    """词库快照文件路径"""
+    return os.path.join(DICTS_FOLDER, SNAPSHOT_FILE)
+
+def list_snapshot_files():
+    """快照收录的词库（与 get_dict_files 相同的筛选，但不创建文件、不输出）"""
+    return sorted(path for path in glob.glob(os.path.join(DICTS_FOLDER, '*.yaml'))
+                  if os.path.basename(path) not in EXCLUDE_FILES)
+
+def normalize_pinyin(pinyin):
+    """拼音查询键：去声调、转小写、v 视为 ü，多个音节以单个空格分隔"""
+    import unicodedata
+    decomposed = unicodedata.normalize('NFD', pinyin.lower().replace('v', 'ü'))
+    toneless = unicodedata.normalize('NFC', ''.join(ch for ch in decomposed if ch not in TONE_MARKS))
+    return ' '.join(toneless.split())
+
+def iter_dict_entries(file_path):
+    """逐条产出词库正文中的词条：(词, [(音节, 辅助码), ...], 词频)，没有词频时为 -1"""
+    with open(file_path, 'rb') as fin, contextlib.ExitStack() as stack:
+        if os.fstat(fin.fileno()).st_size == 0:
+            return
+        buf = stack.enter_context(mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ))
+        pos = find_body_start(buf)
+        if pos is None:
+            return
+        buf.seek(pos)
+        for raw in iter(buf.readline, b''):
+            line = raw.decode('utf-8').rstrip('\r\n')
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split('\t')
+            if len(parts) < 2:
+                continue
+            syllables = [part.partition(';')[::2] for part in parts[1].split()]
+            weight = parts[2].strip() if len(parts) > 2 else ''
+            yield parts[0], syllables, int(weight) if weight.isdigit() else -1
+
+def build_snapshot(dict_files=None, path=None):
+    """把所有词库写成一个列式快照文件：字符串全部去重后只存一份，词条各字段存为定长数组列"""
+    start_time = time.time()
+    dict_files = list_snapshot_files() if dict_files is None else sorted(dict_files)
+    path = path or get_snapshot_path()
+    string_ids = {'': 0}
+    columns = {name: array(typecode) for name, typecode in SNAPSHOT_COLUMNS}
+    columns['syl_start'].append(0)
+    intern = lambda text: string_ids.setdefault(text, len(string_ids))
+    chars = {}
+    file_stats = []
+    for file_id, file_path in enumerate(dict_files):
+        file_stats.append([os.path.basename(file_path), *get_source_stat(file_path)])
+        for word, syllables, weight in iter_dict_entries(file_path):
+            entry_id = len(columns['word'])
+            columns['word'].append(intern(word))
+            for syllable, code in syllables:
+                columns['syllable'].append(intern(syllable))
+                columns['code'].append(intern(code))
+            columns['syl_start'].append(len(columns['syllable']))
+            columns['weight'].append(weight)
+            columns['file'].append(file_id)
+            for char in set(word):
+                chars.setdefault(char, []).append(entry_id)
+
+    strings = list(string_ids)
+    entry_count = len(columns['word'])
+    syl_start, syllable, code = columns['syl_start'], columns['syllable'], columns['code']
+    pinyin_keys = [normalize_pinyin(' '.join(strings[s] for s in syllable[syl_start[i]:syl_start[i + 1]]))
+                   for i in range(entry_count)]
+    code_keys = [' '.join(strings[c] for c in code[syl_start[i]:syl_start[i + 1]]) for i in range(entry_count)]
+    columns['word_order'].extend(sorted(range(entry_count), key=lambda i: strings[columns['word'][i]]))
+    columns['pinyin_order'].extend(sorted(range(entry_count), key=pinyin_keys.__getitem__))
+    columns['code_order'].extend(sorted(range(entry_count), key=code_keys.__getitem__))
+    columns['char_start'].append(0)
+    for char in sorted(chars):
+        columns['char_key'].append(intern(char))
+        columns['char_entry'].extend(chars[char])
+        columns['char_start'].append(len(columns['char_entry']))
+
+    # 字符串表放在最后生成，字的键也已加入
+    strings = list(string_ids)
+    data = bytearray()
+    columns['str_offsets'].append(0)
+    for text in strings:
+        data += text.encode('utf-8')
+        columns['str_offsets'].append(len(data))
+    columns['str_data'] = array('B', data)
+
+    # 文件头（JSON）之后各列按 8 字节对齐依次存放，打开时用 mmap 直接映射，不需要解析
+    layout = {}
+    offset = 0
+    for name, typecode in SNAPSHOT_COLUMNS:
+        offset = (offset + 7) & ~7
+        nbytes = len(columns[name]) * columns[name].itemsize
+        layout[name] = [typecode, offset, nbytes]
+        offset += nbytes
+    header = json.dumps({'version': SNAPSHOT_VERSION, 'byteorder': sys.byteorder, 'entries': entry_count,
+                         'files': file_stats, 'columns': layout}, ensure_ascii=False).encode('utf-8')
+    data_start = (len(SNAPSHOT_MAGIC) + 8 + len(header) + 7) & ~7
+    temp_file = path + '.tmp'
+    try:
+        with open(temp_file, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC + len(header).to_bytes(8, 'little') + header)
+            for name, _ in SNAPSHOT_COLUMNS:
+                f.write(b'\0' * (data_start + layout[name][1] - f.tell()))
+                columns[name].tofile(f)
+        os.replace(temp_file, path)
+    except Exception:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    print(f"词库快照已生成: {len(dict_files)} 个词库，{entry_count} 条词条，{len(strings)} 个不同字符串，"
+          f"{format_size(os.path.getsize(path))}，耗时 {time.time() - start_time:.2f} 秒")
+    return path
+
+def read_snapshot_header(path):
+    """读取快照文件头，文件缺失、损坏或版本不符时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                return None
+            header = json.loads(f.read(int.from_bytes(f.read(8), 'little')).decode('utf-8'))
+            header['data_start'] = (f.tell() + 7) & ~7
+    except (OSError, ValueError):
+        return None
+    if header.get('version') != SNAPSHOT_VERSION or header.get('byteorder') != sys.byteorder:
+        return None
+    return header
+
+def is_snapshot_current(header):
+    """快照是否与词库目录一致（只比较文件名、大小和修改时间）"""
+    current = [[os.path.basename(path), *get_source_stat(path)] for path in list_snapshot_files()]
+    return header is not None and header['files'] == current
+
+@contextlib.contextmanager
+def open_snapshot(path=None, rebuild=True):
+    """以 mmap 打开快照，各列为直接映射文件的 memoryview；词库有变化时先重建快照"""
+    path = path or get_snapshot_path()
+    header = read_snapshot_header(path)
+    if rebuild and not is_snapshot_current(header):
+        print("词库快照不存在或已过期，正在重建...")
+        build_snapshot(path=path)
+        header = read_snapshot_header(path)
+    if header is None:
+        raise ValueError(f"无法读取词库快照: {path}")
+    data_start = header['data_start']
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        view = memoryview(buf)
+        snapshot = {'header': header, 'files': [item[0] for item in header['files']]}
+        try:
+            for name, (typecode, offset, nbytes) in header['columns'].items():
+                snapshot[name] = view[data_start + offset:data_start + offset + nbytes].cast(typecode)
+            yield snapshot
+        finally:
+            for name in header['columns']:
+                if name in snapshot:
+                    snapshot[name].release()
+            view.release()
+
+def snapshot_string(snapshot, string_id):
+    """按编号取出快照中的字符串"""
+    offsets = snapshot['str_offsets']
+    return str(snapshot['str_data'][offsets[string_id]:offsets[string_id + 1]], 'utf-8')
+
+def snapshot_entry_parts(snapshot, entry_id):
+    """词条的 (音节, 辅助码) 列表"""
+    start, end = snapshot['syl_start'][entry_id], snapshot['syl_start'][entry_id + 1]
+    return [(snapshot_string(snapshot, snapshot['syllable'][i]), snapshot_string(snapshot, snapshot['code'][i]))
+            for i in range(start, end)]
+
+def snapshot_entry(snapshot, entry_id):
+    """把快照中的一条词条还原为 (文件名, 词, 编码, 词频)"""
+    encoding = ' '.join(f"{syllable};{code}" if code else syllable
+                        for syllable, code in snapshot_entry_parts(snapshot, entry_id))
+    weight = snapshot['weight'][entry_id]
+    return (snapshot['files'][snapshot['file'][entry_id]], snapshot_string(snapshot, snapshot['word'][entry_id]),
+            encoding, '' if weight < 0 else weight)
+
+def search_sorted(order, key_of, target, prefix=False):
+    """在按键排好序的序号列中二分查找，返回键等于（或以其开头）target 的词条编号"""
+    lo, hi = 0, len(order)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key_of(order[mid]) < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    matches = []
+    for pos in range(lo, len(order)):
+        key = key_of(order[pos])
+        if not (key.startswith(target) if prefix else key == target):
+            break
+        matches.append(order[pos])
+    return matches
+
+def query_snapshot(snapshot, word=None, char=None, pinyin=None, code=None):
+    """按词、字、拼音（不区分声调）或辅助码前缀查询，多个条件同时给出时取交集，结果按词频降序"""
+    candidates = []
+    if word:
+        candidates.append(search_sorted(snapshot['word_order'],
+                                        lambda i: snapshot_string(snapshot, snapshot['word'][i]), word))
+    if char:
+        keys = snapshot['char_key']
+        index = search_sorted(range(len(keys)), lambda i: snapshot_string(snapshot, keys[i]), char)
+        candidates.append(snapshot['char_entry'][snapshot['char_start'][index[0]]:
+                                                 snapshot['char_start'][index[0] + 1]].tolist() if index else [])
+    if pinyin:
+        pinyin_key = lambda i: normalize_pinyin(' '.join(s for s, _ in snapshot_entry_parts(snapshot, i)))
+        candidates.append(search_sorted(snapshot['pinyin_order'], pinyin_key, normalize_pinyin(pinyin)))
+    if code:
+        code_key = lambda i: ' '.join(c for _, c in snapshot_entry_parts(snapshot, i))
+        candidates.append(search_sorted(snapshot['code_order'], code_key, code, prefix=True))
+    if not candidates:
+        return []
+    candidates.sort(key=len)
+    matches = set(candidates[0]).intersection(*candidates[1:])
+    return sorted(matches, key=lambda i: (-snapshot['weight'][i], i))
+
+def query(word=None, char=None, pinyin=None, code=None, limit=50):
+    """命令行查询入口：打印匹配的词条"""
+    if not any((word, char, pinyin, code)):
+        print("错误：query 需要至少指定 --word、--char、--pinyin、--code 之一")
+        return []
+    with open_snapshot() as snapshot:
+        start_time = time.perf_counter()
+        matches = query_snapshot(snapshot, word=word, char=char, pinyin=pinyin, code=code)
+        entries = [snapshot_entry(snapshot, entry_id) for entry_id in matches[:limit]]
+        elapsed = (time.perf_counter() - start_time) * 1000
+    for filename, entry_word, encoding, weight in entries:
+        print(f"{filename}\t{entry_word}\t{encoding}\t{weight}")
+    more = f"，仅显示前 {limit} 条" if len(matches) > limit else ""
+    print(f"共 {len(matches)} 条{more}，查询耗时 {elapsed:.2f} 毫秒")
+    return entries
+
+# ==================== 库接口与批量模式 ====================
+
+class UserDictTransformer:
+    """库接口：按一份配置（用户配置区域中的常量名 → 值，未给出的沿用模块默认值）加载规则，
+    处理整个词库目录、单个词库文件或任意词条行
+    
+    用法：
+        transformer = UserDictTransformer({'DICTS_FOLDER': '/path/dicts/', 'MODS_FILE': '/path/modifications.txt'})
+        transformer.run()
+        lines = list(transformer.transform_lines(['的\tde;ab\t100']))
+    """
+    
+    def __init__(self, config=None, **overrides):
+        config = dict(config or {}, **overrides)
+        unknown = set(config) - set(CONFIG_NAMES)
+        if unknown:
+            raise ValueError(f"未知的配置项: {', '.join(sorted(unknown))}")
+        self.config = {name: globals()[name] for name in CONFIG_NAMES}
+        self.config.update(config)
+        self._rules = None
+        self._previous_rules = None
+    
+    @contextlib.contextmanager
+    def activated(self):
+        """在本配置下执行：临时替换模块级配置，结束后恢复"""
+        with _config_lock:
+            saved = override_config(**self.config)
+            clear_cache()
+            try:
+                yield self
+            finally:
+                globals().update(saved)
+                clear_cache()
+    
+    def get_rule_sources(self):
+        """本配置使用的规则文件，规则文件相同的配置可以共用已解析的规则"""
+        return tuple(os.path.abspath(self.config[name])
+                     for name in ('MODS_FILE', 'ADDS_FILE', 'DELETIONS_FILE', 'NEUTRAL_TONE_FILE'))
+    
+    def share_rules(self, other):
+        """沿用另一个转换器已解析的规则（两者的规则文件必须相同）"""
+        self._rules = other.rules
+        self._previous_rules = other._previous_rules
+    
+    @property
+    def rules(self):
+        """已解析的规则 (mods, multi_mods, adds, deletions)，第一次用到时加载"""
+        return self.prepare_rules()
+    
+    def prepare_rules(self, dry_run=False):
+        """加载规则（已加载时直接返回），dry_run=True 时不写入规则缓存"""
+        if self._rules is None:
+            with self.activated():
+                self._rules = load_rules(dry_run)
+                self._previous_rules = _config_cache.get('previous_rules')
+        return self._rules
+    
+    def transform_lines(self, lines):
+        """处理任意可迭代的词条行，逐行产出处理后的行（不含换行符），被删除的行不产出
         
-        return execution_time
+        不含制表符的行（元数据、注释）原样产出；新增词条只在处理用户扩展文件时插入
+        """
+        with self.activated():
+            mods, multi_mods, _, deletions = fill_rules_aux_codes(self.rules)
+        rule_chars = build_rule_char_set(mods, multi_mods, deletions)
+        stats = {'modified': 0, 'multi_modified': 0, 'deleted': 0}
+        for line in lines:
+            processed_line = apply_rules_to_line(line.rstrip('\r\n'), mods, multi_mods, deletions, stats,
+                                                 rule_chars=rule_chars)
+            if processed_line is not None:
+                yield processed_line
+    
+    def transform_file(self, file_path, output_path=None):
+        """处理单个词库文件，返回与 process_single_dict_file 相同格式的结果
         
-    except Exception as e:
-        end_time = time.time()
-        execution_time = end_time - start_time
-        print(f"\n错误: {e}")
-        print(f"执行时间: {execution_time:.2f} 秒")
-        return execution_time
+        给出 output_path 时原文件保持不变，处理结果写到 output_path
+        """
+        rules = self.rules
+        filename = os.path.basename(file_path)
+        if output_path is not None:
+            shutil.copyfile(file_path, output_path)
+            file_path = output_path
+        with self.activated():
+            # 词频规则按原文件名匹配，在同一遍重写中调整
+            rules = fill_rules_aux_codes(rules)
+            prepare_weight_plan(rules)
+            return process_single_dict_file((file_path,) + tuple(rules), filename=filename)
+    
+    def run(self, force_full=False, dry_run=False, show_diff=False, metrics_file=None, shared_pool=None, archive=None):
+        """按本配置处理整个词库目录（与命令行 run 相同，archive 为更新包路径时先直接处理包内的词库）"""
+        rules = self.prepare_rules(dry_run)
+        with self.activated():
+            if self._previous_rules is not None:
+                # 让增量模式按规则变化局部更新
+                _config_cache['previous_rules'] = self._previous_rules
+            return main_optimized(force_full, dry_run, show_diff, metrics_file, rules=rules, shared_pool=shared_pool,
+                                  archive=archive)
+
+def run_profiles(profiles, force_full=False, dry_run=False, metrics_file=None):
+    """批量模式：依次处理多份配置（配置字典或 UserDictTransformer），返回各配置是否成功
+    
+    规则文件相同的配置只解析一次规则，并共用一个进程池
+    """
+    transformers = [profile if isinstance(profile, UserDictTransformer) else UserDictTransformer(profile)
+                    for profile in profiles]
+    groups = {}
+    for transformer in transformers:
+        groups.setdefault(transformer.get_rule_sources(), []).append(transformer)
+    
+    outcomes = {}
+    for group in groups.values():
+        group[0].prepare_rules(dry_run)
+        for transformer in group[1:]:
+            transformer.share_rules(group[0])
+        shared_pool = {'executor': None, 'rules': None}
+        try:
+            for transformer in group:
+                print(f"\n{'#' * 50}\n配置 {transformers.index(transformer) + 1}/{len(transformers)}: "
+                      f"{transformer.config['DICTS_FOLDER']}\n{'#' * 50}")
+                try:
+                    outcomes[id(transformer)] = transformer.run(force_full, dry_run, metrics_file=metrics_file,
+                                                                shared_pool=shared_pool)
+                except Exception as e:
+                    print(f"✗ 处理出错: {e}")
+                    outcomes[id(transformer)] = False
+        finally:
+            if shared_pool['executor'] is not None:
+                shared_pool['executor'].shutdown()
+    return [outcomes[id(transformer)] for transformer in transformers]
+
+def load_profiles(path):
+    """读取批量模式的配置文件（JSON 数组，每项为一份配置）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        profiles = json.load(f)
+    if not isinstance(profiles, list) or not all(isinstance(profile, dict) for profile in profiles):
+        raise ValueError(f"配置文件 {path} 应为 JSON 数组，每项为一份配置")
+    return profiles
+
+# ========================================================
+
+# 合成词库用的拼音音节（带声调）
+BENCH_SYLLABLES = ['ā', 'bā', 'bǎo', 'cháng', 'dà', 'de', 'fēng', 'guó', 'hǎo', 'jiā', 'kě', 'lǐ',
+                   'mén', 'nǐ', 'píng', 'qī', 'rén', 'shān', 'tiān', 'wǒ', 'xīn', 'yī', 'zhōng', 'zǐ']
+
+def strip_tone(pinyin):
+    """去掉拼音声调（合成轻声对应表用）"""
+    import unicodedata
+    decomposed = unicodedata.normalize('NFD', pinyin)
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+def generate_benchmark_data(root, total_lines, seed=0):
+    """在 root 下生成万象格式的合成词库和配套规则文件，返回 (词库目录, 规则目录)"""
+    import random
+    rng = random.Random(seed)
+    dicts_folder = os.path.join(root, 'dicts')
+    rules_folder = os.path.join(root, 'cn_dicts_user')
+    os.makedirs(dicts_folder, exist_ok=True)
+    os.makedirs(rules_folder, exist_ok=True)
+    
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    def aux_code():
+        return rng.choice(letters) + rng.choice(letters)
+    
+    # 单字表：每个字固定一个读音和辅助码
+    char_count = max(100, min(20000, total_lines // 10))
+    chars = [(chr(0x4E00 + i), rng.choice(BENCH_SYLLABLES), aux_code()) for i in range(char_count)]
+    
+    def write_dict(filename, name, lines):
+        with open(os.path.join(dicts_folder, filename), 'w', encoding='utf-8') as f:
+            f.write(f"# Rime dictionary\n---\nname: {name}\nversion: \"LTS\"\nsort: by_weight\n...\n")
+            f.writelines(lines)
+    
+    def word_line(length):
+        picked = [rng.choice(chars) for _ in range(length)]
+        word = ''.join(hanzi for hanzi, _, _ in picked)
+        encoding = ' '.join(f"{pinyin};{code}" for _, pinyin, code in picked)
+        return f"{word}\t{encoding}\t{rng.randint(1, 1000)}\n"
+    
+    # 单字库（用户扩展文件）、大词库、小词库按 1:6:3 分配行数
+    write_dict(USER_EXTEND_FILE, USER_EXTEND_FILE.replace('.dict.yaml', ''),
+               [f"{hanzi}\t{pinyin};{code}\t{rng.randint(1, 1000)}\n" for hanzi, pinyin, code in chars])
+    word_lines = max(0, total_lines - char_count)
+    write_dict('base.dict.yaml', 'base', [word_line(rng.randint(2, 4)) for _ in range(word_lines * 2 // 3)])
+    write_dict('place.pro.dict.yaml', 'place', [word_line(rng.randint(2, 3)) for _ in range(word_lines - word_lines * 2 // 3)])
+    
+    # 规则：约一半单字刷新辅助码，部分字带轻声读法，少量多字词修改、新增和删除
+    with open(os.path.join(rules_folder, 'modifications.txt'), 'w', encoding='utf-8') as f:
+        for hanzi, pinyin, _ in chars[::2]:
+            f.write(f"{hanzi}\t{pinyin};{aux_code()}\n")
+        for _ in range(max(1, char_count // 50)):
+            f.write(word_line(2))
+    with open(os.path.join(rules_folder, 'neutral_tone.txt'), 'w', encoding='utf-8') as f:
+        for hanzi, pinyin, _ in chars[::7]:
+            if strip_tone(pinyin) != pinyin:
+                f.write(f"{hanzi}\t{strip_tone(pinyin)}\t{pinyin}\n")
+    with open(os.path.join(rules_folder, 'additions.txt'), 'w', encoding='utf-8') as f:
+        f.writelines(word_line(2) for _ in range(max(1, char_count // 20)))
+    with open(os.path.join(rules_folder, 'deletions.txt'), 'w', encoding='utf-8') as f:
+        for hanzi, pinyin, code in chars[1::40]:
+            f.write(f"{hanzi}\t{pinyin};{code}\n")
+    
+    return dicts_folder, rules_folder
+
+def get_folder_size(folder):
+    """统计目录下词库文件的总字节数和总行数"""
+    total_bytes = 0
+    total_lines = 0
+    for file_path in glob.glob(os.path.join(folder, '*.yaml')):
+        total_bytes += os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            total_lines += sum(block.count(b'\n') for block in iter(lambda: f.read(1 << 20), b''))
+    return total_bytes, total_lines
+
+def override_config(**values):
+    """临时替换模块级配置，返回恢复用的原值"""
+    saved = {name: globals()[name] for name in values}
+    globals().update(values)
+    return saved
+
+def benchmark_once(total_lines, seed=0):
+    """对一种规模的合成词库分阶段计时，比较串行、线程池与进程池模式"""
+    
+    with tempfile.TemporaryDirectory(prefix='wanxiang_bench_') as root:
+        pristine_dicts, rules_folder = generate_benchmark_data(os.path.join(root, 'src'), total_lines, seed)
+        total_bytes, file_lines = get_folder_size(pristine_dicts)
+        saved = override_config(
+            MODS_FILE=os.path.join(rules_folder, 'modifications.txt'),
+            ADDS_FILE=os.path.join(rules_folder, 'additions.txt'),
+            DELETIONS_FILE=os.path.join(rules_folder, 'deletions.txt'),
+            NEUTRAL_TONE_FILE=os.path.join(rules_folder, 'neutral_tone.txt'),
+            EXCLUDE_FILES=[],
+        )
+        try:
+            record = {'lines': file_lines, 'bytes': total_bytes, 'phases': {}, 'modes': {}}
+            phases = record['phases']
+            
+            with contextlib.redirect_stdout(io.StringIO()):
+                # 规则加载（解析四个规则文件）
+                clear_cache()
+                phase_start = time.perf_counter()
+                neutral_tone_map = load_neutral_tone_map()
+                mods, multi_mods = load_modifications()
+                adds = load_additions()
+                deletions = load_deletions()
+                phases['load_rules'] = time.perf_counter() - phase_start
+                
+                # 轻声扩展
+                phase_start = time.perf_counter()
+                mods, multi_mods = expand_modifications_with_neutral_tone(mods, multi_mods, neutral_tone_map)
+                phases['neutral_expand'] = time.perf_counter() - phase_start
+                clear_cache()
+            record['rules'] = {'mods': len(mods), 'multi_mods': len(multi_mods),
+                               'adds': len(adds), 'deletions': len(deletions)}
+            
+            defer_user_extend = build_addition_probe(adds, mods, multi_mods, deletions) is not None
+            for mode in ('sequential', 'thread', 'parallel', 'pipeline'):
+                # 每种模式都从同一份原始词库开始
+                dicts_folder = os.path.join(root, mode)
+                shutil.copytree(pristine_dicts, dicts_folder)
+                dict_files = sorted(glob.glob(os.path.join(dicts_folder, '*.yaml')))
+                
+                with contextlib.redirect_stdout(io.StringIO()):
+                    phase_start = time.perf_counter()
+                    if mode == 'sequential':
+                        results = process_dict_files_sequential(dict_files, mods, multi_mods, adds, deletions)
+                    elif mode == 'pipeline':
+                        results = process_dict_files_pipelined(dict_files, mods, multi_mods, adds, deletions)
+                    else:
+                        # 强制指定执行方式，不经过自动调度
+                        schedule = plan_schedule(dict_files, 'thread' if mode == 'thread' else 'process',
+                                                 defer_user_extend)
+                        results = process_dict_files_parallel(dict_files, mods, multi_mods, adds, deletions,
+                                                              schedule=schedule)
+                    wall = time.perf_counter() - phase_start
+                
+                file_timings = [result.get('timings', {}) for result in results]
+                record['modes'][mode] = {
+                    'wall': wall,
+                    'process_files': sum(t.get('total', 0.0) for t in file_timings),
+                    'sort': sum(t.get('sort', 0.0) for t in file_timings),
+                    'write': sum(t.get('write', 0.0) + t.get('commit', 0.0) for t in file_timings),
+                    'lines_per_sec': file_lines / wall if wall else 0.0,
+                    'mb_per_sec': total_bytes / (1024 * 1024) / wall if wall else 0.0,
+                    'success': all(result.get('success') for result in results),
+                }
+            
+            # 各模式的输出必须逐字节一致
+            record['outputs_match'] = all(
+                files_identical(os.path.join(root, 'sequential', filename), os.path.join(root, mode, filename))
+                for filename in os.listdir(os.path.join(root, 'sequential'))
+                for mode in ('thread', 'parallel', 'pipeline')
+            )
+            return record
+        finally:
+            globals().update(saved)
+            clear_cache()
+
+def benchmark(sizes=(10000, 100000), output=None, seed=0):
+    """性能测试：在临时目录生成合成词库，分阶段计时并保存 JSON 结果"""
+    import platform
+    import multiprocessing
+    
+    print("=" * 60)
+    print("开始性能测试（合成词库，不会修改实际词库目录）...")
+    print("=" * 60)
+    
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'chunk_size': CHUNK_SIZE,
+        'results': []
+    }
+    
+    for total_lines in sizes:
+        print(f"\n规模: {total_lines} 行")
+        record = benchmark_once(total_lines, seed)
+        report['results'].append(record)
+        phases = record['phases']
+        print(f"  词库: {record['lines']} 行, {record['bytes'] / (1024 * 1024):.2f} MB")
+        print(f"  规则加载: {phases['load_rules']:.3f} 秒, 轻声扩展: {phases['neutral_expand']:.3f} 秒")
+        for mode, result in record['modes'].items():
+            print(f"  {mode}: 总耗时 {result['wall']:.3f} 秒 (文件处理 {result['process_files']:.3f}, "
+                  f"排序 {result['sort']:.3f}, 写出 {result['write']:.3f}) "
+                  f"{result['lines_per_sec']:.0f} 行/秒, {result['mb_per_sec']:.2f} MB/秒"
+                  f"{'' if result['success'] else ' [失败]'}")
+        if not record['outputs_match']:
+            print("  警告：各执行模式的输出不一致")
+    
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {output}")
+    return report
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    import argparse
+    parser = argparse.ArgumentParser(description='万象用户词库修改工具')
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'full', 'watch', 'batch', 'snapshot', 'query', 'benchmark'],
+                        help='run=按配置处理（默认），full=忽略增量清单全部重新处理，watch=常驻监视变化并自动处理，'
+                             'batch=按 --profiles 依次处理多份配置，snapshot=生成词库快照，'
+                             'query=在词库快照中查询词条，benchmark=性能测试')
+    parser.add_argument('--dry-run', action='store_true', help='只预览改动，不写入任何文件')
+    parser.add_argument('--diff', action='store_true', help='预演时输出统一 diff（默认只输出每个文件的改动摘要）')
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='benchmark 使用的合成词库规模（总行数，逗号分隔），默认 10000,100000')
+    parser.add_argument('--output', help='benchmark 结果保存为 JSON 的路径')
+    parser.add_argument('--profiles', help='batch 使用的配置文件（JSON 数组，每项为一份配置，如 {"DICTS_FOLDER": "..."}）')
+    parser.add_argument('--full', action='store_true', help='batch 时忽略增量清单全部重新处理')
+    parser.add_argument('--word', help='query 按词精确查询')
+    parser.add_argument('--char', help='query 查询含有该字的词条')
+    parser.add_argument('--pinyin', help='query 按拼音查询（不区分声调，音节以空格分隔，v 可代替 ü）')
+    parser.add_argument('--code', help='query 按辅助码前缀查询（多字词的辅助码以空格分隔）')
+    parser.add_argument('--limit', type=int, default=50, help='query 最多显示的条数，默认 50')
+    parser.add_argument('--archive', help='run/full 时直接处理该更新包（zip）中的词库：边解压边应用规则，只写出最终文件')
+    parser.add_argument('--metrics', help='把本次运行的各文件耗时、规则命中、进程利用率、峰值内存追加写入该 JSON Lines 文件')
+    return parser.parse_args(argv)
 
 # 替换原来的主程序入口
 if __name__ == "__main__":
+    args = parse_args()
     # 可以选择直接运行性能测试
-    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
-        benchmark()
+    if args.command == 'benchmark':
+        benchmark(sizes=[int(size) for size in args.sizes.split(',') if size.strip()], output=args.output)
+    elif args.command == 'watch':
+        watch()
+    elif args.command == 'snapshot':
+        build_snapshot()
+    elif args.command == 'query':
+        query(word=args.word, char=args.char, pinyin=args.pinyin, code=args.code, limit=args.limit)
+    elif args.command == 'batch':
+        if not args.profiles:
+            print("错误：batch 需要用 --profiles 指定配置文件")
+            sys.exit(2)
+        outcomes = run_profiles(load_profiles(args.profiles), force_full=args.full,
+                                dry_run=args.dry_run, metrics_file=args.metrics)
+        sys.exit(0 if all(outcomes) else 1)
     else:
-        # 或者正常运行
-        main_optimized()
+        # 或者正常运行（full 忽略增量清单）
+        main_optimized(force_full=args.command == 'full', dry_run=args.dry_run or args.diff,
+                       show_diff=args.diff, metrics_file=args.metrics, archive=args.archive)